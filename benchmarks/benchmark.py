@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Time sheldon end-to-end on a generated repository shaped like fw4spl, and compare the timings with a baseline.
+
+The repository has SrcLib libraries and Bundles, each with headers, sources and an XML configuration, and a history of
+commits modifying some of them. A few files have a TAB, a forbidden word or a cppcheck issue, so the hooks also report
+problems. Each hook is timed alone, then all of them together, in the staged, range and --input modes, without the
+results cache and with a cache filled by a previous run. The uncrustify and cppcheck of the shims directory are used, so
+nothing needs to be installed.
+
+Timings are the best of the repeated runs. They are saved with --save-baseline, then each run fails when a timing is
+slower than its baseline by more than the tolerance, or when there is no baseline. Baselines only make sense on the
+machine they were saved on.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SHELDON = os.path.join(BENCHMARKS_DIR, '..', 'hooks', 'sheldon')
+SHIMS_DIR = os.path.join(BENCHMARKS_DIR, 'shims')
+
+HOOKS = ['crlf', 'tab', 'badwords', 'filesize', 'check_xml', 'cppcheck', 'codingstyle']
+MODES = ['staged', 'range', 'input']
+CACHES = ['uncached', 'cached']
+
+LICENSE = """/* ***** BEGIN LICENSE BLOCK *****
+ * FW4SPL - Copyright (C) IRCAD, 2009-%d.
+ * Distributed under the terms of the GNU Lesser General Public License (LGPL) as
+ * published by the Free Software Foundation.
+ * ****** END LICENSE BLOCK ****** */
+""" % datetime.date.today().year
+
+HEADER = """%(license)s
+#pragma once
+
+#include "%(module)s/config.hpp"
+
+namespace %(module)s
+{
+
+class %(export)s_CLASS_API %(name)s
+{
+
+public:
+
+    %(export)s_API %(name)s();
+
+    %(export)s_API int compute(int value) const;
+
+private:
+
+    int m_value;
+};
+
+} // namespace %(module)s
+"""
+
+SOURCE = """%(license)s
+%(includes)s
+
+namespace %(module)s
+{
+
+//------------------------------------------------------------------------------
+
+%(name)s::%(name)s() :
+    m_value(0)
+{
+}
+
+//------------------------------------------------------------------------------
+
+int %(name)s::compute(int value) const
+{
+%(body)s
+}
+
+//------------------------------------------------------------------------------
+
+} // namespace %(module)s
+"""
+
+CONFIG = """<plugin id="%(module)s" class="%(module)s::Plugin" version="@PROJECT_VERSION@">
+    <library name="%(module)s" />
+%(requirements)s
+</plugin>
+"""
+
+
+def git(repo, *args):
+    return subprocess.check_output(['git', '-C', repo] + list(args), stderr=subprocess.STDOUT)
+
+
+# ------------------------------------------------------------------------------
+
+class Generator(object):
+    """Writes the modules of a fw4spl-shaped repository, then modifies their sources"""
+
+    def __init__(self, repo, libs, bundles, classes, seed):
+        self.repo = repo
+        self.classes = classes
+        self.random = random.Random(seed)
+        self.libs = ['fwLib%d' % i for i in range(libs)]
+        self.modules = [('SrcLib/core', name) for name in self.libs]
+        self.modules += [('Bundles/core', 'bundle%d' % i) for i in range(bundles)]
+
+    def body(self, lines):
+        body = ['    std::vector<int> values(%d, value);' % lines]
+        for i in range(lines):
+            body.append('    values[%d] += m_value * %d;' % (i, i))
+
+        # Some files have problems, found by the hooks
+        problem = self.random.random()
+        if problem < 0.05:
+            body.append('\tvalues[0] += 1;')
+        elif problem < 0.08:
+            body.append('    values[0] += 1; // toto')
+        elif problem < 0.10:
+            body.append('    int* array = new int[1];\n    delete[] array;')
+
+        body.append('    return values.back();')
+        return '\n'.join(body)
+
+    def source(self, module, name):
+        # Includes are sorted like sheldon expects, each library apart
+        includes = ['#include "%s/%s.hpp"' % (module, name)]
+        includes += ['#include <%s/Class0.hpp>' % lib
+                     for lib in sorted(self.random.sample(self.libs, min(3, len(self.libs)))) if lib != module]
+        includes += ['#include <vector>']
+
+        return SOURCE % {'license': LICENSE, 'module': module, 'name': name, 'includes': '\n\n'.join(includes),
+                         'body': self.body(self.random.randint(5, 60))}
+
+    def write(self, path, content):
+        path = os.path.join(self.repo, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as output_file:
+            output_file.write(content)
+
+    def generate(self):
+        self.write('LICENSE/COPYING.LESSER', 'GNU LESSER GENERAL PUBLIC LICENSE\n')
+        self.write('CMakeLists.txt', 'cmake_minimum_required(VERSION 3.0)\n')
+
+        for directory, module in self.modules:
+            root = directory + '/' + module + '/'
+            export = module.upper()
+
+            self.write(root + 'CMakeLists.txt', 'fwLoadProperties()\n')
+            self.write(root + 'Properties.cmake', 'set( NAME %s )\nset( TYPE LIBRARY )\n' % module)
+            self.write(root + 'include/%s/config.hpp' % module, LICENSE + '\n#pragma once\n')
+
+            for i in range(self.classes):
+                name = 'Class%d' % i
+                self.write(root + 'include/%s/%s.hpp' % (module, name),
+                           HEADER % {'license': LICENSE, 'module': module, 'name': name, 'export': export})
+                self.write(root + 'src/%s/%s.cpp' % (module, name), self.source(module, name))
+
+            requirements = '\n'.join('    <requirement id="%s" />' % lib
+                                     for lib in self.random.sample(self.libs, min(2, len(self.libs))))
+            self.write(root + 'rc/plugin.xml', CONFIG % {'module': module, 'requirements': requirements})
+
+    def modify(self, count):
+        """rewrite the body of some sources, return their paths"""
+        paths = []
+        for directory, module in self.random.sample(self.modules, min(count, len(self.modules))):
+            name = 'Class%d' % self.random.randrange(self.classes)
+            path = '%s/%s/src/%s/%s.cpp' % (directory, module, module, name)
+            self.write(path, self.source(module, name))
+            paths.append(path)
+        return paths
+
+
+def generate_repository(repo, libs, bundles, classes, commits, staged, seed):
+    git(repo, 'init', '-q')
+    git(repo, 'config', 'user.name', 'Benchmark')
+    git(repo, 'config', 'user.email', 'benchmark@example.com')
+
+    generator = Generator(repo, libs, bundles, classes, seed)
+    generator.generate()
+    git(repo, 'add', '-A')
+    git(repo, 'commit', '-q', '-m', 'feat(benchmark): initial modules')
+    first = git(repo, 'rev-parse', 'HEAD').decode().strip()
+
+    for i in range(commits):
+        generator.modify(3)
+        git(repo, 'add', '-A')
+        git(repo, 'commit', '-q', '-m', 'enh(benchmark): modify sources %d' % i)
+
+    git(repo, 'add', '--', *generator.modify(staged))
+
+    return first
+
+
+# ------------------------------------------------------------------------------
+
+def run_sheldon(repo, args, cache):
+    """return the wall time of a run of sheldon"""
+    env = dict(os.environ, PATH=SHIMS_DIR + os.pathsep + os.environ['PATH'])
+    command = [sys.executable, SHELDON, '--no-daemon'] + ([] if cache == 'cached' else ['--no-cache']) + args
+
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=repo, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    duration = time.perf_counter() - start
+
+    # Problems are expected, crashes are not
+    if b'Traceback' in process.stdout:
+        raise RuntimeError('sheldon %s failed:\n%s' % (' '.join(args), process.stdout.decode(errors='replace')))
+
+    return duration
+
+
+def measure(repo, first, modes, caches, hooks, repeat):
+    mode_args = {
+        'staged': [],
+        'range': [first, 'HEAD'],
+        'input': ['--input', repo],
+    }
+
+    timings = {}
+    for mode in modes:
+        for cache in caches:
+            # Uncached timings keep the name of their mode, like in the baselines saved before the cached ones
+            name = mode if cache == 'uncached' else mode + '-' + cache
+            timings[name] = {}
+            for hook in hooks + ['all']:
+                git(repo, 'config', 'fw4spl-hooks.hooks', ' '.join(HOOKS) if hook == 'all' else hook)
+
+                # The results of the files are stored by a first run, which is not timed
+                if cache == 'cached':
+                    run_sheldon(repo, mode_args[mode], cache)
+
+                timings[name][hook] = min(run_sheldon(repo, mode_args[mode], cache) for _ in range(repeat))
+                print('%-15s %-14s %8.3fs' % (name, hook, timings[name][hook]))
+                sys.stdout.flush()
+
+    return timings
+
+
+def compare(timings, baseline, tolerance, slack):
+    """return the (mode, hook, timing, baseline timing) slower than their baseline"""
+    regressions = []
+    for mode, hooks in sorted(timings.items()):
+        for hook, timing in sorted(hooks.items()):
+            expected = baseline.get(mode, {}).get(hook)
+            if expected is not None and timing > expected * tolerance + slack:
+                regressions.append((mode, hook, timing, expected))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time sheldon on a generated fw4spl-shaped repository.')
+    parser.add_argument('--libs', type=int, default=20, help='Number of SrcLib libraries (default: 20).')
+    parser.add_argument('--bundles', type=int, default=10, help='Number of bundles (default: 10).')
+    parser.add_argument('--classes', type=int, default=10,
+                        help='Number of headers and sources of each library and bundle (default: 10).')
+    parser.add_argument('--commits', type=int, default=20, help='Number of commits of the history (default: 20).')
+    parser.add_argument('--staged', type=int, default=10, help='Number of sources staged (default: 10).')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated contents (default: 0).')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each timing, the best is kept (default: 3).')
+    parser.add_argument('--mode', action='append', choices=MODES, dest='modes',
+                        help='Mode to time, may be repeated (default: all the modes).')
+    parser.add_argument('--cache', action='append', choices=CACHES, dest='caches',
+                        help='Time the runs without the results cache or with a filled one, may be repeated '
+                             '(default: both).')
+    parser.add_argument('--hook', action='append', choices=HOOKS, dest='hooks',
+                        help='Hook to time alone, may be repeated (default: all the hooks).')
+    parser.add_argument('--baseline', default=os.path.join(BENCHMARKS_DIR, 'baseline.json'),
+                        help='Baseline file (default: baseline.json next to this script).')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the timings as the baseline.')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='Ratio to the baseline above which a timing fails (default: 1.25).')
+    parser.add_argument('--slack', type=float, default=0.05,
+                        help='Seconds added to the tolerated timings, for the noise of short runs (default: 0.05).')
+    parser.add_argument('--keep', metavar='DIRECTORY',
+                        help='Generate the repository in DIRECTORY and keep it, instead of a temporary directory.')
+    args = parser.parse_args()
+
+    parameters = {name: getattr(args, name) for name in ('libs', 'bundles', 'classes', 'commits', 'staged', 'seed')}
+
+    # The parent directory is walked for the fw4spl libraries and bundles, it only holds the repository
+    parent = args.keep or tempfile.mkdtemp(prefix='sheldon-benchmark-')
+    repo = os.path.join(parent, 'fw4spl')
+    if os.path.exists(repo):
+        shutil.rmtree(repo)
+    os.makedirs(repo)
+
+    try:
+        first = generate_repository(repo, seed=args.seed, **{name: parameters[name] for name in parameters
+                                                              if name != 'seed'})
+        timings = measure(repo, first, args.modes or MODES, args.caches or CACHES, args.hooks or HOOKS, args.repeat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(parent)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'parameters': parameters, 'timings': timings}, baseline_file, indent=4, sort_keys=True)
+        print('Baseline saved in ' + args.baseline)
+        exit(0)
+
+    # Nothing to compare with must not pass for no regression
+    if not os.path.exists(args.baseline):
+        print('No baseline in %s, save one with --save-baseline.' % args.baseline)
+        exit(2)
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    if baseline['parameters'] != parameters:
+        print('The baseline was saved for another repository: %s' % json.dumps(baseline['parameters'], sort_keys=True))
+        exit(2)
+
+    missing = [(mode, hook) for mode, hooks in sorted(timings.items()) for hook in sorted(hooks)
+               if hook not in baseline['timings'].get(mode, {})]
+    if missing:
+        print('No baseline timing for: %s, save the baseline again with --save-baseline.' %
+              ', '.join(mode + ' ' + hook for mode, hook in missing))
+        exit(2)
+
+    regressions = compare(timings, baseline['timings'], args.tolerance, args.slack)
+    for mode, hook, timing, expected in regressions:
+        print('REGRESSION: %s %s took %.3fs, %.3fs in the baseline (x%.2f)' % (mode, hook, timing, expected,
+                                                                               timing / expected))
+
+    exit(1 if regressions else 0)
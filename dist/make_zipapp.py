@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Build sheldon as a single executable file, to be copied on developer machines.
+
+The archive holds the modules with their bytecode compiled for the python running this script, so nothing is compiled
+when sheldon starts. Another python version falls back to the sources, also stored in the archive. Entries are not
+compressed, to be read without inflating them.
+"""
+
+import argparse
+import glob
+import os
+import py_compile
+import stat
+import tempfile
+import zipfile
+
+HOOKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hooks')
+
+
+def compiled(source_path, name):
+    """return the bytecode of a module, valid whatever the modification time of its source"""
+    with tempfile.TemporaryDirectory() as directory:
+        pyc_path = os.path.join(directory, name + 'c')
+
+        # Before python 3.7, the bytecode holds the modification time of the source, which is kept in the archive
+        options = {}
+        if hasattr(py_compile, 'PycInvalidationMode'):
+            options['invalidation_mode'] = py_compile.PycInvalidationMode.UNCHECKED_HASH
+
+        py_compile.compile(source_path, cfile=pyc_path, dfile=name, doraise=True, **options)
+        with open(pyc_path, 'rb') as pyc_file:
+            return pyc_file.read()
+
+
+def make_zipapp(output, interpreter):
+    # The sheldon script is the entry point of the archive
+    modules = [(os.path.join(HOOKS_DIR, 'sheldon'), '__main__.py')]
+    modules += [(path, os.path.basename(path)) for path in sorted(glob.glob(os.path.join(HOOKS_DIR, '*.py')))]
+
+    data = sorted(glob.glob(os.path.join(HOOKS_DIR, '*.cfg')) + glob.glob(os.path.join(HOOKS_DIR, '*.txt')))
+
+    with open(output, 'wb') as output_file:
+        output_file.write(b'#!' + interpreter.encode() + b'\n')
+
+        with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_STORED) as archive:
+            for path, name in modules:
+                archive.write(path, name)
+                archive.writestr(name + 'c', compiled(path, name))
+
+            for path in data:
+                archive.write(path, os.path.basename(path))
+
+    mode = os.stat(output).st_mode
+    os.chmod(output, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build sheldon as a single executable zipapp.')
+    parser.add_argument('-o', '--output', default='sheldon.pyz', help='Path of the archive (default: sheldon.pyz).')
+    parser.add_argument('-p', '--python', default='/usr/bin/env python3',
+                        help='Interpreter of the archive (default: /usr/bin/env python3).')
+    args = parser.parse_args()
+
+    make_zipapp(args.output, args.python)
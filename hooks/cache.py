@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Persistent cache of hook results, keyed by file content.
+
+The cache is stored in the git common directory, so it is shared by all the worktrees of a repository.
+
+.gitconfig configuration :
+
+[fw4spl-hooks]
+    cache = true
+    cache-size = 67108864
+
+Available options are :
+cache : enable or disable the results cache - default to true
+cache-size : maximum size of the cache in bytes, least recently used results are evicted first - default to 64MB
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import common
+import profiling
+
+# Configuration sections which may change the results of a hook
+CONFIG_SECTIONS = ('fw4spl-hooks', 'forbidtoken-hook', 'forbidtoken-hooks', 'filesize-hook', 'codingstyle-hook',
+                   'cppcheck-hook')
+
+g_sources_hash = None
+
+
+# ------------------------------------------------------------------------------
+
+class ResultCache(object):
+    """Content-addressed store of hook results, with a least recently used eviction"""
+
+    def __init__(self, path, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        # sqlite handles the locking, so the cache can be used concurrently from several worktrees. Each write is a
+        # transaction of its own, so other runs are never locked out for long, and cheap with the write-ahead log.
+        self.db = sqlite3.connect(path, timeout=30)
+        try:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+        except sqlite3.Error as e:
+            common.trace('Cannot use the write-ahead log of the results cache: ' + str(e))
+
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS results '
+                            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+
+        # Results reused, marked as recently used all at once when closing
+        self.used = []
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        try:
+            row = self.db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            common.trace('Cannot read the results cache: ' + str(e))
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.used.append(key)
+        return json.loads(row[0])
+
+    def put(self, key, record):
+        value = json.dumps(record)
+
+        try:
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                                (key, value, len(value), time.time()))
+        except sqlite3.Error as e:
+            common.trace('Cannot write in the results cache: ' + str(e))
+
+    def evict(self):
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+        # Remove the least recently used results until the cache fits in its budget
+        for key, size in self.db.execute('SELECT key, size FROM results ORDER BY used').fetchall():
+            if total <= self.max_size:
+                break
+            self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+            total -= size
+
+    def close(self):
+        try:
+            with self.db:
+                now = time.time()
+                self.db.executemany('UPDATE results SET used = ? WHERE key = ?', [(now, key) for key in self.used])
+                self.evict()
+        except sqlite3.Error as e:
+            common.warn('Cannot save the results cache: ' + str(e))
+        self.db.close()
+
+
+# ------------------------------------------------------------------------------
+
+def open_cache(repo):
+    if common.get_option('fw4spl-hooks.cache', default='true', type='--bool') != 'true' or not repo.common_dir:
+        return None
+
+    max_size = int(common.get_option('fw4spl-hooks.cache-size', default=64 * 1024 ** 2))
+    directory = os.path.join(repo.common_dir, 'sheldon')
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        return ResultCache(os.path.join(directory, 'results.db'), max_size)
+    except (OSError, sqlite3.Error) as e:
+        common.warn('Cannot open the results cache: ' + str(e))
+        return None
+
+
+# ------------------------------------------------------------------------------
+
+# Hash of sheldon itself and of its data files (uncrustify.cfg, ...), so any change invalidates the cache
+def sources_hash():
+    global g_sources_hash
+
+    if g_sources_hash is None:
+        sha1 = hashlib.sha1()
+        directory = os.path.dirname(os.path.abspath(__file__))
+
+        # When sheldon runs from a zipapp, the archive holds everything
+        paths = [directory] if os.path.isfile(directory) else []
+        for pattern in ('*.py', '*.cfg', '*.txt'):
+            paths += sorted(glob.glob(os.path.join(directory, pattern)))
+
+        # The script itself, which gives the hooks their options and the keys of their results
+        if os.path.isfile(os.path.join(directory, 'sheldon')):
+            paths.append(os.path.join(directory, 'sheldon'))
+
+        for path in paths:
+            with open(path, 'rb') as source_file:
+                sha1.update(source_file.read())
+        g_sources_hash = sha1.hexdigest()
+
+    return g_sources_hash
+
+
+# ------------------------------------------------------------------------------
+
+def config_key():
+    return sorted((k, v) for k, v in common.config().values.items() if k.split('.')[0] in CONFIG_SECTIONS)
+
+
+# ------------------------------------------------------------------------------
+
+# Run the check of a single file, in this process or in a worker, and return its result with its messages.
+# When timed, the resources used are returned too, as they are not known by the profile of the main process.
+def _run_file(check, f, timed=False):
+    usage = profiling.Usage() if timed else None
+
+    with common.capture() as messages:
+        result = check(f)
+
+    record = {
+        'result': result,
+        'messages': messages
+    }
+
+    if usage is not None:
+        record['usage'] = usage.stop()
+
+    return record
+
+
+# Run a hook, reusing the results stored in the cache if there is one for the check of each of its files. The hook
+# reports the results of its checks itself, given in the order of its files by the each(check, files) function it is
+# called with, so its messages are the same as when it checks its files in turn.
+# The key function returns what the result depends on for a given file, its content first.
+# Files are dispatched to the pool of processes if given, and their messages are replayed in the order of the files.
+# Files are not checked anymore once stop() is true, if given.
+# Return the result of the hook.
+def run_hook(results_cache, name, hook, files, file_key, pool=None, stop=None):
+    hook_key = [name, sources_hash(), config_key()]
+    profile = profiling.g_profile
+    settings = common.worker_settings() if pool is not None else None
+
+    def start(check, f):
+        # Return the key to store the result with, and the result or the future computing it
+        key = results_cache.key(hook_key, file_key(f)) if results_cache is not None else None
+        record = results_cache.get(key) if results_cache is not None else None
+
+        # Contents are not sent to the workers, they load them again
+        if pool is not None:
+            f.release()
+
+        if profile is not None and results_cache is not None:
+            profile.cached(name, record is not None)
+
+        if record is not None:
+            common.trace('Using cached "' + name + '" result for ' + f.path)
+            return None, record
+        elif pool is not None:
+            return key, pool.submit(common.run_in_worker, settings, _run_file, check, f, profile is not None)
+        else:
+            return key, _run_file(check, f, profile is not None)
+
+    def finish(key, record, path):
+        # Resources used are only reported, not cached
+        usage = record.pop('usage', None)
+        if usage is not None:
+            if pool is not None:
+                profile.remote(name, path, usage)
+            else:
+                profile.file(name, path, usage[0], usage[1])
+
+        # Traces depend on the options of the run, not on the file
+        if key is not None:
+            results_cache.put(key, dict(record, messages=[m for m in record['messages'] if m[0] != 'trace']))
+
+        common.replay(record['messages'])
+        return record['result']
+
+    def each(check, checked):
+        # Contents are read ahead and released once the result of each file is known, unless workers read them
+        if pool is None:
+            for f in common.prefetch(list(checked)):
+                if stop is not None and stop():
+                    break
+                yield f, finish(*start(check, f), path=f.path)
+            return
+
+        pending = []
+        for f in checked:
+            if stop is not None and stop():
+                break
+            pending.append((f,) + start(check, f))
+
+        # Wait for the workers in the order of the files
+        for i, (f, key, record) in enumerate(pending):
+            yield f, finish(key, record if isinstance(record, dict) else record.result(), f.path)
+
+            # Stopping after the last result would take a completed check as interrupted
+            if stop is not None and i + 1 < len(pending) and stop():
+                for _, _, rest in pending[i + 1:]:
+                    if not isinstance(rest, dict):
+                        rest.cancel()
+                break
+
+    return hook(files, each=each)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python2
 # -*- coding: UTF-8 -*-
 
+import os
 import re
 
 import common
@@ -43,6 +44,18 @@ def commit_in_path(old_path=None, new_path=None):
         return command_result.out.decode().split('\n')
 
 
+# return the messages of the commits of a push, the ones reachable from the revisions but from no ref yet, None if
+# they cannot be listed
+def commit_in_push(revisions):
+    command_result = common.execute_command('git log --pretty=format:%h:%aE:%s ' + ' '.join(revisions) +
+                                            ' --not --all')
+
+    if command_result.status != 0:
+        return None
+    else:
+        return command_result.out.decode().splitlines()
+
+
 # check the title conformance against commitizen/angularjs/... rules
 def __check_commit_title(commit_hash, commit_title):
     # Test the title against regex
@@ -59,6 +72,8 @@ def __check_commit_title(commit_hash, commit_title):
             + "' with title '"
             + commit_title
             + "' does not follow Sheldon rules: '<" + "|".join(TYPES) + ">(<scope>): <subject>'.")
+        common.diagnostic('check_commit', None, None, 'error',
+                          "Title of commit '" + commit_hash + "' does not follow '<type>(<scope>): <subject>'")
 
     return title_have_not_matched
 
@@ -77,10 +92,25 @@ def __check_commit_author(commit_hash, commit_author):
             "Commit '"
             + commit_hash
             + "' has anonymous author.")
+        common.diagnostic('check_commit', None, None, 'error', "Commit '" + commit_hash + "' has anonymous author")
 
     return author_have_matched
 
 
+# check a file containing a commit message, like the one given to the commit-msg hook, None if it does not exist
+def check_commit_message_file(path):
+    common.note("Checking commit message in: " + path)
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as commit_message_file:
+        commit_message = commit_message_file.read()
+    print(commit_message)
+
+    return __check_commit_title("None", commit_message)
+
+
 def check_commit_messages(commit_messages):
     results = [False]
 
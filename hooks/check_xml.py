@@ -178,22 +178,33 @@ def check_unused_service(config_tree):
     return err
 
 
-def check_xml(files):
+# Return True if a XML file has errors, reported on their own
+def check_file(f):
+    common.trace('Checking ' + str(f.path) + ' syntax...')
+    try:
+        tree = xml_parser(f.text)
+        msg = check_configurations(tree)
+        if msg:
+            common.error('XML parsing error in ' + f.path + ' :\n' + msg)
+            for line in msg.splitlines():
+                common.diagnostic('check_xml', f.path, None, 'error', line.lstrip('- '))
+            return True
+    except ET.ParseError as err:
+        # Errors outside the changed lines are not reported
+        if not f.changed_line(err.position[0]):
+            return False
+        common.error('XML parsing error in ' + f.path + ' :\n' + err.msg + '\n')
+        common.diagnostic('check_xml', f.path, err.position[0], 'error', err.msg.split('\n')[0])
+        return True
+
+    return False
+
+
+def check_xml(files, each=common.each_file):
     abort = False
 
-    for f in files:
-        if f.path.lower().endswith(('.xml', '.xsd')):
-            content = f.contents
-            common.trace('Checking ' + str(f.path) + ' syntax...')
-            try:
-                tree = xml_parser(content.decode())
-                msg = check_configurations(tree)
-                if msg:
-                    common.error('XML parsing error in ' + f.path + ' :\n' + msg)
-                    abort = True
-            except ET.ParseError as err:
-                common.error('XML parsing error in ' + f.path + ' :\n' + err.msg + '\n')
-                abort = True
+    for f, error in each(check_file, (f for f in files if f.path.lower().endswith(('.xml', '.xsd')))):
+        abort = error or abort
 
     return abort
 
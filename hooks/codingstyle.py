@@ -27,6 +27,7 @@ additional-projects : additional fw4spl repositories paths used to sort includes
 
 """
 
+import functools
 import os
 import re
 from fnmatch import fnmatch
@@ -36,7 +37,7 @@ import sortincludes
 from common import FormatReturn
 
 SEPARATOR = '%s\n' % ('-' * 79)
-FILEWARN = lambda x: ('  - %s') % os.path.relpath(x, common.get_repo_root())
+FILEWARN = lambda x: ('  - %s') % os.path.relpath(x, common.worktree_root())
 UNCRUSTIFY_PATH = 'uncrustify'
 BACKUP_LIST_FILE = 'backupList'
 
@@ -49,84 +50,143 @@ LICENSE = '/\* \*\*\*\*\* BEGIN LICENSE BLOCK \*\*\*\*\*\n\
 
 # ------------------------------------------------------------------------------
 
-def codingstyle(files, enable_reformat, check_lgpl, check_commits_date):
-    source_patterns = common.get_option('codingstyle-hook.source-patterns', default='*.cpp *.cxx *.c').split()
-    header_patterns = common.get_option('codingstyle-hook.header-patterns', default='*.hpp *.hxx *.h').split()
-    misc_patterns = common.get_option('codingstyle-hook.misc-patterns', default='*.cmake *.txt *.xml *.json').split()
+# Report a problem of a file to the structured output, fix telling if reformatting fixes it
+def report(path, message, fix):
+    common.diagnostic('codingstyle', os.path.relpath(path, common.worktree_root()), None, 'error', message, fix)
 
-    code_patterns = source_patterns + header_patterns
-    include_patterns = code_patterns + misc_patterns
 
-    sort_includes = common.get_option('codingstyle-hook.sort-includes', default="true", type='--bool') == "true"
+# ------------------------------------------------------------------------------
+
+def fw4spl_projects():
+    repo_root = common.get_repo_root()
 
-    global repoRoot
-    repoRoot = common.get_repo_root()
+    # Without a working tree, the modules of the repository are read from the checked commits
+    from_trees = common.g_checked_revisions is not None
 
-    if repoRoot is None:
-        common.warn("Cannot find 'fw4spl' repository structure")
+    if not repo_root:
+        if not from_trees:
+            common.warn("Cannot find 'fw4spl' repository structure")
         parent_repo = ""
     else:
-        parent_repo = os.path.abspath(os.path.join(repoRoot, os.pardir))
+        parent_repo = os.path.abspath(os.path.join(repo_root, os.pardir))
 
     fw4spl_configured_projects = common.get_option('codingstyle-hook.additional-projects', default=None)
     fw4spl_projects = []
 
     if fw4spl_configured_projects is None:
         # no additional-projects specified in config file. Default is parent repository folder
-        fw4spl_projects.append(parent_repo)
+        if parent_repo or not from_trees:
+            fw4spl_projects.append(parent_repo)
     else:
         fw4spl_projects = fw4spl_configured_projects.split(";")
         # adds current repository folder to the additional-projects specified in config file.
-        fw4spl_projects.append(repoRoot)
+        if not from_trees:
+            fw4spl_projects.append(repo_root)
         # normalize pathname
         fw4spl_projects = list(map(os.path.normpath, fw4spl_projects))
         # remove duplicates
         fw4spl_projects = list(set(fw4spl_projects))
 
-    global UNCRUSTIFY_PATH
+    return fw4spl_projects
+
+
+# ------------------------------------------------------------------------------
 
+def find_uncrustify():
     if common.g_uncrustify_path_arg is not None and len(common.g_uncrustify_path_arg) > 0:
-        UNCRUSTIFY_PATH = common.g_uncrustify_path_arg
-    else:
-        UNCRUSTIFY_PATH = common.get_option('codingstyle-hook.uncrustify-path', default=UNCRUSTIFY_PATH,
-                                            type='--path').strip()
+        return common.g_uncrustify_path_arg
+
+    return common.get_option('codingstyle-hook.uncrustify-path', default=UNCRUSTIFY_PATH, type='--path').strip()
+
+
+# ------------------------------------------------------------------------------
+
+# Return what the hook results depend on, besides the checked file and the git configuration
+def cache_key():
+    sortincludes.find_libraries_and_bundles(fw4spl_projects(), common.g_checked_revisions)
+    # Library and bundle names are bytes, keys are JSON
+    return [common.tool_version(find_uncrustify(), '-v'), [lib.decode() for lib in sortincludes.g_libs],
+            [bundle.decode() for bundle in sortincludes.g_bundles]]
+
+
+# ------------------------------------------------------------------------------
+
+# Check or reformat a file of the repository, return a FormatReturn value, None if it is not checked.
+# The tools and the libraries and bundles found by the main process are given for the workers.
+def check_file(f, enable_reformat, check_lgpl, check_commits_date, sort_includes, patterns, uncrustify_path, projects):
+    global UNCRUSTIFY_PATH
+    UNCRUSTIFY_PATH = uncrustify_path
+    sortincludes.find_libraries_and_bundles(projects, common.g_checked_revisions)
+
+    code_patterns, header_patterns, misc_patterns = patterns
+    binary = f.binary
+
+    # The file may be rewritten below, do not keep it mapped
+    f.release()
+
+    if binary:
+        return None
+
+    # Do this last because contents of the file will be modified by uncrustify
+    # Thus the variable content will no longer reflect the real content of the file
+    file_path = os.path.join(common.worktree_root(), f.path)
+    if not os.path.isfile(file_path):
+        return None
+
+    return format_file(file_path, enable_reformat, code_patterns, header_patterns, misc_patterns, check_lgpl,
+                       sort_includes, f.status, check_commits_date)
+
+
+def codingstyle(files, enable_reformat, check_lgpl, check_commits_date, each=common.each_file):
+    source_patterns = common.get_option('codingstyle-hook.source-patterns', default='*.cpp *.cxx *.c').split()
+    header_patterns = common.get_option('codingstyle-hook.header-patterns', default='*.hpp *.hxx *.h').split()
+    misc_patterns = common.get_option('codingstyle-hook.misc-patterns', default='*.cmake *.txt *.xml *.json').split()
+
+    code_patterns = source_patterns + header_patterns
+    include_patterns = code_patterns + misc_patterns
+
+    sort_includes = common.get_option('codingstyle-hook.sort-includes', default="true", type='--bool') == "true"
+
+    global UNCRUSTIFY_PATH
+    UNCRUSTIFY_PATH = find_uncrustify()
 
     common.note('Using uncrustify: ' + UNCRUSTIFY_PATH)
 
-    if common.execute_command(UNCRUSTIFY_PATH + ' -v -q').status != 0:
+    if common.tool_version(UNCRUSTIFY_PATH, '-v') is None:
         common.error('Failed to launch uncrustify.\n')
+        common.diagnostic('codingstyle', None, None, 'error', 'Failed to launch ' + UNCRUSTIFY_PATH)
         return []
 
-    checked = set()
-
     reformatted_list = []
-    sortincludes.find_libraries_and_bundles(fw4spl_projects)
+    projects = fw4spl_projects()
+    sortincludes.find_libraries_and_bundles(projects, common.g_checked_revisions)
+
+    def selected():
+        checked = set()
+        for f in files:
+            if f not in checked and any(f.fnmatch(p) for p in include_patterns):
+                checked.add(f)
+                yield f
+
+    check = functools.partial(check_file, enable_reformat=enable_reformat, check_lgpl=check_lgpl,
+                              check_commits_date=check_commits_date, sort_includes=sort_includes,
+                              patterns=(code_patterns, header_patterns, misc_patterns),
+                              uncrustify_path=UNCRUSTIFY_PATH, projects=projects)
 
     ret = False
     count = 0
     reformat_count = 0
-    for f in files:
-        if f in checked or not any(f.fnmatch(p) for p in include_patterns):
+    for f, res in each(check, selected()):
+        if res is None:
             continue
 
-        content = f.contents
-        if not common.binary(content):
-
-            # Do this last because contents of the file will be modified by uncrustify
-            # Thus the variable content will no longer reflect the real content of the file
-            file_path = os.path.join(repoRoot, f.path)
-            if os.path.isfile(file_path):
-                res = format_file(file_path, enable_reformat, code_patterns, header_patterns, misc_patterns, check_lgpl,
-                                  sort_includes, f.status, check_commits_date)
-                count += 1
-                if res == FormatReturn.Modified:
-                    reformatted_list.append(f.path)
-                    reformat_count += 1
-                elif res == FormatReturn.Error:
-                    # Error in reformatting
-                    ret = True
-
-        checked.add(f)
+        count += 1
+        if res == FormatReturn.Modified:
+            reformatted_list.append(f.path)
+            reformat_count += 1
+        elif res == FormatReturn.Error:
+            # Error in reformatting
+            ret = True
 
     common.note('%d file(s) checked, %d file(s) reformatted.' % (count, reformat_count))
 
@@ -143,7 +203,7 @@ def format_file(source_file, enable_reformat, code_patterns, header_patterns, mi
     if any(fnmatch(source_file, p) for p in code_patterns):
 
         common.trace('Launching uncrustify on : ' + source_file)
-        config_file = os.path.join(os.path.dirname(__file__), 'uncrustify.cfg')
+        config_file = os.path.join(common.data_dir(), 'uncrustify.cfg')
 
         ret = FormatReturn()
 
@@ -170,6 +230,7 @@ def format_file(source_file, enable_reformat, code_patterns, header_patterns, mi
                 if uncrustify.status != 0:
                     common.error('Uncrustify failure on file: ' + source_file)
                     common.error(uncrustify.out.decode())
+                    report(source_file, 'Uncrustify failure: ' + uncrustify.out.decode().strip(), False)
                     return FormatReturn.Error
                 ret.add(FormatReturn.Modified)
         else:
@@ -177,6 +238,7 @@ def format_file(source_file, enable_reformat, code_patterns, header_patterns, mi
 
             if uncrustify.status != 0:
                 common.error('Uncrustify failure on file: ' + source_file)
+                report(source_file, 'Code is not formatted according to uncrustify.cfg', True)
                 return FormatReturn.Error
 
         return ret.value
@@ -209,13 +271,15 @@ def fix_license_year(path, enable_reformat, status, check_commits_date):
 
     common.trace('Checking for LGPL license in: ' + path)
 
-    YEAR = common.get_file_datetime(path, check_commits_date).year
+    # Resolving the file date may require git, so only do it when there is a license year to compare it with
+    file_year = lambda: common.get_file_datetime(path, check_commits_date).year
 
     # Look for the license pattern
     licence_number = len(re.findall(LICENSE, content, re.MULTILINE))
     if licence_number > 1:
 
         common.error("There should be just one licence header per file in :" + FILEWARN(path) + ".")
+        report(path, 'There should be just one licence header per file', False)
         return FormatReturn.Error
 
     elif licence_number < 1:
@@ -223,7 +287,7 @@ def fix_license_year(path, enable_reformat, status, check_commits_date):
         if enable_reformat:
 
             lic = LICENSE
-            lic = lic.replace("(.*)", "%s" % YEAR)
+            lic = lic.replace("(.*)", "%s" % file_year())
             lic = lic.replace("\\", "")
 
             with open(path, 'wb') as source_file:
@@ -237,6 +301,7 @@ def fix_license_year(path, enable_reformat, status, check_commits_date):
         else:
 
             common.error("There should be at least one licence header per file in :" + FILEWARN(path) + ".")
+            report(path, 'There should be at least one licence header per file', True)
             return FormatReturn.Error
 
     # Here, it has only one occurrences that must be checked
@@ -246,8 +311,11 @@ def fix_license_year(path, enable_reformat, status, check_commits_date):
     LICENSE_YEAR_RANGE = r"(.*)FW4SPL - Copyright \(C\) IRCAD, ([0-9]+)-([0-9]+)."
 
     # Check date
-    if re.search(LICENSE_YEAR_RANGE, content):
+    match = re.search(LICENSE_YEAR_RANGE, content)
+
+    if match:
 
+        YEAR = file_year()
         LICENSE_YEAR_REPLACE = r"\1FW4SPL - Copyright (C) IRCAD, \2-" + str(YEAR) + "."
         str_new_file = re.sub(LICENSE_YEAR_RANGE, LICENSE_YEAR_REPLACE, content)
 
@@ -257,6 +325,7 @@ def fix_license_year(path, enable_reformat, status, check_commits_date):
 
         if match:
 
+            YEAR = file_year()
             if status == 'A' or match.group(2) == str(YEAR):
 
                 LICENSE_YEAR_REPLACE = r"\1FW4SPL - Copyright (C) IRCAD, " + str(YEAR) + "."
@@ -269,6 +338,7 @@ def fix_license_year(path, enable_reformat, status, check_commits_date):
         else:
 
             common.error('Licence year format in : ' + FILEWARN(path) + ' is not correct.')
+            report(path, 'Licence year format is not correct', False)
             return FormatReturn.Error
 
     if str_new_file != content:
@@ -283,6 +353,7 @@ def fix_license_year(path, enable_reformat, status, check_commits_date):
         else:
 
             common.error('Licence year in : ' + FILEWARN(path) + ' is not up-to-date.')
+            report(path, 'Licence year is not up-to-date', True)
             return FormatReturn.Error
 
     return FormatReturn.NotModified
@@ -342,6 +413,7 @@ def fix_header_guard(path, enable_reformat):
         else:
 
             common.error("Old style of header guard found : " + match2.group(0) + "in file : " + FILEWARN(path) + ".")
+            report(path, 'Old style of header guard found: ' + match2.group(0).strip(), True)
             ret.add(FormatReturn.Error)
             return ret.value
 
@@ -350,6 +422,7 @@ def fix_header_guard(path, enable_reformat):
     if pragma_number > 1:
 
         common.error("There should be just one '#pragma once' per file in :" + FILEWARN(path) + ".")
+        report(path, "There should be just one '#pragma once' per file", False)
         ret.add(FormatReturn.Error)
         return ret.value
 
@@ -374,6 +447,7 @@ def fix_header_guard(path, enable_reformat):
         else:
 
             common.error("There should be at least one '#pragma once' per file in :" + FILEWARN(path) + ".")
+            report(path, "There should be at least one '#pragma once' per file", True)
             ret.add(FormatReturn.Error)
             return ret.value
 
@@ -401,6 +475,7 @@ def fix_header_guard(path, enable_reformat):
         common.error(
             ("Unexpected : '%s' befor #pragma once in :" % re.search("^.+$", out, re.MULTILINE).group(0)) + FILEWARN(
                 path) + ".")
+        report(path, "Unexpected '%s' before #pragma once" % re.search("^.+$", out, re.MULTILINE).group(0), False)
         ret.add(FormatReturn.Error)
         return ret.value
 
@@ -428,6 +503,8 @@ def fix_header_guard(path, enable_reformat):
 
             common.error("Needed : '#pragma once', actual : '" + re.search(pragma_once, content, re.DOTALL).group(
                 0) + "' in file :" + FILEWARN(path) + ".")
+            report(path, "Needed '#pragma once', actual '" + re.search(pragma_once, content, re.DOTALL).group(0) + "'",
+                   True)
             ret.add(FormatReturn.Error)
             return ret.value
 
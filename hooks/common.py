@@ -1,17 +1,44 @@
 #!/usr/bin/env python3
 # -*- coding: UTF-8 -*-
 
+import atexit
+import bisect
 import collections
+import contextlib
 # From command line arguments
 import datetime
 import fnmatch
+import functools
+import mmap
 import os
 import re
 import subprocess
+import threading
+import zlib
+
+import gitrepo
+
+# hashlib, shutil and tempfile are imported where they are used, the commit-msg hook only needs to print messages
 
 g_trace = False
 g_cppcheck_path_arg = None
 g_uncrustify_path_arg = None
+g_blob_reader = None
+# Blobs may be read from the prefetch thread and from the hooks
+g_blob_lock = threading.Lock()
+g_captured = None
+# Writer of the structured diagnostics, None when only the text report is wanted
+g_diagnostics = None
+# Errors reported, and paths of the files with an error diagnostic
+g_errors = 0
+g_failed_paths = set()
+g_tool_versions = {}
+g_git_repositories = {}
+g_snapshot_root = None
+# Commits checked from the object database only, their trees replace the working tree
+g_checked_revisions = None
+# Process the worker settings were applied in
+g_worker_pid = None
 
 
 class FormatReturn:
@@ -27,39 +54,334 @@ class FormatReturn:
 
 
 class FileAtIndex(object):
-    def __init__(self, contents, size, mode, sha1, status, path):
-        self.contents = contents
+    __slots__ = ('size', 'mode', 'sha1', 'status', 'path', 'changed', '_buffer', '_loader', '_binary', '_text',
+                 '_line_offsets')
+
+    def __init__(self, contents, size, mode, sha1, status, path, loader=None):
+        self._buffer = contents
+        self._loader = loader
+        self._binary = None
+        self._text = None
+        self._line_offsets = None
         self.size = size
         self.mode = mode
         self.sha1 = sha1
         self.status = status
         self.path = path
+        # Sorted (first, last) intervals of the lines to check, None to check the whole file
+        self.changed = None
+
+    @property
+    def buffer(self):
+        """raw contents, as bytes or as a read-only mmap, loaded on first access"""
+        if self._buffer is None and self._loader is not None:
+            self._buffer = self._loader()
+        return self._buffer
+
+    @property
+    def contents(self):
+        buffer = self.buffer
+        if buffer is None:
+            return b''
+        return buffer if isinstance(buffer, bytes) else buffer[:]
+
+    @property
+    def binary(self):
+        """true if the file is binary data, computed once"""
+        if self._binary is None:
+            self._binary = binary(self.buffer or b'')
+        return self._binary
+
+    @property
+    def text(self):
+        """decoded contents, shared by all hooks"""
+        if self._text is None:
+            self._text = self.contents.decode()
+        return self._text
+
+    @property
+    def line_offsets(self):
+        """offsets in text of the start of each line"""
+        if self._line_offsets is None:
+            self._line_offsets = [0] + [m.end() for m in re.finditer('\n', self.text)]
+        return self._line_offsets
+
+    def line_number(self, offset):
+        """return the number, starting from 1, of the line containing an offset of text"""
+        return bisect.bisect_right(self.line_offsets, offset)
+
+    def line(self, number):
+        """return the text of a line, with its end of line"""
+        offsets = self.line_offsets
+        end = offsets[number] if number < len(offsets) else len(self.text)
+        return self.text[offsets[number - 1]:end]
+
+    def changed_line(self, number):
+        """true if a line, starting from 1, has to be checked"""
+        if self.changed is None:
+            return True
+        i = bisect.bisect_right(self.changed, (number, float('inf')))
+        return i > 0 and self.changed[i - 1][1] >= number
+
+    def regions(self):
+        """return the start and end offsets in text of the lines to check"""
+        if self.changed is None:
+            return [(0, len(self.text))]
+
+        offsets = self.line_offsets
+        end = lambda number: offsets[number] if number < len(offsets) else len(self.text)
+        return [(offsets[first - 1], end(last)) for first, last in self.changed if first <= len(offsets)]
+
+    def release(self):
+        """drop the loaded contents, they will be loaded again on next access"""
+        self._text = None
+        self._line_offsets = None
+        if self._loader is None:
+            return
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = None
+
+    def __getstate__(self):
+        # Sent to worker processes, which load the contents again when they can
+        contents = None if self._loader is not None else self.contents
+        return (contents, self.size, self.mode, self.sha1, self.status, self.path, self._loader, self._binary,
+                self.changed)
+
+    def __setstate__(self, state):
+        self.__init__(*state[:7])
+        self._binary = state[7]
+        self.changed = state[8]
 
     def fnmatch(self, pattern):
         basename = os.path.basename(self.path)
         return fnmatch.fnmatch(basename, pattern)
 
 
+def worker_settings():
+    """return the global settings needed by worker processes"""
+    return g_trace, g_cppcheck_path_arg, g_uncrustify_path_arg, g_snapshot_root, g_checked_revisions
+
+
+def init_worker(settings):
+    """initialize a worker process, which must not share the git processes nor the locks of its parent"""
+    global g_trace, g_cppcheck_path_arg, g_uncrustify_path_arg, g_snapshot_root, g_checked_revisions
+    global g_blob_reader, g_blob_lock, g_captured, g_diagnostics
+
+    g_trace, g_cppcheck_path_arg, g_uncrustify_path_arg, g_snapshot_root, g_checked_revisions = settings
+    g_blob_reader = None
+    g_blob_lock = threading.Lock()
+    g_captured = None
+    g_diagnostics = None
+
+
+def run_in_worker(settings, function, *args):
+    """run a function in a worker process, initialized with the settings of the main process on its first task"""
+    global g_worker_pid, g_trace, g_cppcheck_path_arg, g_uncrustify_path_arg, g_snapshot_root, g_checked_revisions
+
+    if g_worker_pid != os.getpid():
+        init_worker(settings)
+        g_worker_pid = os.getpid()
+    else:
+        # The snapshot directory changes when pushed blobs sharing a path are checked
+        g_trace, g_cppcheck_path_arg, g_uncrustify_path_arg, g_snapshot_root, g_checked_revisions = settings
+
+    return function(*args)
+
+
+def forget_run_state():
+    """forget what depends on the state of the repository or on a previous run, keeping the configuration, the tool
+    versions and the git readers, for a daemon serving several runs"""
+    global g_blob_reader, g_blob_lock, g_captured, g_diagnostics, g_commit_date_index, g_status_index, g_snapshot_root
+    global g_errors, g_checked_revisions
+
+    g_repo_contexts.clear()
+    g_blob_reader = None
+    g_blob_lock = threading.Lock()
+    g_captured = None
+    g_diagnostics = None
+    g_errors = 0
+    g_failed_paths.clear()
+    g_commit_date_index = None
+    g_status_index = None
+    g_snapshot_root = None
+    g_checked_revisions = None
+
+
+def _output(level, line):
+    global g_errors
+
+    if g_captured is not None:
+        g_captured.append((level, line))
+    elif level == 'diagnostic':
+        if line[1] is not None and line[3] == 'error':
+            g_failed_paths.add(line[1])
+        if g_diagnostics is not None:
+            g_diagnostics.write(Diagnostic(*line))
+    else:
+        if level == 'error':
+            g_errors += 1
+        print(line)
+
+
+@contextlib.contextmanager
+def capture():
+    """collect (level, line) messages in the yielded list instead of printing them"""
+    global g_captured
+
+    previous = g_captured
+    g_captured = []
+    try:
+        yield g_captured
+    finally:
+        g_captured = previous
+
+
+def each_file(check, files):
+    """yield each file with the result of check on it, for hooks checking their files in turn"""
+    for f in files:
+        yield f, check(f)
+
+
+def replay(messages):
+    for level, line in messages:
+        _output(level, line)
+
+
 def note(msg):
-    print(('* [Sheldon] ' + msg))
+    _output('note', '* [Sheldon] ' + msg)
 
 
 def trace(msg):
     if g_trace:
-        print(('* [Sheldon] ' + msg))
+        _output('trace', '* [Sheldon] ' + msg)
 
 
 def error(msg):
-    print(('*** [ERROR] ' + msg + ' ***'))
+    _output('error', '*** [ERROR] ' + msg + ' ***')
 
 
 def warn(msg):
-    print(('* [Warning] ' + msg + ' *'))
+    _output('warn', '* [Warning] ' + msg + ' *')
+
+
+# A problem found by a hook. path is relative to the repository root and line starts at 1, both may be None.
+# severity is 'error', 'warning' or 'note', fix is True when 'sheldon -f' can fix it.
+Diagnostic = collections.namedtuple('Diagnostic', 'hook, path, line, severity, message, fix')
+
+
+def diagnostic(hook, path, line, severity, message, fix=False):
+    """report a problem to the structured output, in addition to the text messages of the hook"""
+    # Captured as a list, like it is stored in the results cache
+    _output('diagnostic', [hook, path, line, severity, message, fix])
+
+
+# Like git, only the start of the contents is searched for a NUL byte
+BINARY_SNIFF_SIZE = 8000
 
 
 def binary(s):
     """return true if a string is binary data"""
-    return b'\0' in s
+    return b'\0' in s[:BINARY_SNIFF_SIZE]
+
+
+def _check_attributes(paths):
+    """return the binary, diff and text attributes of paths as {path: {attribute: value}}, with a single git call"""
+    process = subprocess.Popen(['git', 'check-attr', '-z', '--stdin', 'binary', 'diff', 'text'],
+                               cwd=get_repo_root() or None,
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    out, err = process.communicate(b''.join(path.encode() + b'\0' for path in paths))
+
+    if process.returncode != 0:
+        trace('Cannot read git attributes: ' + err.decode().strip())
+        return {}
+
+    # Records are "<path>\0<attribute>\0<value>\0"
+    records = out.split(b'\0')
+    attributes = collections.defaultdict(dict)
+
+    for i in range(0, len(records) - 2, 3):
+        attributes[records[i].decode()][records[i + 1].decode()] = records[i + 2].decode()
+
+    return attributes
+
+
+def classify_binary(files):
+    """set the binary flag of files from their git attributes, so their contents are not read to guess it.
+    Files without attributes are guessed from their contents when needed."""
+    attributes = _check_attributes([f.path for f in files])
+
+    for f in files:
+        values = attributes.get(f.path, {})
+
+        # 'binary' is a macro for '-diff -merge -text'
+        if values.get('binary') == 'set' or values.get('diff') == 'unset':
+            f._binary = True
+        elif values.get('text') == 'set' or values.get('diff') == 'set':
+            f._binary = False
+
+
+# Files read by sheldon or by the tools it launches, next to the modules
+DATA_FILES = ('uncrustify.cfg', 'func_impl_separator.txt', 'std_headers.txt')
+
+g_data_dir = None
+
+
+def data_dir():
+    """return the directory of the data files. When sheldon runs from a zipapp, they are extracted once in the user
+    cache directory, in a directory named after their contents"""
+    global g_data_dir
+
+    if g_data_dir is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+
+        if os.path.isdir(directory):
+            g_data_dir = directory
+        else:
+            contents = [__loader__.get_data(os.path.join(directory, name)) for name in DATA_FILES]
+            cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            g_data_dir = os.path.join(cache_dir, 'sheldon', blob_sha1(b''.join(contents)))
+
+            if not os.path.isdir(g_data_dir):
+                # Written aside and renamed, so concurrent runs never see partial files
+                extracted = g_data_dir + '.%d' % os.getpid()
+                os.makedirs(extracted)
+                for name, content in zip(DATA_FILES, contents):
+                    with open(os.path.join(extracted, name), 'wb') as data_file:
+                        data_file.write(content)
+                try:
+                    os.rename(extracted, g_data_dir)
+                except OSError:
+                    # Extracted by another run meanwhile
+                    import shutil
+
+                    shutil.rmtree(extracted, True)
+
+    return g_data_dir
+
+
+def blob_sha1(data):
+    """return the sha1 git would give to a blob with this content"""
+    import hashlib
+
+    sha1 = hashlib.sha1(b'blob %d\0' % len(data))
+    sha1.update(data)
+    return sha1.hexdigest()
+
+
+def tool_version(path, option='--version'):
+    """return the version string of an external tool, None if it cannot be launched.
+    Each tool is only launched once per run"""
+    if (path, option) not in g_tool_versions:
+        try:
+            out = subprocess.check_output([path, option], stderr=subprocess.STDOUT)
+            g_tool_versions[(path, option)] = out.decode(errors='replace').strip()
+        except (subprocess.CalledProcessError, OSError):
+            g_tool_versions[(path, option)] = None
+
+    return g_tool_versions[(path, option)]
 
 
 ExecutionResult = collections.namedtuple(
@@ -68,41 +390,284 @@ ExecutionResult = collections.namedtuple(
 )
 
 
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+
+class RepoContext(collections.namedtuple('RepoContext', 'root, git_dir, common_dir, head, lgpl')):
+    """Repository information resolved once per run"""
+    __slots__ = ()
+
+    @classmethod
+    def load(cls):
+        context = cls._load_in_process()
+        if context is not None:
+            return context
+
+        process = subprocess.Popen(['git', 'rev-parse', '--absolute-git-dir', '--git-common-dir', '--show-toplevel'],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        out, err = process.communicate()
+
+        # The top level is missing in bare repositories, the whole output outside of a repository
+        lines = out.decode().splitlines()
+
+        if len(lines) < 2:
+            warn(err.decode().strip())
+            return cls('', '', '', None, False)
+
+        git_dir = lines[0]
+        common_dir = os.path.abspath(lines[1])
+        root = lines[2] if len(lines) > 2 else ''
+
+        head = execute_command('git rev-parse -q --verify HEAD')
+        head = head.out.strip().decode() if head.status == 0 else None
+
+        lgpl = os.path.isfile(os.path.join(root, "LICENSE/COPYING.LESSER"))
+
+        return cls(root, git_dir, common_dir, head, lgpl)
+
+    @classmethod
+    def _load_in_process(cls):
+        # Find the repository without launching git, for the common layouts only
+        if get_option('fw4spl-hooks.git-backend', default='auto') == 'git':
+            return None
+
+        found = gitrepo.discover(os.getcwd())
+        if found is None:
+            return None
+
+        root, git_dir, common_dir = found
+
+        try:
+            repository = g_git_repositories.get(git_dir) or gitrepo.Repository(git_dir, common_dir)
+            head = repository.read_ref('HEAD')
+        except (gitrepo.GitError, OSError) as e:
+            trace('Using git commands: ' + str(e))
+            return None
+
+        g_git_repositories[git_dir] = repository
+        lgpl = os.path.isfile(os.path.join(root, "LICENSE/COPYING.LESSER"))
+
+        return cls(root, git_dir, common_dir, head, lgpl)
+
+    @property
+    def base(self):
+        """return the commit to compare the index with, the empty tree if there is no commit yet"""
+        return self.head if self.head is not None else EMPTY_TREE
+
+
+g_repo_contexts = {}
+
+
+def repo_context():
+    """return the context of the repository of the current directory, resolved only once"""
+    cwd = os.getcwd()
+
+    if cwd not in g_repo_contexts:
+        g_repo_contexts[cwd] = RepoContext.load()
+
+    return g_repo_contexts[cwd]
+
+
 def get_repo_root():
-    result = execute_command('git rev-parse --show-toplevel')
+    return repo_context().root
 
-    if result.status == 0:
-        return result.out.strip().decode()
 
-    warn(result.out.decode())
-    return ""
+def worktree_root():
+    """return the directory of the files checked by external tools, a snapshot of the blobs when checking from the
+    object database only"""
+    return g_snapshot_root or get_repo_root()
 
 
-def is_LGPL_repo():
-    repo_root = get_repo_root()
-    try:
-        f = open(os.path.join(repo_root, "LICENSE/COPYING.LESSER"))
-        f.close()
-        return True
-    except:
-        return False
+def write_snapshot(files):
+    """write the contents of the files in a temporary directory, used instead of the working tree"""
+    import shutil
+    import tempfile
 
+    global g_snapshot_root
 
-def _get_git_commit_datetime(path):
-    # Get the git modification date of the file
-    result = execute_command('git log -1 --format=%ad --date=format:%Y-%m-%dT%H:%M:%S ' + path)
+    # The snapshot is nested in a private directory, so its parent does not look like other projects
+    parent = tempfile.mkdtemp(prefix='sheldon-')
+    atexit.register(shutil.rmtree, parent, True)
+    root = os.path.join(parent, 'snapshot')
 
-    if result.status != 0:
-        warn(result.out.decode())
-        return None
+    for f in prefetch(files):
+        path = os.path.join(root, f.path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as snapshot_file:
+            snapshot_file.write(f.buffer or b'')
 
-    try:
-        # Parse the string back to a datetime object
-        return datetime.datetime.strptime(result.out.decode().strip(), '%Y-%m-%dT%H:%M:%S')
-    except Exception as e:
-        warn(e.message)
+    g_snapshot_root = root
+    return root
+
+
+def tree_paths(revisions):
+    """return the sorted paths of the files of some commits"""
+    repository = git_repository()
+    paths = set()
+
+    if repository is not None:
+        try:
+            for rev in revisions:
+                paths.update(repository.flatten_tree(repository.tree_of(rev)))
+            return sorted(paths)
+        except (gitrepo.GitError, OSError, ValueError, zlib.error) as e:
+            trace('Using git commands: ' + str(e))
+            paths.clear()
+
+    for rev in revisions:
+        result = execute_command('git ls-tree -r -z --name-only ' + rev)
+        if result.status != 0:
+            warn('Cannot list the files of ' + rev + ': ' + result.out.decode(errors='replace').strip())
+            continue
+        paths.update(path.decode() for path in result.out.split(b'\0') if path)
+
+    return sorted(paths)
+
+
+def file_in_rev(rev, path):
+    """return True if a file exists in a commit"""
+    repository = git_repository()
+
+    if repository is not None:
+        try:
+            return repository.tree_entry(repository.tree_of(rev), path) is not None
+        except (gitrepo.GitError, OSError, ValueError, zlib.error) as e:
+            trace('Using git commands: ' + str(e))
+
+    return execute_command('git cat-file -e ' + rev + ':' + path).status == 0
+
+
+def git_repository():
+    """return the in-process reader of the current repository, None if git commands must be used instead"""
+    # Like the objects of a push, kept in a quarantine directory until it is accepted. Checked on each call, as a
+    # daemon serves callers with different environments.
+    if gitrepo.overridden():
         return None
 
+    context = repo_context()
+
+    if context.git_dir not in g_git_repositories:
+        repository = None
+
+        if context.git_dir and get_option('fw4spl-hooks.git-backend', default='auto') != 'git':
+            try:
+                repository = gitrepo.Repository(context.git_dir, context.common_dir)
+            except (gitrepo.GitError, OSError) as e:
+                trace('Using git commands: ' + str(e))
+
+        g_git_repositories[context.git_dir] = repository
+
+    return g_git_repositories[context.git_dir]
+
+
+def is_LGPL_repo():
+    return repo_context().lgpl
+
+
+def _read_records(stream, separator=b'\0'):
+    # Yield the records of a stream as soon as they are available, without reading it whole
+    pending = b''
+
+    for chunk in iter(lambda: stream.read1(65536), b''):
+        records = (pending + chunk).split(separator)
+        pending = records.pop()
+
+        for record in records:
+            yield record
+
+    if pending:
+        yield pending
+
+
+class CommitDateIndex(object):
+    """Last commit date of files, resolved with a single 'git log' pass for all the registered files"""
+
+    DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+    def __init__(self, revs=('HEAD',)):
+        # The newest commit of all of them is taken for a path
+        self.revs = list(revs)
+        self.dates = {}
+        self.pending = set()
+
+    def add(self, paths):
+        """register paths relative to the repository root, their dates will be resolved together"""
+        self.pending.update(p for p in paths if p not in self.dates)
+
+    def _load(self):
+        pending = self.pending
+        self.pending = set()
+
+        # Paths are read from stdin after '--', so there is no limit on their number
+        process = subprocess.Popen(['git', '--literal-pathspecs', 'log', '--stdin', '--name-only', '-z',
+                                    '--format=%x01%ad', '--date=format:' + self.DATE_FORMAT] + self.revs,
+                                   cwd=get_repo_root() or None,
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL)
+
+        # Write from another thread, git may block writing its output before reading all the paths
+        writer = threading.Thread(target=self._write_paths, args=(process.stdin, pending))
+        writer.start()
+
+        # Commits are listed from the newest, so the first date seen for a path is its last commit date.
+        # Output is "\x01<date>\0\n<path>\0<path>\0" for each commit.
+        date = None
+        for record in _read_records(process.stdout):
+            if record.startswith(b'\x01'):
+                date = datetime.datetime.strptime(record[1:].decode(), self.DATE_FORMAT)
+                continue
+
+            path = record.lstrip(b'\n').decode()
+            if path in pending:
+                self.dates[path] = date
+                pending.discard(path)
+
+                # Stop as soon as everything is found instead of walking the whole history
+                if not pending:
+                    process.kill()
+                    break
+
+        process.stdout.close()
+        writer.join()
+        process.wait()
+
+        # Files without any commit
+        for path in pending:
+            self.dates[path] = None
+
+    @staticmethod
+    def _write_paths(stdin, paths):
+        try:
+            stdin.write(b'--\n' + b''.join(p.encode() + b'\n' for p in paths))
+            stdin.close()
+        except OSError:
+            pass
+
+    def datetime(self, path):
+        """return the last commit date of a file, None if it has never been committed"""
+        path = os.path.relpath(os.path.abspath(path), worktree_root() or os.getcwd())
+
+        if path not in self.dates:
+            self.pending.add(path)
+            self._load()
+
+        return self.dates[path]
+
+
+g_commit_date_index = None
+
+
+def commit_date_index():
+    global g_commit_date_index
+
+    if g_commit_date_index is None:
+        # Without a working tree, HEAD is not the checked commit
+        g_commit_date_index = CommitDateIndex(g_checked_revisions or ['HEAD'])
+
+    return g_commit_date_index
+
 
 def get_file_datetime(path, check_commits_date):
     try:
@@ -115,7 +680,7 @@ def get_file_datetime(path, check_commits_date):
         modification_time = None
 
     if check_commits_date:
-        git_datetime = _get_git_commit_datetime(path)
+        git_datetime = commit_date_index().datetime(path)
 
         # Use git modification time if it is valid and creation_time == modification_time
         if git_datetime is not None:
@@ -141,199 +706,785 @@ def execute_command(proc):
 
 
 def current_commit():
-    if execute_command('git rev-parse --verify HEAD').status != 0:
-        return '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
-    else:
-        return 'HEAD'
+    return repo_context().base
 
 
-def get_option(option, default, type=""):
-    try:
-        out = subprocess.check_output(('git config ' + type + ' ' + option).split()).strip()
-        return out.decode()
-    except subprocess.CalledProcessError:
-        return default
+class ConfigSnapshot(object):
+    """Whole effective git configuration, read once with 'git config -z --list'"""
 
+    BOOLEANS = {
+        'true': 'true', 'yes': 'true', 'on': 'true', '1': 'true',
+        'false': 'false', 'no': 'false', 'off': 'false', '0': 'false', '': 'false',
+    }
 
-def _contents(sha):
-    result = execute_command('git show ' + sha)
+    def __init__(self):
+        self.values = {}
+        self.reload()
 
-    if result.status == 0:
-        return result.out
+    def reload(self):
+        values = {}
 
-    warn(result.out.decode())
-    return ""
+        try:
+            out = subprocess.check_output(['git', 'config', '-z', '--list'], stderr=subprocess.DEVNULL)
+        except (subprocess.CalledProcessError, OSError):
+            out = b''
 
+        # Each entry is "<key>\n<value>\0", or "<key>\0" for a key without value.
+        # The last value wins for multi-valued keys, like with 'git config <key>'
+        for entry in out.split(b'\0'):
+            if entry:
+                key, separator, value = entry.decode().partition('\n')
+                values[key] = value if separator else None
 
-def _diff_index(rev):
-    result = execute_command('git diff-index --cached -z --diff-filter=AM ' + rev)
+        self.values = values
 
-    if result.status == 0:
-        return result.out
+    @staticmethod
+    def _key(option):
+        # Section and variable names are case insensitive, but not subsection names
+        section, _, remainder = option.partition('.')
+        subsection, dot, name = remainder.rpartition('.')
+        return section.lower() + '.' + subsection + dot + name.lower()
 
-    warn(result.out.decode())
-    return ""
+    def get(self, option, default, type=""):
+        key = self._key(option)
 
+        if key not in self.values:
+            return default
 
-def _diff(rev, rev2):
-    result = execute_command('git diff --raw -z --diff-filter=AM ' + rev + ' ' + rev2)
+        value = self.values[key]
 
-    if result.status == 0:
-        return result.out
+        if type == '--bool':
+            # A key without value means true
+            if value is None:
+                return 'true'
+            try:
+                return 'true' if int(value) != 0 else 'false'
+            except ValueError:
+                return self.BOOLEANS.get(value.lower(), default)
 
-    warn(result.out.decode())
-    return ""
+        if value is None:
+            return ''
 
+        if type == '--path':
+            return os.path.expanduser(value)
+
+        return value
+
+
+g_config = None
+
+
+def config():
+    global g_config
+
+    if g_config is None:
+        g_config = ConfigSnapshot()
+
+    return g_config
+
+
+def reload_config():
+    """Read the git configuration again, for long-lived processes"""
+    config().reload()
+
+
+def get_option(option, default, type=""):
+    return config().get(option, default, type)
+
+
+class BlobReader(object):
+    """Stream blobs from a 'git cat-file --batch' process kept open for the whole run"""
+
+    def __init__(self):
+        self.process = None
+
+    def _request(self, sha):
+        # Return the size of the object, its contents being the next bytes of the stream, None on failure
+        if self.process is None:
+            self.process = subprocess.Popen(['git', 'cat-file', '--batch'],
+                                            stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE)
 
-def _size(sha):
-    result = execute_command('git cat-file -s ' + sha)
-    if result.status == 0:
         try:
-            return int(result.out)
-        except ValueError:
+            self.process.stdin.write(sha.encode() + b'\n')
+            self.process.stdin.flush()
+
+            # "<sha> <type> <size>\n" or "<sha> missing\n"
+            header = self.process.stdout.readline().split()
+        except (OSError, ValueError) as e:
+            warn('Cannot read object ' + sha + ': ' + str(e))
+            self.close()
+            return None
+
+        if len(header) != 3:
+            warn('Cannot read object ' + sha + ': ' + b' '.join(header[1:]).decode())
+            return None
+
+        return int(header[2])
+
+    def size(self, sha):
+        """return the size of the given object, 0 if it cannot be found"""
+        size = self._request(sha)
+
+        if size is None:
             return 0
 
-    warn(result.out.decode())
-    return 0
+        # The contents follow the header, they are skipped by chunks without keeping them
+        remaining = size + 1
+        while remaining > 0:
+            chunk = self.process.stdout.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+
+        return size
+
+    def read(self, sha):
+        """return a (size, contents) tuple for the given object, (0, b'') if it cannot be read"""
+        size = self._request(sha)
+
+        if size is None:
+            return 0, b''
+
+        contents = self.process.stdout.read(size)
+
+        # Skip the trailing LF
+        self.process.stdout.read(1)
+
+        return size, contents
+
+    def close(self):
+        if self.process is None:
+            return
+
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        process.stdout.close()
+        process.wait()
+
+
+def blob_reader():
+    global g_blob_reader
+
+    if g_blob_reader is None:
+        g_blob_reader = BlobReader()
+        atexit.register(g_blob_reader.close)
+
+    return g_blob_reader
+
+
+def _read_blob(sha):
+    repository = git_repository()
+
+    with g_blob_lock:
+        if repository is not None and len(sha) == 40:
+            try:
+                return repository.read_blob(sha)
+            except (gitrepo.GitError, OSError, ValueError, zlib.error) as e:
+                trace('Reading ' + sha + ' with git: ' + str(e))
+
+        return blob_reader().read(sha)[1]
+
+
+def _blob_size(sha):
+    repository = git_repository()
 
+    with g_blob_lock:
+        if repository is not None and len(sha) == 40:
+            try:
+                return repository.object_size(sha)
+            except (gitrepo.GitError, OSError, ValueError, zlib.error) as e:
+                trace('Reading ' + sha + ' with git: ' + str(e))
 
-def files_in_rev(rev, rev2=''):
+        return blob_reader().size(sha)
+
+
+def _map_file(path):
+    # Map the file instead of reading it, so only the pages actually used are loaded
+    with open(path, 'rb') as content_file:
+        if os.fstat(content_file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(content_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+DiffEntry = gitrepo.DiffEntry
+
+
+def _parse_raw_diff(records):
+    """yield the entries of a raw diff, given as the NUL separated records of a '-z --no-abbrev' output"""
     # see: git help diff-index
     # "RAW OUTPUT FORMAT" section
-    diff_row_regex = re.compile(
-        b'''
-        :
-        (?P<old_mode>[^ ]+)
-        [ ]
-        (?P<new_mode>[^ ]+)
-        [ ]
-        (?P<old_sha1>[^ ]+)...
-        [ ]
-        (?P<new_sha1>[^ ]+)...
-        [ ]
-        (?P<status>[^\0]+)
-        \0
-        (?P<path>[^\0]+)
-        \0
-        ''',
-        re.X
-    )
-
-    for match in diff_row_regex.finditer(_diff(rev, rev2)):
-        mode, sha, status, path = match.group(
-            'new_mode', 'new_sha1', 'status', 'path'
-        )
+    records = iter(records)
 
-        if status is None or status == 'D':
-            continue
+    for header in records:
+        old_mode, new_mode, old_sha1, new_sha1, status = header.lstrip(b':').decode().split(' ')
+        path = old_path = next(records).decode()
 
-        # Try to guest if the file has been deleted in a later commit
-        file_status = status_of_file(get_repo_root() + '/' + path.decode())
+        # Renames and copies are followed by the source and destination paths, and a similarity score
+        if status[0] in 'RC':
+            path = next(records).decode()
+
+        yield DiffEntry(old_mode, new_mode, old_sha1, new_sha1, status[0], path, old_path)
+
+
+def _stream_raw_diff(command):
+    """yield the entries of a raw diff as git outputs them, without keeping the whole output"""
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    complete = False
+
+    try:
+        for entry in _parse_raw_diff(_read_records(process.stdout)):
+            yield entry
+        complete = True
+    finally:
+        # git is stopped if the entries are not all consumed
+        process.stdout.close()
+        err = process.stderr.read()
+
+        if process.wait() != 0 and complete:
+            warn(err.decode())
+
+
+HUNK_HEADER = re.compile(rb'@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def _unquote_path(path):
+    # Paths with special characters are quoted by git like C strings
+    if path.startswith(b'"'):
+        import codecs
+        path = codecs.escape_decode(path[1:-1])[0]
+    return path.decode()
+
+
+def _parse_hunks(lines):
+    """return the (first, last) intervals of the lines added or modified in each file, given the lines of a
+    '-U0 --no-prefix' diff"""
+    index = {}
+    intervals = None
+    # Lines of the current hunk still to skip, they may look like headers
+    body = 0
+
+    for line in lines:
+        if body > 0:
+            if not line.startswith(b'\\'):
+                body -= 1
+        elif line.startswith(b'+++ '):
+            path = line[4:].rstrip(b'\n')
+
+            # Paths with a space end with a TAB, for patch. A TAB in a path would be quoted.
+            if path.endswith(b'\t'):
+                path = path[:-1]
+
+            intervals = index.setdefault(_unquote_path(path), []) if path != b'/dev/null' else None
+        elif line.startswith(b'@@ '):
+            removed, first, added = HUNK_HEADER.match(line).groups()
+            removed = 1 if removed is None else int(removed)
+            added = 1 if added is None else int(added)
+            body = removed + added
+
+            # Lines only removed leave nothing to check
+            if added > 0 and intervals is not None:
+                intervals.append((int(first), int(first) + added - 1))
+
+    return index
+
+
+def changed_lines(rev, rev2='', cached=False):
+    """return the intervals of the lines added or modified in each file, from the hunks of a single 'git diff'"""
+    command = ['git', '-c', 'core.quotepath=off', 'diff', '-U0', '--no-prefix', '--no-color', '--no-ext-diff'] + \
+        _diff_options() + (['--cached'] if cached else []) + [rev] + ([rev2] if rev2 else [])
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    index = _parse_hunks(process.stdout)
+    err = process.stderr.read()
+
+    if process.wait() != 0:
+        warn(err.decode())
+
+    return index
+
+
+def _detect_renames():
+    return get_option('fw4spl-hooks.renames', default='true', type='--bool') == 'true'
+
+
+def _exact_renames(entries):
+    """pair the deleted and added files with the same contents, like the exact renames found by 'git diff -M'"""
+    deleted = collections.defaultdict(list)
+
+    for entry in entries:
+        if entry.status == 'D':
+            deleted[entry.old_sha1].append(entry)
+
+    paired = []
+
+    for entry in entries:
+        if entry.status == 'A' and deleted.get(entry.new_sha1):
+            source = deleted[entry.new_sha1].pop(0)
+            paired.append(DiffEntry(source.old_mode, entry.new_mode, source.old_sha1, entry.new_sha1, 'R', entry.path,
+                                    source.path))
+        elif entry.status != 'D':
+            paired.append(entry)
+
+    return paired + [entry for sources in deleted.values() for entry in sources]
+
+
+def _in_process_diff(function, *args):
+    repository = git_repository()
+
+    if repository is None:
+        return None
+
+    try:
+        entries = list(function(repository, *args))
+    except (gitrepo.GitError, OSError, ValueError, zlib.error) as e:
+        trace('Using git commands: ' + str(e))
+        return None
+
+    if _detect_renames():
+        entries = _exact_renames(entries)
+
+        # Files renamed and modified can only be paired by the similarity detection of git
+        statuses = set(entry.status for entry in entries)
+        if 'A' in statuses and 'D' in statuses:
+            trace('Using git commands to detect renames')
+            return None
+
+        return [entry for entry in entries if entry.status in ('A', 'M', 'R')]
+
+    return [entry for entry in entries if entry.status in ('A', 'M')]
+
+
+def _diff_options():
+    return ['-M', '--diff-filter=AMRC'] if _detect_renames() else ['--no-renames', '--diff-filter=AM']
+
+
+def _diff_index(rev):
+    entries = _in_process_diff(gitrepo.Repository.diff_index, rev)
+
+    if entries is not None:
+        return entries
+
+    return _stream_raw_diff(['git', 'diff-index', '--cached', '-z', '--no-abbrev'] + _diff_options() + [rev])
+
+
+def _diff(rev, rev2):
+    # Differences with the working tree need git
+    if rev2:
+        entries = _in_process_diff(lambda repository: repository.diff_trees(repository.tree_of(rev),
+                                                                            repository.tree_of(rev2)))
+        if entries is not None:
+            return entries
 
-        if file_status is None or file_status == 'D':
+    return _stream_raw_diff(['git', 'diff', '--raw', '-z', '--no-abbrev'] + _diff_options() + [rev] +
+                            ([rev2] if rev2 else []))
+
+
+def _checked_entries(entries):
+    for entry in entries:
+        # Submodules are listed by git but cannot be checked
+        if entry.new_mode == '160000':
             continue
 
-        content = _contents(sha.decode())
+        if entry.status in ('R', 'C'):
+            # Files moved without modification were already checked under their previous name
+            if entry.old_sha1 == entry.new_sha1:
+                trace('Skipping ' + entry.path + ', renamed from ' + entry.old_path + ' without modification')
+                continue
+
+            # Otherwise they are checked like modified files
+            entry = entry._replace(status='M')
+
+        yield entry
+
 
-        if content is None or len(content) <= 0:
+def _deleted_files():
+    """return a function telling if a file has been deleted since, from the index when it can be read"""
+    root = get_repo_root()
+    repository = git_repository()
+
+    if repository is not None:
+        try:
+            indexed = {entry.path: (entry.mode, entry.sha1) for entry in repository.read_index() if entry.stage == 0}
+            head = repository.read_ref('HEAD')
+            head_tree = repository.tree_of(head) if head is not None else None
+        except (gitrepo.GitError, OSError, ValueError, zlib.error) as e:
+            trace('Using git commands: ' + str(e))
+        else:
+            def deleted(path):
+                # Like the 'D' status of git: deleted from the index of HEAD, or only from the working tree. Files
+                # added or modified then deleted from the working tree ('AD', 'MD') are still committed, and files
+                # removed by a later commit are unknown to git status.
+                if path in indexed and os.path.lexists(root + '/' + path):
+                    return False
+                entry = repository.tree_entry(head_tree, path) if head_tree is not None else None
+                return entry is not None and entry == indexed.get(path, entry)
+
+            return deleted
+
+    statuses = status_index()
+    return lambda path: statuses.status(root + '/' + path) in (None, 'D')
+
+
+def files_in_rev(rev, rev2='', worktree=True):
+    # Without a working tree, the files are checked as they are in rev2
+    deleted = _deleted_files() if worktree else lambda path: False
+
+    for entry in _checked_entries(_diff(rev, rev2)):
+        # Try to guest if the file has been deleted in a later commit
+        if deleted(entry.path):
             continue
 
-        size = _size(sha.decode())
+        size = _blob_size(entry.new_sha1)
 
-        if size is None or size <= 0:
+        if size <= 0:
             continue
 
         yield FileAtIndex(
-            content,
+            None,
             size,
-            mode.decode(),
-            sha.decode(),
-            status.decode(),
-            path.decode()
+            entry.new_mode,
+            entry.new_sha1,
+            entry.status,
+            entry.path,
+            loader=functools.partial(_read_blob, entry.new_sha1)
         )
 
 
 def files_staged_for_commit(rev):
-    # see: git help diff-index
-    # "RAW OUTPUT FORMAT" section
-    diff_index_row_regex = re.compile(
-        b'''
-        :
-        (?P<old_mode>[^ ]+)
-        [ ]
-        (?P<new_mode>[^ ]+)
-        [ ]
-        (?P<old_sha1>[^ ]+)
-        [ ]
-        (?P<new_sha1>[^ ]+)
-        [ ]
-        (?P<status>[^\0]+)
-        \0
-        (?P<path>[^\0]+)
-        \0
-        ''',
-        re.X
-    )
-    diff_idx = _diff_index(rev)
-    for match in diff_index_row_regex.finditer(diff_idx):
-        mode, sha, status, path = match.group(
-            'new_mode', 'new_sha1', 'status', 'path'
-        )
+    entries = _diff_index(rev)
+    deleted = _deleted_files()
 
+    for entry in _checked_entries(entries):
         # Try to guest if the file has been deleted in a later commit
-        file_status = status_of_file(get_repo_root() + '/' + path.decode())
-
-        if status is not None and status != 'D' and file_status is not None and file_status != 'D':
+        if not deleted(entry.path):
             yield FileAtIndex(
-                _contents(sha.decode()),
-                _size(sha.decode()),
-                mode.decode(),
-                sha.decode(),
-                status.decode(),
-                path.decode()
+                None,
+                _blob_size(entry.new_sha1),
+                entry.new_mode,
+                entry.new_sha1,
+                entry.status,
+                entry.path,
+                loader=functools.partial(_read_blob, entry.new_sha1)
             )
 
 
-def status_of_file(path):
-    # By default status is set to 'A' like it is a new file.
-    # if the git status is '??' or empty, we guess also that the file is a new file.
-    status = 'A'
-    gitstatus = execute_command('git status --porcelain ' + path)
+def pushed_revisions(lines):
+    """return the new revisions of the ref updates given to a pre-receive hook, as '<old> <new> <ref>' lines"""
+    revisions = []
 
-    if gitstatus.status != 0:
-        warn("File : " + path + " is not in a git repository, sheldon will consider it like a new file")
-    else:
-        out = gitstatus.out.split()
+    for line in lines:
+        fields = line.split()
+
+        # Deleted refs have a null new revision, nothing to check
+        if len(fields) == 3 and fields[1].strip('0') and fields[1] not in revisions:
+            revisions.append(fields[1])
+
+    return revisions
+
+
+def _git_output(command, input=None):
+    """return the output of a git command, None if it fails"""
+    process = subprocess.Popen(command, stdin=subprocess.PIPE if input is not None else None, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    out, err = process.communicate(input)
+
+    if process.returncode != 0:
+        warn(err.decode().strip() or ' '.join(command[:2]) + ' failed')
+        return None
+
+    return out
+
+
+def _parse_batch(out):
+    """yield the (sha, data) of the objects of a 'git cat-file --batch' output"""
+    pos = 0
+    while pos < len(out):
+        header_end = out.index(b'\n', pos)
+        sha, _, size = out[pos:header_end].decode().split(' ')
+        yield sha, out[header_end + 1:header_end + 1 + int(size)]
+        pos = header_end + 1 + int(size) + 1
+
+
+def files_pushed(revisions):
+    """return each blob reachable from the revisions but from no ref yet, once, under the path of its first use.
+    Return None if the objects cannot be listed."""
+    if not revisions:
+        return []
+
+    # rev-list lists every object once, cat-file keeps the path after the object name as the rest of the line
+    objects = _git_output(['git', 'rev-list', '--objects'] + revisions + ['--not', '--all'])
+    if objects is None:
+        return None
+
+    types = _git_output(['git', 'cat-file', '--batch-check=%(objecttype) %(objectname) %(objectsize) %(rest)'], objects)
+    if types is None:
+        return None
+
+    blobs = []
+    trees = []
+    for line in types.decode().splitlines():
+        object_type, sha, size, path = line.split(' ', 3)
+
+        if object_type == 'tree':
+            trees.append(sha)
+        elif object_type == 'blob':
+            blobs.append((sha, int(size), path))
+
+    # A new blob is always in a new tree, which tells its mode
+    contents = _git_output(['git', 'cat-file', '--batch'], ''.join(sha + '\n' for sha in trees).encode())
+    if contents is None:
+        return None
+
+    modes = {}
+    for tree, data in _parse_batch(contents):
+        for mode, sha in gitrepo.parse_tree(data).values():
+            modes.setdefault(sha, mode)
+
+    files = []
+    for sha, size, path in blobs:
+        # Symbolic links have nothing to check, and empty blobs neither
+        if modes.get(sha) not in (0o100644, 0o100755) or size <= 0:
+            continue
+
+        # Whether the file is new cannot be told from a blob, it is checked as a modified one
+        files.append(FileAtIndex(None, size, '%06o' % modes[sha], sha, 'M', path,
+                                 loader=functools.partial(_read_blob, sha)))
+
+    return files
+
+
+class StatusIndex(object):
+    """Snapshot of 'git status --porcelain -z', mapping absolute paths to their status"""
 
-        # if out is not empty and not equal to '??' so we have modified a tracked file.
-        if out and out[0] != '??':
-            status = out[0]
+    def __init__(self, root):
+        self.root = os.path.normpath(os.path.abspath(root))
+        self.statuses = {}
+        self.in_repository = False
+        self._load()
 
-    return status
+    def _load(self):
+        directory = self.root if os.path.isdir(self.root) else os.path.dirname(self.root)
+
+        try:
+            toplevel = subprocess.check_output(['git', '-C', directory, 'rev-parse', '--show-toplevel'],
+                                               stderr=subprocess.STDOUT).strip().decode()
+
+            # Untracked files are not listed since they are considered as new files anyway
+            out = subprocess.check_output(['git', '-C', directory, 'status', '--porcelain', '-z',
+                                           '--untracked-files=no', '--', self.root],
+                                          stderr=subprocess.STDOUT)
+        except (subprocess.CalledProcessError, OSError):
+            warn("Path : " + self.root + " is not in a git repository, sheldon will consider its files like new files")
+            return
+
+        self.in_repository = True
+
+        # Each entry is "XY <path>\0", followed by "<original path>\0" for renames and copies
+        entries = iter(out.split(b'\0'))
+        for entry in entries:
+            if len(entry) < 4:
+                continue
+
+            status = entry[:2].decode().strip()
+            path = os.path.normpath(os.path.join(toplevel, entry[3:].decode()))
+            self.statuses[path] = status
+
+            if status[0] in 'RC':
+                next(entries, None)
+
+    def covers(self, path):
+        path = os.path.normpath(os.path.abspath(path))
+        return path == self.root or path.startswith(os.path.join(self.root, ''))
+
+    def changed(self, path):
+        return os.path.normpath(os.path.abspath(path)) in self.statuses
+
+    def status(self, path):
+        # By default status is set to 'A' like it is a new file.
+        # if the file is untracked or not modified, we guess also that the file is a new file.
+        return self.statuses.get(os.path.normpath(os.path.abspath(path)), 'A')
+
+
+g_status_index = None
+
+
+def status_index(root=None):
+    """return a status snapshot covering root (the repository by default), taking a new one only if needed"""
+    global g_status_index
+
+    if root is None:
+        root = get_repo_root() or os.getcwd()
+
+    if g_status_index is None or not g_status_index.covers(root):
+        g_status_index = StatusIndex(root)
+
+    return g_status_index
+
+
+def status_of_file(path):
+    return status_index(os.path.dirname(os.path.abspath(path))).status(path)
 
 
-def file_on_disk(path):
+def file_on_disk(path, mode='', sha1=''):
     status = status_of_file(path)
 
     if status is not None and status != 'D':
-        with open(path, 'rb') as content_file:
-            content = content_file.read()
-
         stat = os.stat(path)
         size = stat.st_size
 
         yield FileAtIndex(
-            content,
+            None,
             size,
-            '',
-            '',
+            mode,
+            sha1,
             status,
-            path
+            path,
+            loader=functools.partial(_map_file, path)
         )
 
 
+def _walk_directory(path):
+    # Yield (path, mode, sha1) for all files, skipping hidden directories and CMake build trees
+    try:
+        entries = list(os.scandir(path))
+    except OSError as e:
+        warn(str(e))
+        return
+
+    if any(entry.name == 'CMakeCache.txt' for entry in entries):
+        trace('Skipping build directory: ' + path)
+        return
+
+    for entry in entries:
+        if entry.is_dir():
+            if not entry.name.startswith('.'):
+                yield from _walk_directory(entry.path)
+        elif entry.is_file():
+            yield entry.path, '', ''
+
+
+def _list_directory(path):
+    # Yield (path, mode, sha1) for all tracked and untracked files which are not ignored.
+    # The index sha1 is only given for files that are not modified in the working tree.
+    try:
+        out = subprocess.check_output(['git', 'ls-files', '-z', '--cached', '--others', '--exclude-standard', '-s'],
+                                      cwd=path,
+                                      stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, OSError):
+        out = b''
+
+    statuses = status_index(path)
+    listed = set()
+
+    # Entries are "<mode> <sha1> <stage>\t<path>\0" for cached files and "<path>\0" for others
+    for entry in out.split(b'\0'):
+        if not entry:
+            continue
+
+        info, tab, name = entry.partition(b'\t')
+        if tab:
+            mode, sha1 = info.decode().split()[:2]
+        else:
+            name, mode, sha1 = info, '', ''
+
+        file_path = os.path.normpath(os.path.join(path, name.decode()))
+
+        # Files deleted from the working tree are still in the index, unmerged files are there several times
+        if file_path in listed or not os.path.isfile(file_path):
+            continue
+        listed.add(file_path)
+
+        if statuses.changed(file_path):
+            sha1 = ''
+
+        yield file_path, mode, sha1
+
+    # Outside of a repository, or if the whole directory is ignored, walk it
+    if not listed:
+        yield from _walk_directory(path)
+
+
 def directory_on_disk(path):
-    for root, dirs, files in os.walk(path):
-        for name in files:
-            file_path = os.path.join(root, name)
-            yield next(file_on_disk(file_path))
+    for file_path, mode, sha1 in _list_directory(path):
+        yield from file_on_disk(file_path, mode, sha1)
+
+
+class Prefetcher(object):
+    """Iterate over files while a reader thread loads the next ones, so reading overlaps with checking.
+    The contents loaded ahead are limited to a memory budget, and each file is released once consumed."""
+
+    def __init__(self, files, budget):
+        self.files = files
+        self.budget = budget
+        self.condition = threading.Condition()
+        self.loaded_size = 0
+        self.loaded_sizes = []
+        self.loaded_count = 0
+        self.consumed_count = 0
+        self.stopped = False
+
+    def _load(self):
+        for i, f in enumerate(self.files):
+            # Binary files are usually skipped by the hooks, they are only loaded if a hook reads them
+            size = 0 if f._binary else f.size or 0
+
+            with self.condition:
+                # The file needed next is always loaded, even if it does not fit in the budget alone
+                while not self.stopped and i > self.consumed_count and self.loaded_size + size > self.budget:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+
+            try:
+                buffer = f.buffer if size else None
+                # Mapped files are only read when used, ask the system to read them now
+                if isinstance(buffer, mmap.mmap) and hasattr(mmap, 'MADV_WILLNEED'):
+                    buffer.madvise(mmap.MADV_WILLNEED)
+            except Exception:
+                # The error is raised again when the hook reads the file
+                pass
+
+            with self.condition:
+                self.loaded_size += size
+                self.loaded_sizes.append(size)
+                self.loaded_count = i + 1
+                self.condition.notify_all()
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._load, daemon=True)
+        thread.start()
+
+        try:
+            for i, f in enumerate(self.files):
+                with self.condition:
+                    while self.loaded_count <= i:
+                        self.condition.wait()
+
+                yield f
+
+                # The hook is done with this file
+                f.release()
+
+                with self.condition:
+                    self.loaded_size -= self.loaded_sizes[i]
+                    self.consumed_count = i + 1
+                    self.condition.notify_all()
+        finally:
+            with self.condition:
+                self.stopped = True
+                self.condition.notify_all()
+            thread.join()
+
+            # The hook may stop before the end, do not keep what was loaded ahead
+            for f in self.files[self.consumed_count:self.loaded_count]:
+                f.release()
+
+
+def prefetch(files):
+    """return an iterable over files, whose contents are read ahead by another thread"""
+    budget = int(get_option('fw4spl-hooks.prefetch-size', default=32 * 1024 ** 2))
+    return Prefetcher(files, budget)
@@ -19,6 +19,7 @@ import os
 import re
 import subprocess
 from fnmatch import fnmatch
+from functools import partial
 
 import common
 
@@ -30,16 +31,29 @@ CPPCHECK_PATH = 'cppcheck'
 
 # Can we run cppcheck ?
 def check_cppcheck_install():
-    p = subprocess.Popen([CPPCHECK_PATH, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    p.communicate()
+    return common.tool_version(CPPCHECK_PATH) is None
 
-    return p.wait() != 0
+
+# ------------------------------------------------------------------------------
+
+def find_cppcheck():
+    if common.g_cppcheck_path_arg is not None and len(common.g_cppcheck_path_arg) > 0:
+        return common.g_cppcheck_path_arg
+
+    return common.get_option('cppcheck-hook.cppcheck-path', default=CPPCHECK_PATH, type='--path').strip()
 
 
 # ------------------------------------------------------------------------------
 
-# Return True if cppcheck find errors in specified file
-def check_file(file):
+# Return what the hook results depend on, besides the checked file and the git configuration
+def cache_key():
+    return [common.tool_version(find_cppcheck())]
+
+
+# ------------------------------------------------------------------------------
+
+# Return True if cppcheck find errors in specified file, on the lines kept by changed_line if given
+def check_file(file, changed_line=None):
     common.note('Checking with ' + CPPCHECK_PATH + ' file: ' + file)
 
     # Invoke cppcheck for source code files
@@ -53,28 +67,35 @@ def check_file(file):
                           file], \
                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
     out, err = p.communicate()
+    out = out.decode(errors='replace')
 
-    if err is not None:
-        print(err)
+    if out:
+        common.trace(out)
 
-    if out is not None:
-        print(out)
+    path = os.path.relpath(file, common.worktree_root())
 
     if p.wait() != 0:
         common.error('Cppcheck failure on file: ' + file)
         common.error('Aborting')
+        common.diagnostic('cppcheck', path, None, 'error', 'cppcheck failed')
         return True
 
-    if out:
+    issues = []
+    for line in out.splitlines():
+        words = re.findall('(.+)@!@(.+)@!@(.+)@!@(.+)', line)
+        if (words):
+            num_line = words[0][1]
+            # Issues without a line concern the whole file
+            if changed_line is None or not num_line.isdigit() or changed_line(int(num_line)):
+                issues.append(words[0][1:])
+
+    if out and (changed_line is None or issues):
         common.error('Cppcheck failure on file: ' + file)
-        for line in out.splitlines():
-            words = re.findall('(.+)@!@(.+)@!@(.+)@!@(.+)', line)
-            if (words):
-                num_line = words[0][1]
-                severity = words[0][2]
-                message = words[0][3]
-                common.error('[%s] line %s: %s' % (severity, num_line, message))
-                common.error(SEPARATOR)
+        for num_line, severity, message in issues:
+            common.error('[%s] line %s: %s' % (severity, num_line, message))
+            common.error(SEPARATOR)
+            common.diagnostic('cppcheck', path, int(num_line) if num_line.isdigit() else None, 'error',
+                              '[%s] %s' % (severity, message))
         return True
 
     return False
@@ -82,7 +103,19 @@ def check_file(file):
 
 # ------------------------------------------------------------------------------
 
-def cppcheck(files):
+# Check a source file of the repository, with the cppcheck found by the main process when run in a worker
+def check_source(f, cppcheck_path):
+    global CPPCHECK_PATH
+    CPPCHECK_PATH = cppcheck_path
+
+    if f.binary:
+        return False
+
+    file = os.path.join(common.worktree_root(), f.path)
+    return check_file(file, f.changed_line if f.changed is not None else None)
+
+
+def cppcheck(files, each=common.each_file):
     abort = False
     source_patterns = common.get_option('cppcheck-hook.source-patterns', default='*.cpp *.cxx *.c').split()
     header_patterns = common.get_option('cppcheck-hook.header-patterns', default='*.hpp *.hxx *.h').split()
@@ -90,23 +123,16 @@ def cppcheck(files):
     code_patterns = source_patterns + header_patterns
 
     global CPPCHECK_PATH
-
-    if common.g_cppcheck_path_arg is not None and len(common.g_cppcheck_path_arg) > 0:
-        CPPCHECK_PATH = common.g_cppcheck_path_arg
-    else:
-        CPPCHECK_PATH = common.get_option('cppcheck-hook.cppcheck-path', default=CPPCHECK_PATH, type='--path').strip()
+    CPPCHECK_PATH = find_cppcheck()
 
     if check_cppcheck_install():
         common.error('Failed to launch cppcheck.=')
+        common.diagnostic('cppcheck', None, None, 'error', 'Failed to launch ' + CPPCHECK_PATH)
         return True
 
-    repoRoot = common.get_repo_root()
-    for f in files:
-        if any(fnmatch(f.path.lower(), p) for p in code_patterns):
-
-            if not common.binary(f.contents):
-                file = os.path.join(repoRoot, f.path)
-                abort = check_file(file) or abort
+    sources = (f for f in files if any(fnmatch(f.path.lower(), p) for p in code_patterns))
+    for f, error in each(partial(check_source, cppcheck_path=CPPCHECK_PATH), sources):
+        abort = error or abort
 
     return abort
 
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Long-lived sheldon process, serving the checks of a repository.
+
+'sheldon --daemon' loads everything once (modules, configuration, tool versions, libraries and bundles of the fw4spl
+projects, git readers) and listens on a unix socket stored in the git common directory. The socket and its directory
+are private to the user running the daemon, and requests from other users are refused. Each request is run in a
+process forked from the daemon, so it starts with this state already loaded, in the directory, with the environment and
+with the standard streams of the client. The state is loaded again when the git configuration files, the fw4spl
+projects or the tools change, the configuration is read again for a client with its own one ('git -c', other
+configuration files), and the daemon stops when sheldon itself changes.
+
+'sheldon' forwards its arguments to the daemon of the repository when there is one, and runs the check itself
+otherwise.
+
+This module is imported before anything else by sheldon, so the client part must stay light: modules only needed when
+a daemon is running are imported where they are used.
+"""
+
+import os
+import sys
+
+import gitrepo
+
+# Sent by the daemon instead of an exit code when the client has to run the check itself
+FALLBACK = b'fallback'
+
+
+# ------------------------------------------------------------------------------
+
+def socket_path(common_dir):
+    path = os.path.join(common_dir, 'sheldon', 'daemon.sock')
+
+    # Unix socket paths are limited to about a hundred bytes, the socket is then in a directory of the user
+    if len(path.encode()) > 100:
+        import hashlib
+        import tempfile
+
+        digest = hashlib.sha1(common_dir.encode()).hexdigest()[:16]
+        path = os.path.join(tempfile.gettempdir(), 'sheldon-%d' % os.getuid(), digest + '.sock')
+
+    return path
+
+
+def _owned(path, kind):
+    """return True if path is of the given stat kind, belongs to the current user and only they can write to it"""
+    import stat
+
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+
+    return stat.S_IFMT(info.st_mode) == kind and info.st_uid == os.getuid() and not info.st_mode & 0o022
+
+
+def _private_directory(path):
+    """create the directory of the socket, only accessible to the current user, return False if it cannot be trusted"""
+    import stat
+
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        info = os.lstat(path)
+        if stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() and info.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    except OSError:
+        return False
+
+    return _owned(path, stat.S_IFDIR)
+
+
+def _config_environment(environment):
+    """return the environment variables changing the git configuration"""
+    return {name: value for name, value in environment.items()
+            if name.startswith('GIT_CONFIG') or name in ('HOME', 'XDG_CONFIG_HOME')}
+
+
+def _sources_stamp():
+    import glob
+
+    # sheldon cannot be reloaded in place, the daemon stops when it changes. The directory is the archive itself when
+    # sheldon runs from a zipapp.
+    directory = os.path.dirname(os.path.abspath(__file__))
+    paths = sorted(glob.glob(os.path.join(directory, '*.py')) + glob.glob(os.path.join(directory, '*.cfg')) +
+                   glob.glob(os.path.join(directory, '*.txt')) + [os.path.join(directory, 'sheldon'), directory])
+    return [(path, _mtime(path)) for path in paths]
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+# socket.send_fds and socket.recv_fds need python 3.9, they are written here with sendmsg and recvmsg
+def _send_fds(sock, data, fds):
+    import array
+    import socket
+
+    return sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+
+
+def _recv_fds(sock, size, count):
+    import array
+    import socket
+
+    fds = array.array('i')
+    data, ancillary, flags, address = sock.recvmsg(size, socket.CMSG_LEN(count * fds.itemsize))
+
+    for level, kind, fd_data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(fd_data[:len(fd_data) - (len(fd_data) % fds.itemsize)])
+
+    return data, list(fds)
+
+
+# ------------------------------------------------------------------------------
+
+def forward(argv):
+    """run sheldon in the daemon of the current repository, return its exit code, None if there is no daemon"""
+    found = gitrepo.discover(os.getcwd())
+    if found is None:
+        return None
+
+    path = socket_path(found[2])
+    if not os.path.exists(path):
+        return None
+
+    import json
+    import socket
+    import stat
+
+    # The request holds the environment of the client, it is only sent to a daemon of the same user
+    if not _owned(path, stat.S_IFSOCK) or not _owned(os.path.dirname(path), stat.S_IFDIR):
+        sys.stderr.write('The sheldon daemon socket ' + path + ' does not belong to you, it is not used.\n')
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    request = json.dumps({'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}).encode() + b'\n'
+
+    try:
+        client.connect(path)
+    except OSError:
+        # A daemon which is not running anymore
+        client.close()
+        return None
+
+    try:
+        # The standard streams are given to the daemon, which runs the check with them, then sends the exit code
+        sys.stdout.flush()
+        sent = _send_fds(client, request, [0, 1, 2])
+        client.sendall(request[sent:])
+        reply = b''.join(iter(lambda: client.recv(64), b''))
+    except OSError:
+        reply = b''
+    finally:
+        client.close()
+
+    if reply == FALLBACK:
+        return None
+
+    # The daemon stopped while running the check
+    return int(reply) if reply else 1
+
+
+# ------------------------------------------------------------------------------
+
+class Daemon(object):
+    """Server side, listening on the socket of a repository"""
+
+    def __init__(self, root, git_dir, common_dir, warm_up):
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self.warm_up = warm_up
+        self.path = socket_path(common_dir)
+        self.listener = None
+        self.sources = _sources_stamp()
+        self.stamp = None
+
+    def _config_files(self):
+        home = os.path.expanduser('~')
+        xdg = os.environ.get('XDG_CONFIG_HOME') or os.path.join(home, '.config')
+        paths = ['/etc/gitconfig', os.path.join(home, '.gitconfig'), os.path.join(xdg, 'git', 'config'),
+                 os.path.join(self.common_dir, 'config'), os.path.join(self.git_dir, 'config.worktree')]
+        return paths + [os.environ[name] for name in ('GIT_CONFIG_GLOBAL', 'GIT_CONFIG_SYSTEM') if os.environ.get(name)]
+
+    def _state_stamp(self):
+        import common
+        import shutil
+        import sortincludes
+
+        # The loaded state depends on the configuration, the fw4spl projects and the tools
+        paths = self._config_files() + sorted(sortincludes.g_watched_dirs)
+        paths += sorted(shutil.which(path) or path for path, option in common.g_tool_versions)
+        return [(path, _mtime(path)) for path in paths]
+
+    def _load(self):
+        import common
+        import sortincludes
+
+        common.reload_config()
+        common.g_tool_versions.clear()
+        common.g_repo_contexts.clear()
+        common.g_git_repositories.clear()
+        sortincludes.g_projects = None
+
+        self.warm_up()
+        self.stamp = self._state_stamp()
+
+    def listen(self):
+        """listen on the socket, return False if a daemon is already running, raise OSError if it cannot be trusted"""
+        import socket
+
+        if not _private_directory(os.path.dirname(self.path)):
+            raise OSError('The directory of the socket does not belong to you: ' + os.path.dirname(self.path))
+
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                return False
+            except OSError:
+                # Left by a daemon which did not stop properly
+                os.unlink(self.path)
+            finally:
+                probe.close()
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.listener.listen(16)
+        return True
+
+    def close(self):
+        self.listener.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    @staticmethod
+    def _same_user(connection):
+        """return True if the client runs as the user of the daemon, relying on the private directory of the socket when
+        the system cannot tell"""
+        import socket
+        import struct
+
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return True
+
+        credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        return struct.unpack('3i', credentials)[1] == os.getuid()
+
+    @staticmethod
+    def _read_request(connection):
+        """return the request and the standard streams of the client, None if it is not complete"""
+        import json
+
+        data, streams = _recv_fds(connection, 65536, 3)
+
+        while not data.endswith(b'\n'):
+            chunk = connection.recv(65536)
+            if not chunk:
+                data = b''
+                break
+            data += chunk
+
+        try:
+            request = json.loads(data.decode()) if len(streams) == 3 else None
+        except ValueError:
+            request = None
+
+        if request is None:
+            for fd in streams:
+                os.close(fd)
+            return None
+
+        request['streams'] = streams
+        return request
+
+    @staticmethod
+    def _reply(pid, connection):
+        # Send the exit code once the forked process is done with the streams of the client
+        status = os.waitpid(pid, 0)[1]
+        code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+        try:
+            connection.sendall(str(code).encode())
+        except OSError:
+            pass
+        connection.close()
+
+    def serve(self):
+        """accept requests until stopped, return the request to run in the forked processes only"""
+        import common
+        import threading
+
+        self._load()
+        common.note('Daemon listening on ' + self.path)
+
+        while True:
+            connection = self.listener.accept()[0]
+
+            try:
+                request = self._read_request(connection) if self._same_user(connection) else None
+            except (OSError, ValueError):
+                request = None
+
+            if request is None:
+                connection.close()
+                continue
+
+            if _sources_stamp() != self.sources:
+                common.note('sheldon has changed, stopping the daemon')
+                connection.sendall(FALLBACK)
+                connection.close()
+                return None
+
+            if self._state_stamp() != self.stamp:
+                common.note('Configuration, projects or tools have changed, loading them again')
+                self._load()
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+            pid = os.fork()
+
+            if pid == 0:
+                self._enter(connection, request)
+                return request
+
+            for fd in request['streams']:
+                os.close(fd)
+
+            threading.Thread(target=self._reply, args=(pid, connection), daemon=True).start()
+
+    def _enter(self, connection, request):
+        import common
+        import signal
+
+        # The forked process is a regular sheldon run, with the standard streams of the client
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        self.listener.close()
+        connection.close()
+
+        for target, fd in enumerate(request['streams']):
+            os.dup2(fd, target)
+            os.close(fd)
+
+        # Tools are found from the PATH of the client
+        if request['env'].get('PATH') != os.environ.get('PATH'):
+            common.g_tool_versions.clear()
+
+        loaded_config = _config_environment(os.environ)
+
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.argv = sys.argv[:1] + request['argv']
+
+        common.forget_run_state()
+
+        # The configuration of the client is not the one loaded by the daemon ('git -c', other configuration files, a
+        # repository moved by environment variables), it is read again with what depends on it
+        if _config_environment(os.environ) != loaded_config or gitrepo.overridden():
+            import sortincludes
+
+            common.reload_config()
+            common.g_git_repositories.clear()
+            sortincludes.g_projects = None
+
+
+# ------------------------------------------------------------------------------
+
+def serve(warm_up):
+    """run the daemon of the repository of the current directory, warm_up loading what is shared by all the runs.
+    Return only in the processes forked for each request, with the arguments of the request."""
+    import common
+    import signal
+
+    found = gitrepo.discover(os.getcwd())
+    if found is None:
+        common.error('The daemon needs to be started in a git working tree.')
+        exit(1)
+
+    daemon = Daemon(*found, warm_up=warm_up)
+
+    try:
+        listening = daemon.listen()
+    except OSError as e:
+        common.error('The daemon cannot listen: ' + str(e))
+        exit(1)
+
+    if not listening:
+        common.error('A daemon is already running for this repository.')
+        exit(1)
+
+    # Stop properly on SIGTERM, like on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        request = daemon.serve()
+    except (KeyboardInterrupt, SystemExit):
+        request = None
+
+    if request is not None:
+        return request['argv']
+
+    daemon.close()
+    exit(0)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Structured output of the problems found by the hooks, for continuous integration and dashboards.
+
+Diagnostics are written as they are reported, so nothing is kept in memory whatever their number:
+ - json: one JSON object per line, with the hook, path, line, severity, message and fix fields. The first and the last
+   lines are the record of the run instead, {"run": {"shard": [<i>, <N>], "completed": <bool>}}, the last one telling
+   whether every check ran.
+ - sarif: a SARIF 2.1.0 log with a single run. The rules of the tool are written after the results, once they are all
+   known, with the properties of the run: its shard and whether every check ran. The run of a shard is identified as
+   'sheldon/shard-<i>-of-<N>'.
+
+The outputs of the shards of a check are combined by 'sheldon merge-results' into a single report and exit code, which
+fails when a shard is missing or did not run every check.
+"""
+
+import json
+import sys
+
+import common
+
+SARIF_SCHEMA = 'https://json.schemastore.org/sarif-2.1.0.json'
+SHARD_ID = 'sheldon/shard-%d-of-%d'
+
+
+# ------------------------------------------------------------------------------
+
+class JsonLinesWriter(object):
+    def __init__(self, stream, shard=None):
+        self.stream = stream
+        self.shard = shard
+        self.completed = False
+
+        # A run which does not reach its end keeps this record
+        self._write_run()
+
+    def _write_run(self):
+        shard = list(self.shard) if self.shard is not None else None
+        self.stream.write(json.dumps({'run': {'shard': shard, 'completed': self.completed}}) + '\n')
+
+    def write(self, diagnostic):
+        self.stream.write(json.dumps(diagnostic._asdict()) + '\n')
+
+    def close(self):
+        self._write_run()
+        self.stream.flush()
+
+
+# ------------------------------------------------------------------------------
+
+class SarifWriter(object):
+    def __init__(self, stream, shard=None):
+        self.stream = stream
+        self.shard = shard
+        self.completed = False
+        self.rules = []
+        self.count = 0
+
+        run = ''
+        if shard is not None:
+            run = '"automationDetails": {"id": "%s"}, ' % (SHARD_ID % shard)
+
+        self.stream.write('{"version": "2.1.0", "$schema": "%s", "runs": [{%s"results": [\n' % (SARIF_SCHEMA, run))
+
+    def write(self, diagnostic):
+        if diagnostic.hook not in self.rules:
+            self.rules.append(diagnostic.hook)
+
+        result = {
+            'ruleId': diagnostic.hook,
+            'level': diagnostic.severity,
+            'message': {'text': diagnostic.message},
+            'properties': {'fixAvailable': diagnostic.fix},
+        }
+
+        if diagnostic.path is not None:
+            location = {'artifactLocation': {'uri': diagnostic.path}}
+            if diagnostic.line is not None:
+                location['region'] = {'startLine': diagnostic.line}
+            result['locations'] = [{'physicalLocation': location}]
+
+        self.stream.write((',\n' if self.count else '') + json.dumps(result))
+        self.count += 1
+
+    def close(self):
+        driver = {
+            'name': 'sheldon',
+            'rules': [{'id': rule} for rule in self.rules],
+        }
+        properties = {
+            'shard': list(self.shard) if self.shard is not None else None,
+            'completed': self.completed,
+        }
+        self.stream.write('\n], "tool": %s, "properties": %s}]}\n' % (json.dumps({'driver': driver}),
+                                                                     json.dumps(properties)))
+        self.stream.flush()
+
+
+# ------------------------------------------------------------------------------
+
+WRITERS = {
+    'json': JsonLinesWriter,
+    'sarif': SarifWriter,
+}
+
+
+def open_writer(output_format, stream, shard=None):
+    """return the writer of a format, shard being the (index, count) of the shard checked if any. The run is written
+    as interrupted unless 'completed' is set on the writer before it is closed."""
+    return WRITERS[output_format](stream, shard)
+
+
+# ------------------------------------------------------------------------------
+
+def _run(record):
+    """return the (shard, completed) of the record of a run"""
+    shard = record.get('shard')
+    return tuple(shard) if shard is not None else None, record.get('completed') is True
+
+
+def read(path):
+    """return the diagnostics of a structured output, and the (shard, completed) of its runs"""
+    with open(path) as input_file:
+        content = input_file.read()
+
+    try:
+        log = json.loads(content)
+    except ValueError:
+        # More than one JSON object per line
+        log = None
+
+    if not isinstance(log, dict) or 'runs' not in log:
+        records = []
+        run = None
+
+        for line in content.splitlines():
+            if line.strip():
+                record = json.loads(line)
+                if 'run' in record:
+                    # The last record of the run tells whether it was completed
+                    run = _run(record['run'])
+                else:
+                    records.append(common.Diagnostic(**record))
+
+        return records, [run] if run is not None else []
+
+    records = []
+    runs = []
+
+    for run in log['runs']:
+        runs.append(_run(run.get('properties', {})))
+
+        for result in run.get('results', []):
+            location = result.get('locations', [{}])[0].get('physicalLocation', {})
+            records.append(common.Diagnostic(result['ruleId'],
+                                             location.get('artifactLocation', {}).get('uri'),
+                                             location.get('region', {}).get('startLine'),
+                                             result.get('level', 'warning'),
+                                             result['message']['text'],
+                                             result.get('properties', {}).get('fixAvailable', False)))
+
+    return records, runs
+
+
+def missing_shards(shards):
+    """return a description of the shards missing or repeated, None if they are all there once"""
+    counts = set(count for index, count in shards)
+    if len(counts) > 1:
+        return 'shards of %s runners' % ' and '.join(str(count) for count in sorted(counts))
+
+    for count in counts:
+        expected = [(index, count) for index in range(1, count + 1)]
+        if sorted(shards) != expected:
+            return 'shards %s out of %d' % (', '.join(str(index) for index, count in sorted(shards)), count)
+
+    return None
+
+
+def merge_results(argv):
+    """sheldon merge-results: write the diagnostics of the shards as one report, return the exit code"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='sheldon merge-results',
+                                     description='Combine the structured outputs of the shards of a check.')
+    parser.add_argument('inputs', nargs='+', metavar='FILE', help='JSON lines or SARIF output of a shard.')
+    parser.add_argument('--output-format', choices=['text'] + sorted(WRITERS), default='text',
+                        help='Format of the combined report (default: text).')
+    parser.add_argument('--output-file', help='Write the combined report to this file instead of the standard output.')
+    args = parser.parse_args(argv)
+
+    records = []
+    shards = []
+    incomplete = []
+    for path in args.inputs:
+        try:
+            file_records, runs = read(path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            common.error('Cannot read the results in ' + path + ': ' + str(e))
+            return 1
+        records += file_records
+
+        # A run which did not reach its end may have skipped files without reporting anything
+        if not runs:
+            incomplete.append('no run in ' + path)
+        for shard, completed in runs:
+            if shard is not None:
+                shards.append(shard)
+            if not completed:
+                incomplete.append('an interrupted run in ' + path)
+
+    missing = missing_shards(shards)
+    if missing is not None:
+        incomplete.append(missing)
+
+    # Problems not tied to a file, like the ones of commits, may be reported by every shard
+    merged = []
+    seen = set()
+    for record in records:
+        if record not in seen:
+            seen.add(record)
+            merged.append(record)
+    merged.sort(key=lambda record: (record.path or '', record.line or 0))
+
+    if args.output_file:
+        output_file = open(args.output_file, 'w')
+    else:
+        output_file = sys.stdout
+        if args.output_format != 'text':
+            # Only the results are written to the standard output
+            sys.stdout = sys.stderr
+
+    try:
+        if args.output_format == 'text':
+            for record in merged:
+                location = ':'.join(str(part) for part in (record.path, record.line) if part is not None)
+                output_file.write('%s[%s] %s: %s\n' % (location + ': ' if location else '', record.hook,
+                                                       record.severity, record.message))
+        else:
+            writer = open_writer(args.output_format, output_file)
+            for record in merged:
+                writer.write(record)
+            writer.completed = not incomplete
+            writer.close()
+    finally:
+        if args.output_file:
+            output_file.close()
+
+    errors = sum(1 for record in merged if record.severity == 'error')
+    common.note('%d problem(s) found by %d shard(s), %d error(s).' % (len(merged), len(args.inputs), errors))
+
+    if incomplete:
+        common.error('Incomplete results, found ' + ', '.join(incomplete) + '.')
+        return 1
+
+    return 1 if errors else 0
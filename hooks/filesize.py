@@ -19,6 +19,8 @@ All files are checked by default. To check only binary files, use the type optio
 
 """
 
+from functools import partial
+
 import common
 
 WARNING = ('Attempt to commit or push too big file(s). '
@@ -26,7 +28,16 @@ WARNING = ('Attempt to commit or push too big file(s). '
 FILEWARN = ('   - %s, %s > %s')
 
 
-def filesize(files):
+# Return whether a file is too big, None if it is not checked
+def check_file(f, limit, check_all_files):
+    if not check_all_files and not f.binary:
+        return None
+
+    common.trace('Checking ' + str(f.path) + ' size...')
+    return f.size > limit
+
+
+def filesize(files, each=common.each_file):
     abort = False
     limit = int(common.get_option('filesize-hook.max-size', default=1024 ** 2))
     check_all_files = common.get_option('filesize-hook.type', "all").strip().lower() != "binary"
@@ -35,14 +46,10 @@ def filesize(files):
     common.note('Checking files size...')
 
     count = 0
-    for f in files:
-        check_file = check_all_files or common.binary(f.contents)
-
-        if check_file:
-            common.trace('Checking ' + str(f.path) + ' size...')
-
+    for f, too_big in each(partial(check_file, limit=limit, check_all_files=check_all_files), files):
+        if too_big is not None:
             count += 1
-            if f.size > limit:
+            if too_big:
                 too_big_files.append(f)
 
     common.note('%d file(s) checked.' % count)
@@ -55,6 +62,10 @@ def filesize(files):
                 f.size,
                 limit
             ))
+            common.diagnostic('filesize', f.path, None, 'error', 'File size %s exceeds the limit of %s bytes' % (
+                f.size,
+                limit
+            ))
         abort = True
     return abort
 
@@ -47,45 +47,81 @@ SLM_LOG = lambda x: bool(
 )
 DIGRAPH = lambda x: "<:" in x or ":>" in x
 DOXYGEN = lambda x: '* @class' in x or '* @date' in x or '* @namespace' in x
-BADWORDS = lambda x: any(re.search(r'\b' + bad + r'\b', x, re.IGNORECASE) for bad in BAD_WORDS_LIST)
+BADWORDS_REGEX = re.compile(r'\b(' + '|'.join(BAD_WORDS_LIST) + r')\b', re.IGNORECASE)
+BADWORDS = lambda x: BADWORDS_REGEX.search(x) is not None
 
+# Each entry is (test, description, default file patterns, locator).
+# The locator finds where the token may be, so only the lines around its matches are tested.
 tr = {
-    'crlf': (CRLF, 'CRLF line endings', '*.cpp *.hpp *.hxx *.cxx *.c *.h *.xml *.txt *.cmake *.py'),
-    'cr': (CR, 'CR line endings', '*.cpp *.hpp *.hxx *.cxx *.c *.h *.xml *.txt *.cmake *.py'),
-    'tab': (TAB, 'TAB', '*.cpp *.hpp *.hxx *.cxx *.c *.h *.xml *.txt *.cmake *.py'),
-    'lgpl': (LGPL, 'LGPL Header', '*.cpp *.hpp *.hxx *.cxx *.c *.h *.xml *.txt *.cmake'),
-    'bsd': (BSD, 'BSD Header', '*.cpp *.hpp *.hxx *.cxx *.c *.h *.xml *.txt *.cmake'),
-    'oslmlog': (SLM_LOG, 'O''SLM_LOG', '*.cpp *.hpp *.hxx *.cxx *.c *.h'),
-    'digraphs': (DIGRAPH, 'Forbiden digraphs: <'':, :''>', '*.cpp *.hpp *.hxx *.cxx *.c *.h'),
-    'doxygen': (DOXYGEN, '@class @date @namespace doxygen tag(s)', '*.cpp *.hpp *.hxx *.cxx *.c *.h'),
-    'badwords': (BADWORDS, 'Forbidden word in our code', '*.cpp *.hpp *.hxx *.cxx *.c *.h'),
+    'crlf': (CRLF, 'CRLF line endings', '*.cpp *.hpp *.hxx *.cxx *.c *.h *.xml *.txt *.cmake *.py',
+             re.compile('\r\n')),
+    'cr': (CR, 'CR line endings', '*.cpp *.hpp *.hxx *.cxx *.c *.h *.xml *.txt *.cmake *.py',
+           re.compile('\r')),
+    'tab': (TAB, 'TAB', '*.cpp *.hpp *.hxx *.cxx *.c *.h *.xml *.txt *.cmake *.py',
+            re.compile('\t')),
+    'lgpl': (LGPL, 'LGPL Header', '*.cpp *.hpp *.hxx *.cxx *.c *.h *.xml *.txt *.cmake',
+             re.compile('Lesser General Public License')),
+    'bsd': (BSD, 'BSD Header', '*.cpp *.hpp *.hxx *.cxx *.c *.h *.xml *.txt *.cmake',
+            re.compile('under the terms of the BSD Licence')),
+    'oslmlog': (SLM_LOG, 'O''SLM_LOG', '*.cpp *.hpp *.hxx *.cxx *.c *.h',
+                re.compile('O''SLM_LOG')),
+    'digraphs': (DIGRAPH, 'Forbiden digraphs: <'':, :''>', '*.cpp *.hpp *.hxx *.cxx *.c *.h',
+                 re.compile('<:|:>')),
+    'doxygen': (DOXYGEN, '@class @date @namespace doxygen tag(s)', '*.cpp *.hpp *.hxx *.cxx *.c *.h',
+                re.compile(r'\* @(class|date|namespace)')),
+    'badwords': (BADWORDS, 'Forbidden word in our code', '*.cpp *.hpp *.hxx *.cxx *.c *.h',
+                 BADWORDS_REGEX),
 }
 
 WARNING = ('Attempt to commit or push text file(s) containing "%s"')
 FILEWARN = ('   - %s:%s')
 
 
-def forbidtoken(files, config_name):
+# Return the numbers of the lines of a file matching a token, only searched in the lines to check
+def line_match(test, locator, f):
+    last = 0
+    for start, end in f.regions():
+        for match in locator.finditer(f.text, start, end):
+            n = f.line_number(match.start())
+            if n != last and test(f.line(n)):
+                yield n
+            last = n
+
+
+# Return whether a file has the token of a hook, with the numbers of the lines where it is
+def check_file(f, config_name):
+    token = tr[config_name][0]
+    locator = tr[config_name][3]
+
+    common.trace('Checking ' + str(f.path) + '...')
+
+    if f.binary:
+        return False, []
+    elif f.changed is not None:
+        # Only the changed lines are searched, the token may be elsewhere
+        lines = list(line_match(token, locator, f))
+        return bool(lines), lines
+    elif token(f.text):
+        return True, list(line_match(token, locator, f))
+
+    return False, []
+
+
+def forbidtoken(files, config_name, each=common.each_file):
     include_patterns = common.get_option('forbidtoken-hook.' + config_name, default=tr[config_name][2]).split()
 
     common.note('Checking for "' + config_name + '" tokens on ' + ', '.join(include_patterns) + ' files')
     abort = False
-    token = tr[config_name][0]
-    line_iter = lambda x: enumerate(re.finditer(".*\n", x, re.MULTILINE), 1)
-    line_match = lambda test, x: (n for n, m in line_iter(x) if test(m.group()))
 
     count = 0
-    for f in files:
-        if not any(f.fnmatch(p) for p in include_patterns):
-            continue
-        common.trace('Checking ' + str(f.path) + '...')
-        content = f.contents
-
-        if not common.binary(content) and token(content.decode()):
+    checked = (f for f in files if any(f.fnmatch(p) for p in include_patterns))
+    for f, (found, lines) in each(partial(check_file, config_name=config_name), checked):
+        if found:
             if not abort:
                 common.error(WARNING % (tr[config_name][1]))
-            for n in line_match(token, content.decode()):
+            for n in lines:
                 common.error(FILEWARN % (f.path, n))
+                common.diagnostic(config_name, f.path, n, 'error', tr[config_name][1])
             abort = True
         count += 1
 
@@ -0,0 +1,735 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Read-only access to a git repository without launching git.
+
+The index, loose objects, pack files and refs are parsed in-process, so the staged and range modes can list files
+and read blobs without any fork. Anything which is not supported (split or sparse index, reftable, sha256
+repositories, missing objects of partial clones, complex revision syntax, ...) raises a GitError, and callers are
+expected to fall back to git commands.
+"""
+
+import binascii
+import collections
+import glob
+import mmap
+import os
+import re
+import struct
+import zlib
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {
+    OBJ_COMMIT: 'commit',
+    OBJ_TREE: 'tree',
+    OBJ_BLOB: 'blob',
+    OBJ_TAG: 'tag',
+}
+
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+MODE_TREE = 0o040000
+MODE_GITLINK = 0o160000
+
+IndexEntry = collections.namedtuple('IndexEntry', 'mode, sha1, stage, path')
+
+# Same fields as a line of 'git diff --raw', modes being formatted as octal strings and shas as hex strings.
+# old_path differs from path only for renames and copies.
+DiffEntry = collections.namedtuple('DiffEntry', 'old_mode, new_mode, old_sha1, new_sha1, status, path, old_path')
+
+
+class GitError(Exception):
+    pass
+
+
+# ------------------------------------------------------------------------------
+
+def _varint(data, pos):
+    # Little-endian base 128 integer, used in delta headers
+    value = shift = 0
+    while True:
+        c = data[pos]
+        pos += 1
+        value |= (c & 0x7f) << shift
+        shift += 7
+        if not c & 0x80:
+            return value, pos
+
+
+def _offset_varint(data, pos):
+    # Big-endian base 128 integer with an offset added at each step, used by ofs-delta and index v4 paths
+    c = data[pos]
+    pos += 1
+    value = c & 0x7f
+    while c & 0x80:
+        c = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (c & 0x7f)
+    return value, pos
+
+
+def apply_delta(base, delta):
+    source_size, pos = _varint(delta, 0)
+    target_size, pos = _varint(delta, pos)
+
+    if source_size != len(base):
+        raise GitError('Delta does not apply to its base')
+
+    out = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+
+        if op & 0x80:
+            # Copy from the base
+            offset = size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            out += base[offset:offset + (size or 0x10000)]
+        elif op:
+            # Insert from the delta
+            out += delta[pos:pos + op]
+            pos += op
+        else:
+            raise GitError('Invalid delta opcode')
+
+    if len(out) != target_size:
+        raise GitError('Delta result has a wrong size')
+
+    return bytes(out)
+
+
+# ------------------------------------------------------------------------------
+
+class Pack(object):
+    """A pack file and its version 2 index"""
+
+    def __init__(self, idx_path):
+        self.idx_path = idx_path
+        self.pack_path = idx_path[:-4] + '.pack'
+
+        with open(idx_path, 'rb') as idx_file:
+            self.idx = mmap.mmap(idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.idx[:4] != b'\xfftOc' or struct.unpack('>I', self.idx[4:8])[0] != 2:
+            raise GitError('Unsupported pack index version: ' + idx_path)
+
+        self.fanout = struct.unpack('>256I', self.idx[8:8 + 1024])
+        self.count = self.fanout[255]
+        self.shas_start = 8 + 1024
+        self.offsets_start = self.shas_start + 24 * self.count
+        self.large_offsets_start = self.offsets_start + 4 * self.count
+        self.data = None
+
+    def _sha(self, i):
+        start = self.shas_start + 20 * i
+        return self.idx[start:start + 20]
+
+    def find(self, binsha):
+        """return the offset of an object in the pack, None if it is not there"""
+        lo = self.fanout[binsha[0] - 1] if binsha[0] else 0
+        hi = self.fanout[binsha[0]]
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            sha = self._sha(mid)
+            if sha < binsha:
+                lo = mid + 1
+            elif sha > binsha:
+                hi = mid
+            else:
+                start = self.offsets_start + 4 * mid
+                offset = struct.unpack('>I', self.idx[start:start + 4])[0]
+                if offset & 0x80000000:
+                    start = self.large_offsets_start + 8 * (offset & 0x7fffffff)
+                    offset = struct.unpack('>Q', self.idx[start:start + 8])[0]
+                return offset
+
+        return None
+
+    def find_prefix(self, prefix):
+        """return the binary shas of the objects whose hex sha starts with prefix"""
+        first = int(prefix[:2], 16) if len(prefix) >= 2 else None
+        indices = range(self.fanout[first - 1] if first else 0, self.fanout[first]) if first is not None \
+            else range(self.count)
+        return [self._sha(i) for i in indices if binascii.hexlify(self._sha(i)).decode().startswith(prefix)]
+
+    def header(self, offset):
+        """return (type, size, position of the data, base) of an entry, base being an offset or a binary sha"""
+        if self.data is None:
+            with open(self.pack_path, 'rb') as pack_file:
+                self.data = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        data = self.data
+        c = data[offset]
+        pos = offset + 1
+        obj_type = (c >> 4) & 7
+        size = c & 0x0f
+        shift = 4
+        while c & 0x80:
+            c = data[pos]
+            pos += 1
+            size |= (c & 0x7f) << shift
+            shift += 7
+
+        base = None
+        if obj_type == OBJ_OFS_DELTA:
+            distance, pos = _offset_varint(data, pos)
+            base = offset - distance
+        elif obj_type == OBJ_REF_DELTA:
+            base = data[pos:pos + 20]
+            pos += 20
+
+        return obj_type, size, pos, base
+
+    def inflate(self, pos, size, limit=None):
+        """inflate the zlib stream starting at pos, stopping after limit bytes if given"""
+        decompressor = zlib.decompressobj()
+        out = bytearray()
+        wanted = size if limit is None else min(size, limit)
+
+        while len(out) < wanted and not decompressor.eof:
+            chunk = self.data[pos:pos + 65536]
+            if not chunk:
+                raise GitError('Truncated pack file: ' + self.pack_path)
+            pos += len(chunk)
+            out += decompressor.decompress(chunk, wanted - len(out))
+
+            # Some input may be left unconsumed because of the output limit
+            while decompressor.unconsumed_tail and len(out) < wanted:
+                out += decompressor.decompress(decompressor.unconsumed_tail, wanted - len(out))
+
+        return bytes(out)
+
+
+# ------------------------------------------------------------------------------
+
+class Repository(object):
+    """Read-only in-process view of a repository"""
+
+    def __init__(self, git_dir, common_dir=None):
+        self.git_dir = git_dir
+        self.common_dir = common_dir or git_dir
+
+        if os.path.isdir(os.path.join(self.common_dir, 'reftable')):
+            raise GitError('reftable is not supported')
+
+        # sha256 repositories and other extensions are not supported
+        config_path = os.path.join(self.common_dir, 'config')
+        if os.path.isfile(config_path):
+            with open(config_path, 'rb') as config_file:
+                if re.search(rb'^\s*objectformat\s*=', config_file.read(), re.MULTILINE | re.IGNORECASE):
+                    raise GitError('Only sha1 repositories are supported')
+
+        self.objects_dirs = [os.path.join(self.common_dir, 'objects')]
+
+        # Objects may also be borrowed from other repositories
+        alternates = os.path.join(self.objects_dirs[0], 'info', 'alternates')
+        if os.path.isfile(alternates):
+            with open(alternates) as alternates_file:
+                for line in alternates_file.read().splitlines():
+                    if line and not line.startswith('#'):
+                        self.objects_dirs.append(os.path.join(self.objects_dirs[0], line))
+
+        self._packs = None
+        self._packs_stamp = None
+        self._bases = collections.OrderedDict()
+        self._index = None
+        self._index_stat = None
+
+    # --------------------------------------------------------------------------
+    # Objects
+
+    @property
+    def packs(self):
+        # Packs are listed again when they change, like after a fetch or a gc, as the reader may be long-lived
+        stamp = []
+        for objects_dir in self.objects_dirs:
+            try:
+                stamp.append(os.stat(os.path.join(objects_dir, 'pack')).st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+
+        if self._packs is None or stamp != self._packs_stamp:
+            self._packs = []
+            self._packs_stamp = stamp
+            for objects_dir in self.objects_dirs:
+                for idx_path in sorted(glob.glob(os.path.join(objects_dir, 'pack', '*.idx'))):
+                    self._packs.append(Pack(idx_path))
+        return self._packs
+
+    def _loose_path(self, sha):
+        for objects_dir in self.objects_dirs:
+            path = os.path.join(objects_dir, sha[:2], sha[2:])
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _find_packed(self, binsha):
+        for pack in self.packs:
+            offset = pack.find(binsha)
+            if offset is not None:
+                return pack, offset
+        return None, None
+
+    def _read_packed(self, pack, offset):
+        # Bases of deltas are kept in a small cache since they are usually shared by several objects
+        key = (pack.pack_path, offset)
+        if key in self._bases:
+            self._bases.move_to_end(key)
+            return self._bases[key]
+
+        obj_type, size, pos, base = pack.header(offset)
+        data = pack.inflate(pos, size)
+
+        if obj_type == OBJ_OFS_DELTA:
+            obj_type, base_data = self._read_packed(pack, base)
+            data = apply_delta(base_data, data)
+        elif obj_type == OBJ_REF_DELTA:
+            obj_type, base_data = self._read_binsha(base)
+            data = apply_delta(base_data, data)
+
+        self._bases[key] = (obj_type, data)
+        if len(self._bases) > 64:
+            self._bases.popitem(last=False)
+
+        return obj_type, data
+
+    def _read_binsha(self, binsha):
+        return self.read_object(binascii.hexlify(binsha).decode())
+
+    def read_object(self, sha):
+        """return (type, data) of an object"""
+        path = self._loose_path(sha)
+
+        if path is not None:
+            with open(path, 'rb') as object_file:
+                raw = zlib.decompress(object_file.read())
+            header, _, data = raw.partition(b'\0')
+            obj_type = header.split(b' ')[0].decode()
+            return {v: k for k, v in TYPE_NAMES.items()}[obj_type], data
+
+        pack, offset = self._find_packed(binascii.unhexlify(sha))
+        if pack is None:
+            raise GitError('Object not found: ' + sha)
+
+        return self._read_packed(pack, offset)
+
+    def read_blob(self, sha):
+        obj_type, data = self.read_object(sha)
+        if obj_type != OBJ_BLOB:
+            raise GitError(sha + ' is not a blob')
+        return data
+
+    def object_size(self, sha):
+        """return the size of an object, inflating as little as possible"""
+        path = self._loose_path(sha)
+
+        if path is not None:
+            decompressor = zlib.decompressobj()
+            with open(path, 'rb') as object_file:
+                header = decompressor.decompress(object_file.read(512), 64)
+            return int(header.partition(b'\0')[0].split(b' ')[1])
+
+        pack, offset = self._find_packed(binascii.unhexlify(sha))
+        if pack is None:
+            raise GitError('Object not found: ' + sha)
+
+        obj_type, size, pos, base = pack.header(offset)
+        if obj_type not in (OBJ_OFS_DELTA, OBJ_REF_DELTA):
+            return size
+
+        # The size of the result is in the delta header, after the size of the base
+        delta = pack.inflate(pos, size, 20)
+        _, delta_pos = _varint(delta, 0)
+        return _varint(delta, delta_pos)[0]
+
+    def find_prefix(self, prefix):
+        """return the hex shas of all the objects starting with an abbreviated sha"""
+        found = set()
+
+        for objects_dir in self.objects_dirs:
+            directory = os.path.join(objects_dir, prefix[:2])
+            if len(prefix) >= 2 and os.path.isdir(directory):
+                found.update(prefix[:2] + name for name in os.listdir(directory)
+                             if (prefix[:2] + name).startswith(prefix))
+
+        for pack in self.packs:
+            found.update(binascii.hexlify(sha).decode() for sha in pack.find_prefix(prefix))
+
+        return sorted(found)
+
+    # --------------------------------------------------------------------------
+    # Refs and revisions
+
+    def _packed_refs(self):
+        refs = {}
+        path = os.path.join(self.common_dir, 'packed-refs')
+        if os.path.isfile(path):
+            with open(path) as packed_refs:
+                for line in packed_refs:
+                    if line[0] not in '#^':
+                        sha, _, name = line.strip().partition(' ')
+                        refs[name] = sha
+        return refs
+
+    def read_ref(self, name, depth=0):
+        """return the sha a ref points to, None if it does not exist"""
+        if depth > 5:
+            raise GitError('Too many levels of symbolic refs: ' + name)
+
+        for directory in (self.git_dir, self.common_dir):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                with open(path) as ref_file:
+                    value = ref_file.read().strip()
+                if value.startswith('ref: '):
+                    return self.read_ref(value[5:], depth + 1)
+                return _ref_sha(name, value)
+
+        sha = self._packed_refs().get(name)
+        return _ref_sha(name, sha) if sha is not None else None
+
+    def _peel(self, sha):
+        # Dereference annotated tags up to the commit
+        obj_type, data = self.read_object(sha)
+        while obj_type == OBJ_TAG:
+            sha = data.split(b'\n', 1)[0].split(b' ')[1].decode()
+            obj_type, data = self.read_object(sha)
+        return sha, obj_type, data
+
+    def _commit(self, sha):
+        sha, obj_type, data = self._peel(sha)
+        if obj_type != OBJ_COMMIT:
+            raise GitError(sha + ' is not a commit')
+
+        header = data.split(b'\n\n', 1)[0]
+        tree = None
+        parents = []
+        for line in header.split(b'\n'):
+            if line.startswith(b'tree '):
+                tree = line[5:].decode()
+            elif line.startswith(b'parent '):
+                parents.append(line[7:].decode())
+
+        return sha, tree, parents
+
+    def resolve(self, rev):
+        """return the sha of the commit designated by rev, for refs, shas and ^/~ suffixes only"""
+        match = re.match(r'^([^~^:@ ]+)((?:[~^][0-9]*)*)$', rev)
+        if match is None:
+            raise GitError('Unsupported revision: ' + rev)
+
+        base, suffixes = match.groups()
+        sha = None
+
+        # Same order as git for refs, abbreviated and full shas come after
+        for name in (base, 'refs/' + base, 'refs/tags/' + base, 'refs/heads/' + base, 'refs/remotes/' + base,
+                     'refs/remotes/' + base + '/HEAD'):
+            sha = self.read_ref(name)
+            if sha is not None:
+                break
+
+        if sha is None and re.match('^[0-9a-f]{4,40}$', base):
+            candidates = [base] if len(base) == 40 else self.find_prefix(base)
+            if len(candidates) != 1:
+                raise GitError('Unknown or ambiguous revision: ' + rev)
+            sha = candidates[0]
+
+        if sha is None:
+            raise GitError('Unknown revision: ' + rev)
+
+        sha = self._commit(sha)[0]
+
+        for suffix in re.findall(r'[~^][0-9]*', suffixes):
+            count = int(suffix[1:]) if len(suffix) > 1 else 1
+            if suffix[0] == '^':
+                if count > 0:
+                    parents = self._commit(sha)[2]
+                    if len(parents) < count:
+                        raise GitError('Revision has no parent ' + str(count) + ': ' + rev)
+                    sha = parents[count - 1]
+            else:
+                for _ in range(count):
+                    parents = self._commit(sha)[2]
+                    if not parents:
+                        raise GitError('Revision has no parent: ' + rev)
+                    sha = parents[0]
+
+        return sha
+
+    def tree_of(self, rev):
+        # The empty tree can be given directly, like with git
+        if rev == EMPTY_TREE:
+            return rev
+        return self._commit(self.resolve(rev))[1]
+
+    # --------------------------------------------------------------------------
+    # Trees and index
+
+    def tree_entries(self, sha):
+        """return the {name: (mode, sha)} entries of a tree"""
+        entries = {}
+
+        if sha == EMPTY_TREE:
+            return entries
+
+        obj_type, data = self.read_object(sha)
+        if obj_type != OBJ_TREE:
+            raise GitError(sha + ' is not a tree')
+
+        return parse_tree(data)
+
+    def tree_entry(self, sha, path):
+        """return the (mode, sha) of a path in a tree, None if it does not exist"""
+        entry = (MODE_TREE, sha)
+
+        for name in path.split('/'):
+            if entry[0] != MODE_TREE:
+                return None
+            entry = self.tree_entries(entry[1]).get(name)
+            if entry is None:
+                return None
+
+        return entry
+
+    def flatten_tree(self, sha, prefix=''):
+        """return the {path: (mode, sha)} of all the files of a tree"""
+        files = {}
+        for name, (mode, entry_sha) in self.tree_entries(sha).items():
+            if mode == MODE_TREE:
+                files.update(self.flatten_tree(entry_sha, prefix + name + '/'))
+            else:
+                files[prefix + name] = (mode, entry_sha)
+        return files
+
+    def diff_trees(self, old, new, prefix=''):
+        """yield the changes between two trees, without entering identical subtrees"""
+        old_entries = self.tree_entries(old) if old else {}
+        new_entries = self.tree_entries(new) if new else {}
+
+        for name in sorted(set(old_entries) | set(new_entries)):
+            old_entry = old_entries.get(name)
+            new_entry = new_entries.get(name)
+
+            if old_entry == new_entry:
+                continue
+
+            old_tree = old_entry[1] if old_entry and old_entry[0] == MODE_TREE else None
+            new_tree = new_entry[1] if new_entry and new_entry[0] == MODE_TREE else None
+
+            if old_tree or new_tree:
+                for change in self.diff_trees(old_tree, new_tree, prefix + name + '/'):
+                    yield change
+
+                # A file replaced by a directory or the opposite
+                old_entry = None if old_tree else old_entry
+                new_entry = None if new_tree else new_entry
+                if old_entry is None and new_entry is None:
+                    continue
+
+            yield _change(prefix + name, old_entry, new_entry)
+
+    def read_index(self):
+        """return the entries of the index, parsed again only when the file changes"""
+        # Hooks of 'git commit' are given the index being committed, like .git/index.lock with 'commit -a'
+        path = os.path.abspath(os.environ.get('GIT_INDEX_FILE') or os.path.join(self.git_dir, 'index'))
+
+        # No index yet, like in a fresh repository
+        if not os.path.isfile(path):
+            return []
+
+        stat = os.stat(path)
+        stat = (path, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+        if stat != self._index_stat:
+            self._index = self._parse_index(path)
+            self._index_stat = stat
+
+        return self._index
+
+    @staticmethod
+    def _parse_index(path):
+        with open(path, 'rb') as index_file:
+            data = index_file.read()
+
+        signature, version, count = struct.unpack('>4sII', data[:12])
+        if signature != b'DIRC' or version not in (2, 3, 4):
+            raise GitError('Unsupported index version')
+
+        entries = []
+        pos = 12
+        previous_path = b''
+
+        for _ in range(count):
+            mode = struct.unpack('>I', data[pos + 24:pos + 28])[0]
+            sha = binascii.hexlify(data[pos + 40:pos + 60]).decode()
+            flags = struct.unpack('>H', data[pos + 60:pos + 62])[0]
+            path_pos = pos + 62
+            intent_to_add = False
+
+            if flags & 0x4000:
+                extended_flags = struct.unpack('>H', data[path_pos:path_pos + 2])[0]
+                intent_to_add = bool(extended_flags & 0x2000)
+                path_pos += 2
+
+            if version == 4:
+                strip, path_pos = _offset_varint(data, path_pos)
+                end = data.index(b'\0', path_pos)
+                path = previous_path[:len(previous_path) - strip] + data[path_pos:end]
+                pos = end + 1
+            else:
+                end = data.index(b'\0', path_pos)
+                path = data[path_pos:end]
+                # Entries are padded with 1 to 8 NUL bytes
+                pos += (end - pos + 8) & ~7
+
+            previous_path = path
+
+            if not intent_to_add:
+                entries.append(IndexEntry(mode, sha, (flags >> 12) & 3, path.decode()))
+
+        # Extensions, up to the trailing checksum
+        while pos < len(data) - 20:
+            signature, size = struct.unpack('>4sI', data[pos:pos + 8])
+            if signature in (b'link', b'sdir'):
+                raise GitError('Split and sparse indexes are not supported')
+            pos += 8 + size
+
+        return entries
+
+    def diff_index(self, rev):
+        """yield the changes between the tree of rev and the index, like 'git diff-index --cached'"""
+        tree = self.flatten_tree(self.tree_of(rev))
+        staged = set()
+
+        for entry in self.read_index():
+            # Unmerged entries are not listed
+            if entry.stage != 0:
+                staged.add(entry.path)
+                continue
+
+            staged.add(entry.path)
+            old_entry = tree.get(entry.path)
+            new_entry = (entry.mode, entry.sha1)
+
+            if old_entry != new_entry:
+                yield _change(entry.path, old_entry, new_entry)
+
+        for path in sorted(set(tree) - staged):
+            yield _change(path, tree[path], None)
+
+
+# ------------------------------------------------------------------------------
+
+def parse_tree(data):
+    """return the {name: (mode, sha)} entries of the data of a tree object"""
+    entries = {}
+
+    pos = 0
+    while pos < len(data):
+        space = data.index(b' ', pos)
+        nul = data.index(b'\0', space)
+        entries[data[space + 1:nul].decode()] = (int(data[pos:space], 8),
+                                                 binascii.hexlify(data[nul + 1:nul + 21]).decode())
+        pos = nul + 21
+
+    return entries
+
+
+def _ref_sha(name, value):
+    # Like FETCH_HEAD, some refs have more than a sha: "<sha>\t\tbranch 'master' of <url>"
+    sha = value.split(None, 1)[0] if value else ''
+    if not re.match('^[0-9a-f]{40}$', sha):
+        raise GitError('Unsupported ref value of ' + name)
+    return sha
+
+
+def _change(path, old_entry, new_entry):
+    null = '0' * 40
+    old_mode, old_sha = old_entry if old_entry else (0, null)
+    new_mode, new_sha = new_entry if new_entry else (0, null)
+
+    if old_entry is None:
+        status = 'A'
+    elif new_entry is None:
+        status = 'D'
+    elif (old_mode & 0o170000) != (new_mode & 0o170000):
+        status = 'T'
+    else:
+        status = 'M'
+
+    return DiffEntry('%06o' % old_mode, '%06o' % new_mode, old_sha, new_sha, status, path, path)
+
+
+# ------------------------------------------------------------------------------
+
+# Environment variables moving the repository or its objects, only git follows them
+ENVIRONMENT = ('GIT_DIR', 'GIT_WORK_TREE', 'GIT_COMMON_DIR', 'GIT_OBJECT_DIRECTORY', 'GIT_ALTERNATE_OBJECT_DIRECTORIES',
+               'GIT_QUARANTINE_PATH', 'GIT_CEILING_DIRECTORIES', 'GIT_NAMESPACE', 'GIT_REPLACE_REF_BASE')
+
+
+def overridden():
+    """true if the repository is set by environment variables the in-process reader does not follow"""
+    return any(name in os.environ for name in ENVIRONMENT)
+
+
+def discover(path):
+    """return (root, git dir, common dir) of the working tree containing path, None if it cannot be found
+    without git (bare repositories, GIT_DIR environment variables, core.worktree, ...)"""
+    if overridden():
+        return None
+
+    directory = os.path.realpath(path)
+
+    while True:
+        dot_git = os.path.join(directory, '.git')
+
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+            break
+
+        if os.path.isfile(dot_git):
+            # Worktrees and submodules: "gitdir: <path>"
+            with open(dot_git) as dot_git_file:
+                content = dot_git_file.read().strip()
+            if not content.startswith('gitdir: '):
+                return None
+            git_dir = os.path.normpath(os.path.join(directory, content[8:]))
+            break
+
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+    if not os.path.isfile(os.path.join(git_dir, 'HEAD')):
+        return None
+
+    common_dir = git_dir
+    commondir_path = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_path):
+        with open(commondir_path) as commondir_file:
+            common_dir = os.path.normpath(os.path.join(git_dir, commondir_file.read().strip()))
+
+    # A working tree configured elsewhere
+    config_path = os.path.join(common_dir, 'config')
+    if os.path.isfile(config_path):
+        with open(config_path, 'rb') as config_file:
+            if re.search(rb'^\s*worktree\s*=', config_file.read(), re.MULTILINE | re.IGNORECASE):
+                return None
+
+    return directory, git_dir, common_dir
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Timings of a sheldon run, reported with --profile.
+
+The report gives the wall and CPU time of each hook and of each file, the launched commands, the use of the results
+cache and the peak memory. CPU times include the processes launched and waited for, like uncrustify.
+
+Nothing is measured unless profiling is enabled: sheldon and the hooks only check g_profile, and subprocess.Popen is
+only replaced by a timed version once enabled.
+"""
+
+import collections
+import contextlib
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import common
+
+g_profile = None
+
+
+def cpu_time():
+    """return the CPU time of this process and of its waited children"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def command_name(args):
+    """return the program of a command, with the git command for git"""
+    if isinstance(args, (str, bytes)):
+        args = args.split()
+    args = [arg.decode() if isinstance(arg, bytes) else str(arg) for arg in args]
+
+    name = os.path.basename(args[0])
+
+    if name == 'git':
+        options = iter(args[1:])
+        for arg in options:
+            if arg in ('-C', '-c'):
+                next(options, None)
+            elif not arg.startswith('-'):
+                return 'git ' + arg
+
+    return name
+
+
+class TimedPopen(subprocess.Popen):
+    """Popen recording the duration of the process, until it is waited for"""
+
+    def __init__(self, args, *popen_args, **kwargs):
+        self.profile_name = command_name(args)
+        self.profile_start = time.perf_counter()
+        self.profile_recorded = False
+        super().__init__(args, *popen_args, **kwargs)
+
+    def _record(self):
+        if self.returncode is not None and not self.profile_recorded and g_profile is not None:
+            self.profile_recorded = True
+            g_profile.command(self.profile_name, time.perf_counter() - self.profile_start)
+
+    def poll(self):
+        returncode = super().poll()
+        self._record()
+        return returncode
+
+    def wait(self, timeout=None):
+        returncode = super().wait(timeout)
+        self._record()
+        return returncode
+
+
+# ------------------------------------------------------------------------------
+
+class Usage(object):
+    """Resources used by a part of the run, possibly in a worker process"""
+
+    def __init__(self):
+        self.commands = dict(g_profile.commands) if g_profile is not None else {}
+        self.wall = time.perf_counter()
+        self.cpu = cpu_time()
+
+    def stop(self):
+        """return the wall time, the CPU time and the commands run since the creation"""
+        commands = {}
+        if g_profile is not None:
+            for name, (count, duration) in g_profile.commands.items():
+                before = self.commands.get(name, (0, 0.0))
+                if count != before[0]:
+                    commands[name] = (count - before[0], duration - before[1])
+
+        return time.perf_counter() - self.wall, cpu_time() - self.cpu, commands
+
+
+class Profile(object):
+    def __init__(self, top):
+        self.top = top
+        self.usage = Usage()
+        # name: [wall, cpu]
+        self.hooks = collections.OrderedDict()
+        # (hook, path): [wall, cpu]
+        self.files = collections.OrderedDict()
+        # program: (count, duration)
+        self.commands = collections.OrderedDict()
+        # hook: [hits, misses]
+        self.cache = collections.OrderedDict()
+
+    def hook(self, name, wall, cpu):
+        total = self.hooks.setdefault(name, [0.0, 0.0])
+        total[0] += wall
+        total[1] += cpu
+
+    def file(self, hook, path, wall, cpu):
+        total = self.files.setdefault((hook, path), [0.0, 0.0])
+        total[0] += wall
+        total[1] += cpu
+
+    def command(self, name, duration):
+        count, total = self.commands.get(name, (0, 0.0))
+        self.commands[name] = (count + 1, total + duration)
+
+    def remote(self, hook, path, usage):
+        """add the usage of a file checked in a worker process"""
+        wall, cpu, commands = usage
+        self.file(hook, path, wall, cpu)
+
+        # The CPU time of workers is not counted in the one of this process
+        self.hook(hook, 0.0, cpu)
+        for name, (count, duration) in commands.items():
+            total = self.commands.get(name, (0, 0.0))
+            self.commands[name] = (total[0] + count, total[1] + duration)
+
+    def cached(self, hook, hit):
+        self.cache.setdefault(hook, [0, 0])[0 if hit else 1] += 1
+
+    def report(self):
+        wall, cpu, commands = self.usage.stop()
+        files = collections.Counter(hook for hook, path in self.files)
+
+        common.note('Profile :')
+        common.note('  Total: %.3fs wall, %.3fs CPU' % (wall, cpu))
+
+        common.note('  %-24s %10s %10s %7s %12s' % ('Hook', 'Wall', 'CPU', 'Files', 'Cache hits'))
+        for name, (hook_wall, hook_cpu) in self.hooks.items():
+            hits, misses = self.cache.get(name, (0, 0))
+            rate = '%d/%d' % (hits, hits + misses) if hits + misses else '-'
+            common.note('  %-24s %9.3fs %9.3fs %7d %12s' % (name, hook_wall, hook_cpu, files[name], rate))
+
+        common.note('  %-24s %10s %10s' % ('Command', 'Count', 'Duration'))
+        for name, (count, duration) in sorted(self.commands.items(), key=lambda item: -item[1][1]):
+            common.note('  %-24s %10d %9.3fs' % (name, count, duration))
+
+        traced = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+        common.note('  Peak memory: %.1f MB allocated by python, %.1f MB resident' % (
+            traced / 1024 ** 2, resident_peak() / 1024 ** 2))
+
+        slowest = sorted(self.files.items(), key=lambda item: -item[1][0])[:self.top]
+        if slowest:
+            common.note('  Slowest files:')
+            for (hook, path), (file_wall, file_cpu) in slowest:
+                common.note('  %9.3fs %9.3fs  %-14s %s' % (file_wall, file_cpu, hook, path))
+
+
+def resident_peak():
+    """return the peak resident memory of this process in bytes, 0 if it is not known"""
+    try:
+        import resource
+    except ImportError:
+        return 0
+
+    # Bytes on macOS, kilobytes elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# ------------------------------------------------------------------------------
+
+def enable(top):
+    global g_profile
+
+    tracemalloc.start()
+    subprocess.Popen = TimedPopen
+    g_profile = Profile(top)
+
+
+@contextlib.contextmanager
+def _measure_hook(name):
+    usage = Usage()
+    try:
+        yield
+    finally:
+        wall, cpu, commands = usage.stop()
+        g_profile.hook(name, wall, cpu)
+
+
+@contextlib.contextmanager
+def _not_measured():
+    # contextlib.nullcontext needs python 3.7
+    yield
+
+
+def hook(name):
+    """return a context measuring the time spent by a hook, doing nothing unless profiling"""
+    return _measure_hook(name) if g_profile is not None else _not_measured()
+
+
+def files(name, checked_files):
+    """yield the files, measuring the time spent by a hook on each of them. Return them as is unless profiling"""
+    if g_profile is None:
+        return checked_files
+    return _measure_files(name, checked_files)
+
+
+def _measure_files(name, checked_files):
+    for f in checked_files:
+        usage = Usage()
+        yield f
+        wall, cpu, commands = usage.stop()
+        g_profile.file(name, f.path, wall, cpu)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Order of the checks for --fail-fast, so a failing check gives its answer as soon as possible, and split of the files
+between the shards of a check run by several CI runners.
+
+The cost of each hook is learnt from the previous runs, in seconds per checked file, and the hooks are run from the
+cheapest to the most expensive: the forbidden tokens and the file size before uncrustify and cppcheck. The files which
+failed in the previous runs are checked first, being the most likely to fail again.
+
+The costs and the failed files are stored in the git common directory, next to the results cache.
+
+Shards cannot rely on learnt costs, which differ from one runner to another: every runner computes the same split of
+the files from their paths and sizes only.
+
+A time budget stops the checks the same way as an error with --fail-fast, for a server hook which must not hold a
+push for long.
+"""
+
+import json
+import os
+import time
+
+import common
+
+# Seconds per file of the hooks never measured
+DEFAULT_COSTS = {
+    'filesize': 0.00005,
+    'crlf': 0.0001,
+    'cr': 0.0001,
+    'tab': 0.0001,
+    'lgpl': 0.0001,
+    'bsd': 0.0001,
+    'oslmlog': 0.0001,
+    'digraphs': 0.0001,
+    'doxygen': 0.0001,
+    'badwords': 0.0002,
+    'check_xml': 0.001,
+    'codingstyle': 0.02,
+    'cppcheck': 0.2,
+}
+
+# Hooks not run on each file, their cost is the one of a whole run
+RUN_COSTS = {
+    'check_commit': 0.005,
+}
+
+# Weight of the last run in the learnt costs
+LEARNING_RATE = 0.5
+
+# Failed files remembered, the most recent first
+MAX_FAILURES = 1000
+
+# Weight of each file in the shards besides its size, in bytes: the hooks launch processes for each file
+FILE_WEIGHT = 64 * 1024
+
+
+class Schedule(object):
+    def __init__(self, path):
+        self.path = path
+        self.costs = {}
+        self.failures = []
+
+        try:
+            with open(path) as costs_file:
+                state = json.load(costs_file)
+            self.costs = dict(state.get('costs', {}))
+            self.failures = list(state.get('failures', []))
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def cost(self, name, count):
+        """return the expected duration of a hook checking count files"""
+        if name in RUN_COSTS:
+            return self.costs.get(name, RUN_COSTS[name])
+        return self.costs.get(name, DEFAULT_COSTS.get(name, 0.001)) * count
+
+    def order_hooks(self, names, count):
+        """return the names of the hooks checking count files, the cheapest first"""
+        return sorted(names, key=lambda name: self.cost(name, count))
+
+    def order_files(self, files):
+        """return the files, the ones which failed recently first"""
+        rank = {path: i for i, path in enumerate(self.failures)}
+        return sorted(files, key=lambda f: rank.get(f.path, len(rank)))
+
+    def measure(self, name, duration, count):
+        """learn the cost of a hook from a complete run on count files"""
+        if name not in RUN_COSTS:
+            if count == 0:
+                return
+            duration /= count
+
+        previous = self.costs.get(name)
+        self.costs[name] = duration if previous is None else previous + LEARNING_RATE * (duration - previous)
+
+    def save(self, checked, failed):
+        """remember the failed files, forgetting the other checked ones"""
+        failed = sorted(failed)
+        checked = set(checked) | set(failed)
+        self.failures = (failed + [path for path in self.failures if path not in checked])[:MAX_FAILURES]
+
+        # Written aside then renamed, a concurrent run reads the previous state or the new one
+        temporary_path = '%s.%d' % (self.path, os.getpid())
+        try:
+            with open(temporary_path, 'w') as costs_file:
+                json.dump({'costs': self.costs, 'failures': self.failures}, costs_file)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            common.trace('Cannot save the costs of the hooks: ' + str(e))
+
+
+def open_schedule(repo):
+    if not repo.common_dir:
+        return None
+
+    directory = os.path.join(repo.common_dir, 'sheldon')
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        common.trace('Cannot save the costs of the hooks: ' + str(e))
+        return None
+
+    return Schedule(os.path.join(directory, 'costs.json'))
+
+
+# ------------------------------------------------------------------------------
+
+def shard(files, index, count, base=None):
+    """return the files of a shard, index being from 1 to count.
+    The heaviest files are given first, each to the shard with the least weight, so the shards are balanced. Files of
+    the same size are ordered by a hash of their path, relative to base if given, so every runner computes the same
+    split wherever the repository is."""
+    import heapq
+    import zlib
+
+    def name(f):
+        return os.path.relpath(f.path, base) if base is not None else f.path
+
+    loads = [(0, i) for i in range(1, count + 1)]
+    selected = set()
+
+    for f in sorted(files, key=lambda f: (-(f.size or 0), zlib.crc32(name(f).encode()), name(f))):
+        load, i = heapq.heappop(loads)
+        if i == index:
+            selected.add(f.path)
+        heapq.heappush(loads, (load + (f.size or 0) + FILE_WEIGHT, i))
+
+    return [f for f in files if f.path in selected]
+
+
+# ------------------------------------------------------------------------------
+
+# Set from the command line: stop at the first error, and time.monotonic() after which nothing more is checked
+g_fail_fast = False
+g_deadline = None
+# Set once checks were skipped
+g_interrupted = False
+
+
+def failed():
+    """true once an error has been reported"""
+    return common.g_errors > 0
+
+
+def out_of_time():
+    """true once the time budget is spent"""
+    return g_deadline is not None and time.monotonic() > g_deadline
+
+
+def stopped():
+    """true if the next checks have to be skipped, which is remembered"""
+    global g_interrupted
+
+    if (g_fail_fast and failed()) or out_of_time():
+        g_interrupted = True
+    return g_interrupted
+
+
+def interrupted():
+    """true if checks were skipped, a run ending just after the deadline was not"""
+    return g_interrupted
+
+
+def until_stopped(files):
+    """yield the files until an error is reported with --fail-fast, or until the time budget is spent"""
+    for f in files:
+        if stopped():
+            return
+        yield f
@@ -9,6 +9,9 @@ from common import FormatReturn
 
 g_libs = []
 g_bundles = []
+g_projects = None
+# Directories whose modification means libraries or bundles were added or removed
+g_watched_dirs = set()
 
 
 def find_current_library(path):
@@ -42,27 +45,66 @@ def find_current_library(path):
     return lib_name
 
 
-def find_libraries_and_bundles(fw4spl_projects):
+def _add_module(root):
+    """add the library or bundle of a directory holding a CMakeLists.txt, return False if it is neither"""
+    rootdir = os.path.split(root)[1]
+
+    if re.match('.*Bundles', root):
+        g_bundles.append(rootdir.encode())
+    elif re.match('.*SrcLib', root):
+        g_libs.append(rootdir.encode())
+    else:
+        return False
+
+    return True
+
+
+def find_libraries_and_bundles(fw4spl_projects, revisions=None):
     global g_libs
     global g_bundles
+    global g_projects
+    global g_watched_dirs
+
+    # Walking the projects is costly, only do it again if they changed
+    if g_projects == (sorted(fw4spl_projects), revisions):
+        return
+    g_projects = (sorted(fw4spl_projects), revisions)
 
     g_libs = []
     g_bundles = []
+    g_watched_dirs = set(fw4spl_projects)
+
+    # Without a working tree, the modules of the repository are the ones of the checked commits
+    excluded = None
+    if revisions:
+        excluded = common.get_repo_root() or None
+
+        for path in common.tree_paths(revisions):
+            root, name = os.path.split(path)
+            if name == "CMakeLists.txt" and not os.path.split(root)[1].startswith("."):
+                _add_module(root)
 
     for project_dir in fw4spl_projects:
         if not os.path.isdir(project_dir):
             common.warn("%s isn't a valid directory." % project_dir)
             continue
         for root, dirs, files in os.walk(project_dir):
+            if excluded is not None:
+                dirs[:] = [d for d in dirs if os.path.join(root, d) != excluded]
+
             rootdir = os.path.split(root)[1]
             # Do not inspect hidden folders
             if not rootdir.startswith("."):
                 for file in files:
                     if file == "CMakeLists.txt":
-                        if re.match('.*Bundles', root):
-                            g_bundles += [rootdir.encode()]
-                        elif re.match('.*SrcLib', root):
-                            g_libs += [rootdir.encode()]
+                        if not _add_module(root):
+                            continue
+
+                        # Libraries or bundles added or removed change the modification time of these parents
+                        parent = os.path.dirname(root)
+                        while parent.startswith(project_dir) and parent not in g_watched_dirs:
+                            g_watched_dirs.add(parent)
+                            parent = os.path.dirname(parent)
 
     g_libs.sort()
     g_bundles.sort()
@@ -94,7 +136,7 @@ def sort_includes(path, enable_reformat):
         common.warn('Failed to find current library for file ' + path + ', includes order might be wrong.\n')
         cur_lib = '!!NOTFOUND!!'
 
-    pathname = os.path.dirname(__file__) + "/"
+    pathname = common.data_dir() + "/"
 
     file = open(pathname + "std_headers.txt", 'rb')
     lib_std = file.read()
@@ -115,6 +157,8 @@ def sort_includes(path, enable_reformat):
             if out_of_include:
                 common.warn(
                     'Failed to parse includes in file ' + path + ', includes sort is skipped. Maybe there is a #ifdef ? This may be handled in a future version.\n')
+                common.diagnostic('codingstyle', os.path.relpath(path, common.worktree_root()), i + 1, 'warning',
+                                  'Failed to parse includes, includes sort is skipped')
                 return FormatReturn.NotModified
 
             if first_line == -1:
@@ -195,6 +239,8 @@ def sort_includes(path, enable_reformat):
             return FormatReturn.Modified
         else:
             common.error('Include headers are not correctly sorted in file : ' + path + '.')
+            common.diagnostic('codingstyle', os.path.relpath(path, common.worktree_root()), first_line + 1, 'error',
+                              'Include headers are not correctly sorted', fix=True)
             return FormatReturn.Error
 
     return FormatReturn.NotModified
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import functools
+import os
+import shutil
+import tempfile
+import unittest
+
+import cache
+import codingstyle
+import common
+import forbidtoken
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cache_eviction(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        results_cache = cache.ResultCache(os.path.join(self.directory, 'results.db'), 200)
+
+        for i in range(10):
+            results_cache.put(results_cache.key('hook', i), {'result': False, 'messages': []})
+
+        # Use the first result so it is not evicted
+        self.assertIsNotNone(results_cache.get(results_cache.key('hook', 0)), "Result should be in cache.")
+        results_cache.close()
+
+        results_cache = cache.ResultCache(os.path.join(self.directory, 'results.db'), 200)
+        self.assertIsNotNone(results_cache.get(results_cache.key('hook', 0)), "Recently used result was evicted.")
+        self.assertIsNone(results_cache.get(results_cache.key('hook', 1)), "Least recently used result was kept.")
+        self.assertEqual(results_cache.hits, 1)
+        self.assertEqual(results_cache.misses, 1)
+        results_cache.close()
+
+    def test_concurrent_use(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        path = os.path.join(self.directory, 'results.db')
+        first = cache.ResultCache(path, 1024 ** 2)
+        first.put(first.key('first'), {'result': False, 'messages': []})
+        self.assertIsNotNone(first.get(first.key('first')))
+
+        # Another run, like from another worktree, is not locked out while the first one is still open
+        second = cache.ResultCache(path, 1024 ** 2)
+        second.db.execute('PRAGMA busy_timeout = 100')
+        self.assertIsNotNone(second.get(second.key('first')), "Results of a running check should be shared.")
+        second.put(second.key('second'), {'result': True, 'messages': []})
+        second.close()
+
+        self.assertIsNotNone(first.get(first.key('second')), "Results of the other check should be shared.")
+        first.close()
+
+    def test_run_hook(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        results_cache = cache.ResultCache(os.path.join(self.directory, 'results.db'), 1024 ** 2)
+        hook = forbidtoken.hooks['tab']
+
+        def run(function):
+            files = list(common.file_on_disk(dir_path + '/data/forbidtoken_tab.cpp'))
+            with common.capture() as messages:
+                result = function(files)
+            return result, [list(m) for m in messages if m[0] != 'trace']
+
+        expected = run(hook)
+        result, messages = run(lambda files: cache.run_hook(results_cache, 'tab', hook, files,
+                                                             lambda f: [f.sha1, f.path]))
+        self.assertTrue(result, "tab were not detected in test file.")
+        self.assertEqual(messages, expected[1], "Messages should be the ones of the hook checking its files.")
+        self.assertEqual(results_cache.misses, 1)
+
+        # The second run must give the same messages without checking the file
+        cached = run(lambda files: cache.run_hook(results_cache, 'tab', hook, files, lambda f: [f.sha1, f.path]))
+        self.assertEqual(cached, (result, messages), "Cached result or messages differ.")
+        self.assertEqual(results_cache.hits, 1)
+
+        results_cache.close()
+
+    def test_run_codingstyle(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        # The libraries and bundles of the fw4spl projects are part of the key
+        project = os.path.join(self.directory, 'project')
+        for module in ('SrcLib/core/fwCore', 'Bundles/core/gui'):
+            os.makedirs(os.path.join(project, module))
+            open(os.path.join(project, module, 'CMakeLists.txt'), 'w').close()
+
+        fw4spl_projects = codingstyle.fw4spl_projects
+        codingstyle.fw4spl_projects = lambda: [project]
+        self.addCleanup(setattr, codingstyle, 'fw4spl_projects', fw4spl_projects)
+        self.assertEqual(codingstyle.cache_key()[1:], [['fwCore'], ['gui']])
+
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        results_cache = cache.ResultCache(os.path.join(self.directory, 'results.db'), 1024 ** 2)
+        hook = functools.partial(codingstyle.codingstyle, enable_reformat=False, check_lgpl=True,
+                                 check_commits_date=False)
+
+        def run():
+            files = list(common.directory_on_disk(dir_path + '/data/Codingstyle/Formatted'))
+            with common.capture():
+                return cache.run_hook(results_cache, 'codingstyle', hook, files,
+                                      lambda f: [f.sha1, f.path, f.status] + codingstyle.cache_key()), len(files)
+
+        result, count = run()
+        self.assertEqual(results_cache.misses, count)
+        self.assertEqual(run()[0], result, "Cached result differs.")
+        self.assertEqual(results_cache.hits, count)
+
+        results_cache.close()
+
+    def test_run_hook_in_workers(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        hook = forbidtoken.hooks['tab']
+        names = ['forbidtoken_tab.cpp', 'forbidtoken_lf.cpp', 'check_xml_valid.xml', 'forbidtoken_tab.cpp']
+
+        def run(function):
+            files = [f for name in names for f in common.file_on_disk(dir_path + '/data/' + name)]
+            with common.capture() as messages:
+                result = function(files)
+            return result, messages
+
+        expected = run(hook)
+
+        with concurrent.futures.ProcessPoolExecutor(2) as pool:
+            result, messages = run(lambda files: cache.run_hook(None, 'tab', hook, files, None, pool))
+
+        self.assertTrue(result, "tab were not detected.")
+        self.assertEqual(messages, expected[1], "Messages should be the ones of the hook checking its files in turn.")
+        self.assertEqual([line for level, line in messages if level == 'note'][-1], '* [Sheldon] 4 file(s) checked.',
+                         "Files should be counted once for all.")
+
+        # Asking to stop once every file is checked would take the check as interrupted
+        asked = []
+        with concurrent.futures.ProcessPoolExecutor(2) as pool:
+            run(lambda files: cache.run_hook(None, 'tab', hook, files, None, pool, lambda: asked.append(True)))
+
+        self.assertEqual(len(asked), 2 * len(names) - 1, "Stop should be asked before each file and between results.")
+
+
+if __name__ == '__main__':
+    unittest.main()
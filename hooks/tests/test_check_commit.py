@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import shutil
+import tempfile
 import unittest
 
 import check_commit
@@ -58,6 +61,27 @@ class TestCheckCommit(unittest.TestCase):
         # Check result
         self.assertTrue(any(result), "An invalid commit has not been detected as invalid")
 
+    def test_commit_in_push(self):
+        repo = tempfile.mkdtemp()
+        cwd = os.getcwd()
+
+        try:
+            common.execute_command('git init -q ' + repo)
+            os.chdir(repo)
+            git = 'git -c user.name=a -c user.email=a@b.c '
+            common.execute_command(git + 'commit -q --allow-empty -m first')
+            pushed = common.execute_command(git + 'commit-tree -m pushed -p HEAD HEAD^{tree}').out.decode().strip()
+
+            # Only the commits not reachable from any ref yet are pushed
+            messages = check_commit.commit_in_push([pushed])
+            self.assertEqual([message.split(':')[2] for message in messages], ['pushed'], "Wrong pushed commits.")
+
+            # Commits which cannot be listed must not be taken as nothing to check
+            self.assertIsNone(check_commit.commit_in_push(['0123456789' * 4]))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(repo)
+
 
 if __name__ == '__main__':
     unittest.main()
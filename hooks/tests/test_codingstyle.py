@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import datetime
 import filecmp
 import os
 import shutil
+import subprocess
+import tempfile
+import time
 import unittest
 
 import codingstyle
 import common
+import sortincludes
 
 
 class TestCodingstyle(unittest.TestCase):
@@ -150,5 +155,85 @@ class TestCodingstyle(unittest.TestCase):
         self.assertTrue(len(reformatted) > 0, "Some files should have been fixed.")
 
 
+    def test_license_year_newer_than_file(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        header = codingstyle.LICENSE.replace('(.*)', '%s').replace('\\', '')
+        year = datetime.date.today().year
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'file.cpp')
+
+        try:
+            with open(path, 'w') as source_file:
+                source_file.write(header % ('2015-%d' % year) + '\n\nint a;\n')
+
+            # Last modified before the year of the header
+            modified = time.mktime((2016, 6, 1, 0, 0, 0, 0, 0, -1))
+            os.utime(path, (modified, modified))
+
+            with common.capture():
+                result = codingstyle.fix_license_year(path, False, 'M', False)
+            self.assertEqual(result, common.FormatReturn.Error,
+                             "A license year newer than the last modification of the file should be reported.")
+
+            result = codingstyle.fix_license_year(path, True, 'M', False)
+            self.assertEqual(result, common.FormatReturn.Modified, "The license year should be fixed.")
+            with open(path) as source_file:
+                self.assertIn('IRCAD, 2015-2016.', source_file.read(), "The year should be the one of the file.")
+        finally:
+            shutil.rmtree(directory)
+
+    def test_checked_revisions(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        parent = tempfile.mkdtemp()
+        repo = os.path.join(parent, 'fw4spl')
+        cwd = os.getcwd()
+
+        def write(path, content):
+            path = os.path.join(repo, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as output_file:
+                output_file.write(content)
+
+        def commit(date):
+            env = dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+            subprocess.check_output(['git', '-C', repo, 'add', '-A'])
+            subprocess.check_output(['git', '-C', repo, '-c', 'user.name=a', '-c', 'user.email=a@b.c', 'commit', '-q',
+                                     '-m', 'commit'], env=env)
+
+        try:
+            subprocess.check_output(['git', 'init', '-q', repo])
+            write('SrcLib/core/fwCore/CMakeLists.txt', '')
+            write('a.cpp', 'int a;\n')
+            commit('2016-06-01T00:00:00')
+
+            # Checked commit, not the one of the working tree
+            subprocess.check_output(['git', '-C', repo, 'checkout', '-q', '-b', 'other'])
+            write('Bundles/gui/CMakeLists.txt', '')
+            write('a.cpp', 'int b;\n')
+            commit('2019-06-01T00:00:00')
+            subprocess.check_output(['git', '-C', repo, 'checkout', '-q', '-'])
+            write('SrcLib/core/fwStale/CMakeLists.txt', '')
+
+            os.chdir(repo)
+            common.forget_run_state()
+            common.g_checked_revisions = ['other']
+
+            sortincludes.find_libraries_and_bundles([parent], common.g_checked_revisions)
+            self.assertEqual((sortincludes.g_libs, sortincludes.g_bundles), ([b'fwCore'], [b'gui']),
+                             "Modules of the repository should be the ones of the checked commit.")
+
+            common.commit_date_index().add(['a.cpp'])
+            self.assertEqual(common.commit_date_index().datetime(os.path.join(repo, 'a.cpp')).year, 2019,
+                             "Dates should be the ones of the checked commit.")
+        finally:
+            common.forget_run_state()
+            sortincludes.g_projects = None
+            os.chdir(cwd)
+            shutil.rmtree(parent)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import functools
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+
+
+class TestCommon(unittest.TestCase):
+    def test_blob_reader(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        # Hash a file known by git
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        file_path = dir_path + '/data/check_xml_valid.xml'
+        sha = common.execute_command('git hash-object ' + file_path).out.strip().decode()
+
+        with open(file_path, 'rb') as content_file:
+            expected = content_file.read()
+
+        # Read it twice through the same process
+        reader = common.BlobReader()
+        try:
+            for _ in range(2):
+                size, content = reader.read(sha)
+                self.assertEqual(size, len(expected), "Wrong blob size.")
+                self.assertEqual(content, expected, "Wrong blob content.")
+
+            # Unknown objects should not break the stream
+            size, content = reader.read('0' * 40)
+            self.assertEqual(size, 0, "Missing blob should have no size.")
+
+            size, content = reader.read(sha)
+            self.assertEqual(content, expected, "Wrong blob content after a missing object.")
+
+            # Sizes are read through the same process
+            self.assertEqual(reader.size(sha), len(expected), "Wrong blob size.")
+            self.assertEqual(reader.size('0' * 40), 0, "Missing blob should have no size.")
+            self.assertEqual(reader.read(sha), (len(expected), expected), "Wrong blob after its size.")
+        finally:
+            reader.close()
+
+    def test_status_index(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        index = common.StatusIndex(dir_path + '/data')
+
+        self.assertTrue(index.in_repository, "Test data should be in a git repository.")
+        self.assertTrue(index.covers(dir_path + '/data/check_xml_valid.xml'), "File should be covered by the index.")
+        self.assertFalse(index.covers(dir_path), "Parent directory should not be covered by the index.")
+        self.assertNotEqual(index.status(dir_path + '/data/check_xml_valid.xml'), 'D', "File should not be deleted.")
+
+    def test_config_snapshot(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        snapshot = common.ConfigSnapshot()
+        snapshot.values = {
+            'codingstyle-hook.sort-includes': 'Off',
+            'codingstyle-hook.uncrustify-path': '~/bin/uncrustify',
+            'fw4spl-hooks.Sub.flag': None,
+        }
+
+        self.assertEqual(snapshot.get('codingstyle-hook.sort-includes', 'true', type='--bool'), 'false')
+        self.assertEqual(snapshot.get('CodingStyle-Hook.Sort-Includes', 'true'), 'Off')
+        self.assertEqual(snapshot.get('codingstyle-hook.uncrustify-path', 'uncrustify', type='--path'),
+                         os.path.expanduser('~/bin/uncrustify'))
+        self.assertEqual(snapshot.get('fw4spl-hooks.Sub.FLAG', 'false', type='--bool'), 'true')
+        self.assertEqual(snapshot.get('fw4spl-hooks.sub.flag', 'default'), 'default')
+        self.assertEqual(snapshot.get('filesize-hook.max-size', 1024), 1024)
+
+    def test_lazy_file_on_disk(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        file_path = dir_path + '/data/forbidtoken_tab.cpp'
+
+        with open(file_path, 'rb') as content_file:
+            expected = content_file.read()
+
+        f = next(common.file_on_disk(file_path))
+
+        # Nothing is loaded until the contents are needed
+        self.assertIsNone(f._buffer, "Contents should not be loaded yet.")
+        self.assertEqual(f.size, len(expected), "Wrong file size.")
+        self.assertIsNone(f._buffer, "Size should not load the contents.")
+
+        self.assertEqual(f.contents, expected, "Wrong file contents.")
+        self.assertFalse(common.binary(f.buffer), "Text file detected as binary.")
+
+        f.release()
+        self.assertIsNone(f._buffer, "Contents should have been released.")
+        self.assertEqual(f.contents, expected, "Contents should be loaded again after release.")
+        f.release()
+
+    def test_commit_date_index(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        committed = dir_path + '/data/check_xml_valid.xml'
+        unknown = dir_path + '/data/not_committed.xml'
+
+        index = common.CommitDateIndex()
+        index.add([os.path.relpath(p, common.get_repo_root()) for p in (committed, unknown)])
+
+        self.assertIsNotNone(index.datetime(committed), "Committed file should have a date.")
+        self.assertIsNone(index.datetime(unknown), "Unknown file should not have a date.")
+        self.assertFalse(index.pending, "All registered files should have been resolved at once.")
+
+    def test_directory_on_disk(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        dir_path = os.path.dirname(os.path.realpath(__file__)) + '/data'
+
+        expected = set()
+        for root, dirs, files in os.walk(dir_path):
+            expected.update(os.path.join(root, name) for name in files)
+
+        files = list(common.directory_on_disk(dir_path))
+
+        self.assertEqual(set(f.path for f in files), expected, "Wrong list of files.")
+
+        # The index sha1 is known for unmodified tracked files
+        for f in files:
+            if f.sha1:
+                sha1 = common.execute_command('git hash-object ' + f.path).out.strip().decode()
+                self.assertEqual(f.sha1, sha1, "Wrong sha1 for " + f.path)
+
+    def test_text_and_lines(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        f = common.FileAtIndex(b'first\nsecond\r\n\nlast', 22, '', '', 'A', 'test.cpp')
+
+        self.assertFalse(f.binary, "Text detected as binary.")
+        self.assertEqual(f.text, 'first\nsecond\r\n\nlast')
+        self.assertEqual(f.line_offsets, [0, 6, 14, 15])
+        self.assertEqual(f.line_number(0), 1)
+        self.assertEqual(f.line_number(f.text.index('\r')), 2)
+        self.assertEqual(f.line_number(f.text.index('last')), 4)
+        self.assertEqual(f.line(2), 'second\r\n')
+        self.assertEqual(f.line(4), 'last')
+
+        self.assertTrue(common.FileAtIndex(b'\x89PNG\0', 5, '', '', 'A', 'test.png').binary, "Binary not detected.")
+
+    def test_parse_raw_diff(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        old_sha1 = '1' * 40
+        new_sha1 = '2' * 40
+        out = (':100644 100644 %s %s M\0dir/a.cpp\0'
+               ':000000 100755 %s %s A\0b.sh\0'
+               ':100644 100644 %s %s R087\0old.hpp\0new.hpp\0') % ((old_sha1, new_sha1) * 3)
+
+        # Records are split at arbitrary places in the stream
+        stream = io.BufferedReader(io.BytesIO(out.encode()), buffer_size=7)
+        entries = list(common._parse_raw_diff(common._read_records(stream)))
+
+        self.assertEqual(entries, [
+            common.DiffEntry('100644', '100644', old_sha1, new_sha1, 'M', 'dir/a.cpp', 'dir/a.cpp'),
+            common.DiffEntry('000000', '100755', old_sha1, new_sha1, 'A', 'b.sh', 'b.sh'),
+            common.DiffEntry('100644', '100644', old_sha1, new_sha1, 'R', 'new.hpp', 'old.hpp'),
+        ])
+
+    def test_parse_hunks(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        out = [b'diff --git a.cpp a.cpp\n', b'--- a.cpp\n', b'+++ a.cpp\n',
+               b'@@ -2,0 +3 @@ int b;\n', b'+y\n',
+               b'@@ -10,2 +11,3 @@\n', b'-old\n', b'\\ No newline at end of file\n', b'-old\n',
+               b'+++ looks like a header\n', b'+new\n', b'+new\n',
+               b'@@ -20 +21,0 @@\n', b'-removed\n',
+               b'diff --git "dir/\\303\\251t\\303\\251.cpp" "dir/\\303\\251t\\303\\251.cpp"\n',
+               b'--- /dev/null\n', b'+++ "dir/\\303\\251t\\303\\251.cpp"\n', b'@@ -0,0 +1,2 @@\n', b'+a\n', b'+b\n',
+               b'diff --git a b.cpp a b.cpp\n', b'--- a b.cpp\t\n', b'+++ a b.cpp\t\n', b'@@ -1,0 +2 @@ a\n', b'+\tb\n',
+               b'diff --git gone.cpp gone.cpp\n', b'--- gone.cpp\n', b'+++ /dev/null\n', b'@@ -1 +0,0 @@\n',
+               b'-a\n']
+
+        self.assertEqual(common._parse_hunks(out), {
+            'a.cpp': [(3, 3), (11, 13)],
+            'dir/\u00e9t\u00e9.cpp': [(1, 2)],
+            'a b.cpp': [(2, 2)],
+        })
+
+    def test_changed_line(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        f = common.FileAtIndex(b'1\n2\n3\n4\n5\n6', 11, '', '', 'M', 'test.cpp')
+        self.assertTrue(all(f.changed_line(n) for n in range(1, 7)), "All lines are checked by default.")
+        self.assertEqual(f.regions(), [(0, 11)])
+
+        f.changed = [(2, 3), (6, 6)]
+        self.assertEqual([n for n in range(1, 7) if f.changed_line(n)], [2, 3, 6])
+        self.assertEqual([f.text[start:end] for start, end in f.regions()], ['2\n3\n', '6'])
+
+        f.changed = []
+        self.assertFalse(f.changed_line(1), "No line is changed.")
+        self.assertEqual(f.regions(), [])
+
+    def test_exact_renames(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        null = '0' * 40
+        a = 'a' * 40
+        b = 'b' * 40
+        entries = [
+            common.DiffEntry('100644', '000000', a, null, 'D', 'old.hpp', 'old.hpp'),
+            common.DiffEntry('000000', '100644', null, a, 'A', 'new.hpp', 'new.hpp'),
+            common.DiffEntry('000000', '100644', null, a, 'A', 'copy.hpp', 'copy.hpp'),
+            common.DiffEntry('100644', '000000', b, null, 'D', 'removed.hpp', 'removed.hpp'),
+        ]
+
+        self.assertEqual(common._exact_renames(entries), [
+            common.DiffEntry('100644', '100644', a, a, 'R', 'new.hpp', 'old.hpp'),
+            entries[2],
+            entries[3],
+        ])
+
+        # Pure renames are skipped, modified ones are checked as modifications
+        checked = list(common._checked_entries([
+            common.DiffEntry('100644', '100644', a, a, 'R', 'new.hpp', 'old.hpp'),
+            common.DiffEntry('100644', '100644', a, b, 'R', 'moved.hpp', 'other.hpp'),
+        ]))
+        self.assertEqual(checked, [common.DiffEntry('100644', '100644', a, b, 'M', 'moved.hpp', 'other.hpp')])
+
+    def test_classify_binary(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        repo = tempfile.mkdtemp()
+        cwd = os.getcwd()
+
+        try:
+            common.execute_command('git init -q ' + repo)
+            with open(os.path.join(repo, '.gitattributes'), 'w') as attributes_file:
+                attributes_file.write('*.png binary\n*.dat -diff\n*.txt text\n')
+
+            def load():
+                raise AssertionError('Contents should not be read.')
+
+            files = [common.FileAtIndex(None, 10, '', '', 'A', name, loader=load)
+                     for name in ('a.png', 'b.dat', 'dir/c.txt')]
+            files.append(common.FileAtIndex(b'x' * common.BINARY_SNIFF_SIZE + b'\0', 10, '', '', 'A', 'd.cpp'))
+
+            os.chdir(repo)
+            common.classify_binary(files)
+
+            self.assertEqual([f.binary for f in files], [True, True, False, False], "Wrong binary flags.")
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(repo)
+
+    def test_files_pushed(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        repo = tempfile.mkdtemp()
+        cwd = os.getcwd()
+
+        def commit(contents, message):
+            for name, content in contents.items():
+                with open(os.path.join(repo, name), 'w') as source_file:
+                    source_file.write(content)
+            common.execute_command('git -C ' + repo + ' add -A')
+            common.execute_command('git -C ' + repo + ' -c user.name=a -c user.email=a@b.c commit -q -m ' + message)
+            return common.execute_command('git -C ' + repo + ' rev-parse HEAD').out.decode().strip()
+
+        try:
+            common.execute_command('git init -q ' + repo)
+            first = commit({'a.cpp': 'int a;\n'}, 'first')
+            commit({'a.cpp': 'int b;\n', 'b.cpp': 'int b;\n'}, 'second')
+            second = commit({'a.cpp': 'int c;\n', 'c.cpp': 'int b;\n', 'empty.cpp': ''}, 'third')
+
+            # Links have nothing to check
+            os.symlink('a.cpp', os.path.join(repo, 'link.cpp'))
+            os.chmod(os.path.join(repo, 'b.cpp'), 0o755)
+            second = commit({}, 'fourth')
+
+            # The pushed commits are not reachable from any ref yet
+            common.execute_command('git -C ' + repo + ' update-ref refs/heads/master ' + first)
+            os.chdir(repo)
+
+            null = '0' * 40
+            pushed = common.pushed_revisions(['%s %s refs/heads/master\n' % (first, second),
+                                              '%s %s refs/heads/other\n' % (null, second),
+                                              '%s %s refs/heads/deleted\n' % (first, null)])
+            self.assertEqual(pushed, [second], "Deleted refs and repeated revisions should be ignored.")
+
+            files = list(common.files_pushed(pushed))
+            self.assertEqual(sorted(f.contents for f in files), [b'int b;\n', b'int c;\n'],
+                             "Each new blob should be listed once, the empty and already pushed ones not at all.")
+            self.assertEqual(sorted((f.path, f.mode) for f in files), [('a.cpp', '100644'), ('b.cpp', '100755')],
+                             "Blobs should have the mode of their first path.")
+
+            # Objects which cannot be listed must not be taken as nothing to check
+            with common.capture():
+                self.assertIsNone(common.files_pushed(['0123456789' * 4]))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(repo)
+
+    def test_deleted_files(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        repo = tempfile.mkdtemp()
+        cwd = os.getcwd()
+
+        def write(name, content):
+            with open(os.path.join(repo, name), 'w') as source_file:
+                source_file.write(content)
+
+        try:
+            common.execute_command('git init -q ' + repo)
+            for name in ('kept.cpp', 'modified.cpp', 'removed.cpp', 'staged.cpp'):
+                write(name, 'int a;\n')
+            common.execute_command('git -C ' + repo + ' add -A')
+            common.execute_command('git -C ' + repo + ' -c user.name=a -c user.email=a@b.c commit -q -m first')
+
+            # Added or modified then deleted from the working tree, still committed
+            write('added.cpp', 'int c;\n')
+            write('modified.cpp', 'int b;\n')
+            common.execute_command('git -C ' + repo + ' add -A')
+            os.remove(os.path.join(repo, 'added.cpp'))
+            os.remove(os.path.join(repo, 'modified.cpp'))
+            os.remove(os.path.join(repo, 'removed.cpp'))
+            common.execute_command('git -C ' + repo + ' rm -q staged.cpp')
+            os.chdir(repo)
+
+            for backend in ('in-process', 'git'):
+                common.forget_run_state()
+                if backend == 'git':
+                    common.g_git_repositories[common.repo_context().git_dir] = None
+                else:
+                    self.assertIsNotNone(common.git_repository())
+
+                deleted = common._deleted_files()
+                self.assertEqual([name for name in ('added.cpp', 'kept.cpp', 'modified.cpp', 'removed.cpp',
+                                                    'staged.cpp') if deleted(name)], ['removed.cpp', 'staged.cpp'],
+                                 "Only the files deleted from the index or unchanged in it should be skipped with "
+                                 "the " + backend + " backend.")
+        finally:
+            common.g_git_repositories.pop(common.repo_context().git_dir, None)
+            common.forget_run_state()
+            os.chdir(cwd)
+            shutil.rmtree(repo)
+
+    def test_files_in_rev_deleted_later(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        repo = tempfile.mkdtemp()
+        cwd = os.getcwd()
+
+        def commit(message):
+            common.execute_command('git -C ' + repo + ' add -A')
+            common.execute_command('git -C ' + repo + ' -c user.name=a -c user.email=a@b.c commit -q -m ' + message)
+            return common.execute_command('git -C ' + repo + ' rev-parse HEAD').out.decode().strip()
+
+        try:
+            common.execute_command('git init -q ' + repo)
+            with open(os.path.join(repo, 'kept.cpp'), 'w') as source_file:
+                source_file.write('int a;\n')
+            first = commit('first')
+            with open(os.path.join(repo, 'later.cpp'), 'w') as source_file:
+                source_file.write('int\tb;\n')
+            second = commit('second')
+
+            # Removed by a commit after the checked range
+            os.remove(os.path.join(repo, 'later.cpp'))
+            commit('third')
+            os.chdir(repo)
+
+            for backend in ('in-process', 'git'):
+                common.forget_run_state()
+                if backend == 'git':
+                    common.g_git_repositories[common.repo_context().git_dir] = None
+
+                self.assertEqual([f.path for f in common.files_in_rev(first, second)], ['later.cpp'],
+                                 "Files deleted after the checked range should be checked with the " + backend +
+                                 " backend.")
+        finally:
+            common.g_git_repositories.pop(common.repo_context().git_dir, None)
+            common.forget_run_state()
+            os.chdir(cwd)
+            shutil.rmtree(repo)
+
+    def test_prefetcher(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        loaded = []
+        consumed = []
+
+        def load(i):
+            loaded.append(i)
+            return b'x' * 10
+
+        files = [common.FileAtIndex(None, 10, '', '', 'A', str(i), loader=functools.partial(load, i))
+                 for i in range(10)]
+
+        # Only two files fit in the budget
+        for f in common.Prefetcher(files, 25):
+            self.assertEqual(f.contents, b'x' * 10, "File should be loaded before being consumed.")
+            consumed.append(int(f.path))
+            self.assertLessEqual(len(loaded) - len(consumed), 2, "Too many files loaded ahead.")
+
+        self.assertEqual(consumed, list(range(10)), "Files should be consumed in order.")
+        self.assertEqual(loaded, list(range(10)), "Files should be loaded once.")
+        self.assertTrue(all(f._buffer is None for f in files), "Consumed files should be released.")
+
+        # Stopping early releases the files loaded ahead
+        for f in common.Prefetcher(files, 1000):
+            break
+        self.assertTrue(all(f._buffer is None for f in files), "Files loaded ahead should be released.")
+
+
+if __name__ == '__main__':
+    unittest.main()
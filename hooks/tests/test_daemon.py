@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import daemon
+
+SHELDON = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'sheldon')
+
+
+def git(repo, *args):
+    return subprocess.check_output(['git', '-C', repo] + list(args))
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        git(self.repo, 'init', '-q')
+        git(self.repo, 'config', 'fw4spl-hooks.hooks', 'tab crlf')
+
+        with open(os.path.join(self.repo, 'file.cpp'), 'w') as content_file:
+            content_file.write('int\ta;\n')
+        git(self.repo, 'add', 'file.cpp')
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def sheldon(self, *args, env=None):
+        process = subprocess.run([sys.executable, SHELDON, '--no-cache'] + list(args), cwd=self.repo,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 env=dict(os.environ, **env) if env else None)
+        return process.returncode, process.stdout
+
+    def test_socket_path(self):
+        self.assertEqual(daemon.socket_path('/repo/.git'), '/repo/.git/sheldon/daemon.sock')
+
+        # Too long for a unix socket
+        path = daemon.socket_path('/' + 'a' * 200 + '/.git')
+        self.assertEqual(os.path.dirname(path), os.path.join(tempfile.gettempdir(), 'sheldon-%d' % os.getuid()),
+                         "Long paths should be replaced by a path in a directory of the user.")
+        self.assertEqual(path, daemon.socket_path('/' + 'a' * 200 + '/.git'), "Socket path should be stable.")
+
+    def test_forward(self):
+        expected = self.sheldon('--no-daemon')
+        self.assertEqual(expected[0], 1, "Tab should be detected.")
+
+        # No daemon, the check is run by the client
+        self.assertEqual(self.sheldon(), expected, "Output differs without daemon.")
+
+        server = subprocess.Popen([sys.executable, SHELDON, '--daemon'], cwd=self.repo,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        socket_path = daemon.socket_path(os.path.join(os.path.realpath(self.repo), '.git'))
+
+        try:
+            for _ in range(100):
+                if os.path.exists(socket_path):
+                    break
+                time.sleep(0.1)
+
+            self.assertEqual(self.sheldon(), expected, "Output differs with the daemon.")
+
+            # Only the user can reach the daemon
+            self.assertEqual(stat.S_IMODE(os.stat(socket_path).st_mode), 0o600, "Socket should be private.")
+            self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(socket_path)).st_mode), 0o700,
+                             "Directory of the socket should be private.")
+
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(socket_path)
+            try:
+                self.assertTrue(daemon.Daemon._same_user(client), "The user of the daemon should be accepted.")
+            finally:
+                client.close()
+
+            # The configuration is read again when it changes
+            git(self.repo, 'config', 'fw4spl-hooks.hooks', 'crlf')
+            self.assertEqual(self.sheldon(), self.sheldon('--no-daemon'), "Configuration change was not seen.")
+            self.assertEqual(self.sheldon()[0], 0, "Removed hook should not fail.")
+
+            # Like 'git -c fw4spl-hooks.hooks=tab sheldon', the configuration of the client is used
+            env = {'GIT_CONFIG_PARAMETERS': "'fw4spl-hooks.hooks'='tab'"}
+            self.assertEqual(self.sheldon(env=env), self.sheldon('--no-daemon', env=env),
+                             "Configuration of the client was not used.")
+            self.assertEqual(self.sheldon()[0], 0, "Configuration of the client should not be kept.")
+        finally:
+            server.terminate()
+            server.wait()
+
+        self.assertFalse(os.path.exists(socket_path), "Socket should be removed when the daemon stops.")
+
+    def test_untrusted_socket(self):
+        directory = os.path.join(self.repo, '.git', 'sheldon')
+        os.makedirs(directory)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(os.path.join(directory, 'daemon.sock'))
+        listener.listen(1)
+
+        try:
+            # Anyone could have replaced the socket
+            os.chmod(directory, 0o777)
+            cwd = os.getcwd()
+            os.chdir(self.repo)
+            try:
+                with open(os.devnull, 'w') as null:
+                    stderr, sys.stderr = sys.stderr, null
+                    try:
+                        self.assertIsNone(daemon.forward([]), "Request should not be sent to an untrusted socket.")
+                    finally:
+                        sys.stderr = stderr
+            finally:
+                os.chdir(cwd)
+
+            listener.settimeout(0)
+            self.assertRaises(OSError, listener.accept)
+        finally:
+            listener.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
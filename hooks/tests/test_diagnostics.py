@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+import diagnostics
+import forbidtoken
+
+
+class TestDiagnostics(unittest.TestCase):
+    def setUp(self):
+        self.records = [
+            common.Diagnostic('tab', 'src/a.cpp', 3, 'error', 'TAB', False),
+            common.Diagnostic('codingstyle', 'src/b.hpp', None, 'error', 'Licence year is not up-to-date', True),
+            common.Diagnostic('check_commit', None, None, 'error', "Commit 'abc' has anonymous author", False),
+        ]
+
+    def write(self, output_format, stream=None, records=None, shard=None, completed=True):
+        stream = stream or io.StringIO()
+        writer = diagnostics.open_writer(output_format, stream, shard)
+        for record in self.records if records is None else records:
+            writer.write(record)
+        writer.completed = completed
+        writer.close()
+        return stream.getvalue() if isinstance(stream, io.StringIO) else None
+
+    def test_hook_diagnostics(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        files = common.file_on_disk(dir_path + '/data/forbidtoken_tab.cpp')
+
+        with common.capture() as messages:
+            self.assertTrue(forbidtoken.forbidtoken(files, 'tab'), "tab were not detected in test file.")
+
+        records = [common.Diagnostic(*line) for level, line in messages if level == 'diagnostic']
+        self.assertTrue(records, "No diagnostic reported.")
+        for record in records:
+            self.assertEqual((record.hook, record.severity, record.fix), ('tab', 'error', False))
+            self.assertTrue(record.path.endswith('forbidtoken_tab.cpp'), "Wrong path.")
+            self.assertIsInstance(record.line, int, "Line should be known.")
+
+        # Diagnostics are written to the structured output only
+        stream = io.StringIO()
+        common.g_diagnostics = diagnostics.open_writer('json', stream)
+        try:
+            common.replay(messages)
+        finally:
+            common.g_diagnostics = None
+        self.assertEqual(len(stream.getvalue().splitlines()), len(records) + 1, "Diagnostics were not written.")
+
+    def test_json_lines(self):
+        lines = self.write('json', shard=(1, 2)).splitlines()
+
+        # The run is written as interrupted first, in case it does not reach its end
+        self.assertEqual(json.loads(lines[0]), {'run': {'shard': [1, 2], 'completed': False}})
+        self.assertEqual(json.loads(lines[-1]), {'run': {'shard': [1, 2], 'completed': True}})
+        self.assertEqual([common.Diagnostic(**json.loads(line)) for line in lines[1:-1]], self.records)
+
+    def test_sarif(self):
+        log = json.loads(self.write('sarif'))
+
+        self.assertEqual(log['version'], '2.1.0')
+        run = log['runs'][0]
+        self.assertEqual([rule['id'] for rule in run['tool']['driver']['rules']],
+                         ['tab', 'codingstyle', 'check_commit'])
+        self.assertEqual(run['properties'], {'shard': None, 'completed': True})
+
+        results = run['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['locations'][0]['physicalLocation'],
+                         {'artifactLocation': {'uri': 'src/a.cpp'}, 'region': {'startLine': 3}})
+        self.assertNotIn('region', results[1]['locations'][0]['physicalLocation'], "Line is not known.")
+        self.assertTrue(results[1]['properties']['fixAvailable'])
+        self.assertNotIn('locations', results[2], "Commit problems have no location.")
+
+    def test_merge_results(self):
+        directory = tempfile.mkdtemp()
+        try:
+            paths = []
+            for index, (output_format, records) in enumerate([('sarif', self.records[:2]), ('sarif', self.records[2:]),
+                                                              ('json', self.records[2:])]):
+                paths.append(os.path.join(directory, 'shard%d' % index))
+                with open(paths[-1], 'w') as output_file:
+                    self.write(output_format, output_file, records, (index + 1, 2) if index < 2 else None)
+
+            self.assertEqual(diagnostics.read(paths[0]), (self.records[:2], [((1, 2), True)]))
+            self.assertEqual(diagnostics.read(paths[2]), (self.records[2:], [(None, True)]))
+
+            merged_path = os.path.join(directory, 'merged')
+            with common.capture():
+                self.assertEqual(diagnostics.merge_results(paths + ['--output-format', 'json', '--output-file',
+                                                                    merged_path]), 1, "Errors should fail.")
+                self.assertEqual(diagnostics.merge_results(paths[:1] + ['--output-file', merged_path]), 1,
+                                 "Missing shard should fail.")
+
+                # JSON lines tell their shard too, and a shard which did not check everything is not a success
+                for output_format in sorted(diagnostics.WRITERS):
+                    for shard, completed in [((1, 2), True), ((2, 2), False), ((3, 3), True)]:
+                        with open(os.path.join(directory, 'run%d' % shard[0]), 'w') as output_file:
+                            self.write(output_format, output_file, [], shard, completed)
+                    shard_paths = [os.path.join(directory, 'run%d' % index) for index in (1, 2, 3)]
+
+                    self.assertEqual(diagnostics.merge_results(shard_paths[:2] + ['--output-file', merged_path]), 1,
+                                     "Interrupted shard should fail.")
+                    self.assertEqual(diagnostics.merge_results(shard_paths[::2] + ['--output-file', merged_path]), 1,
+                                     "Missing shard should fail.")
+                    self.assertEqual(diagnostics.merge_results(shard_paths[:1] + ['--output-file', merged_path]), 1,
+                                     "Missing shard should fail.")
+
+                    with open(shard_paths[1], 'w') as output_file:
+                        self.write(output_format, output_file, [], (2, 2))
+                    self.assertEqual(diagnostics.merge_results(shard_paths[:2] + ['--output-file', merged_path]), 0,
+                                     "Complete shards without error should succeed.")
+
+                # Nothing tells a file without the record of its run was checked to its end
+                with open(merged_path, 'w') as output_file:
+                    output_file.write(json.dumps(self.records[0]._asdict()) + '\n')
+                self.assertEqual(diagnostics.merge_results([merged_path]), 1, "Unknown run should fail.")
+
+                # The problem of the commit is only reported once
+                diagnostics.merge_results(paths + ['--output-format', 'json', '--output-file', merged_path])
+            self.assertEqual(diagnostics.read(merged_path)[0], [self.records[2], self.records[0], self.records[1]])
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(diagnostics.missing_shards([(2, 2), (1, 2)]), None)
+        self.assertIsNotNone(diagnostics.missing_shards([(1, 2), (1, 2)]), "Repeated shard should be reported.")
+        self.assertIsNotNone(diagnostics.missing_shards([(1, 2), (2, 3)]), "Different shard counts.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -247,6 +247,24 @@ class TestForbidtoken(unittest.TestCase):
         # Check result
         self.assertTrue(result, "copain were not detected in test file.")
 
+    def test_tab_on_changed_lines(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        # Load the test file, which has a TAB on line 5
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        file = list(common.file_on_disk(dir_path + '/data/forbidtoken_tab.cpp'))
+
+        # Apply the hook on other lines only
+        file[0].changed = [(1, 4), (6, 7)]
+        self.assertFalse(forbidtoken.forbidtoken(file, 'tab'), "TAB outside of the changed lines was detected.")
+
+        # Then with the line
+        file[0].changed = [(5, 5)]
+        with common.capture() as messages:
+            self.assertTrue(forbidtoken.forbidtoken(file, 'tab'), "TAB on a changed line was not detected.")
+        self.assertEqual([line[2] for level, line in messages if level == 'diagnostic'], [5])
+
 
 if __name__ == '__main__':
     unittest.main()
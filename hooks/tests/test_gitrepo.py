@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import gitrepo
+
+
+def git(repo, *args):
+    env = dict(os.environ, GIT_AUTHOR_NAME='sheldon', GIT_AUTHOR_EMAIL='sheldon@localhost',
+               GIT_COMMITTER_NAME='sheldon', GIT_COMMITTER_EMAIL='sheldon@localhost')
+    return subprocess.check_output(['git', '-C', repo] + list(args), env=env)
+
+
+class TestGitRepo(unittest.TestCase):
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        git(self.repo, 'init', '-q')
+
+        # Enough similar content for the packed objects to be stored as deltas
+        lines = ['line %d of a file which is slightly modified in each commit' % i for i in range(200)]
+        os.mkdir(os.path.join(self.repo, 'dir'))
+
+        for i in range(3):
+            lines[i * 10] = 'changed in commit %d' % i
+            with open(os.path.join(self.repo, 'dir', 'file.txt'), 'w') as content_file:
+                content_file.write('\n'.join(lines))
+            with open(os.path.join(self.repo, 'other_%d.txt' % i), 'w') as content_file:
+                content_file.write(str(i))
+            git(self.repo, 'add', '-A')
+            git(self.repo, 'commit', '-q', '-m', 'commit %d' % i)
+
+        git(self.repo, 'tag', '-a', '-m', 'tag', 'annotated')
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def check_objects(self, repository):
+        for line in git(self.repo, 'rev-list', '--objects', '--all').decode().splitlines():
+            sha = line.split(' ')[0]
+            obj_type = git(self.repo, 'cat-file', '-t', sha).decode().strip()
+            expected = git(self.repo, 'cat-file', obj_type, sha)
+
+            read_type, data = repository.read_object(sha)
+            self.assertEqual(gitrepo.TYPE_NAMES[read_type], obj_type, "Wrong object type.")
+            self.assertEqual(data, expected, "Wrong object content.")
+            self.assertEqual(repository.object_size(sha), len(expected), "Wrong object size.")
+
+    def test_loose_and_packed_objects(self):
+        git_dir = os.path.join(self.repo, '.git')
+        self.check_objects(gitrepo.Repository(git_dir))
+
+        git(self.repo, 'gc', '-q', '--aggressive')
+        self.check_objects(gitrepo.Repository(git_dir))
+
+    def test_resolve(self):
+        repository = gitrepo.Repository(os.path.join(self.repo, '.git'))
+
+        for rev in ('HEAD', 'HEAD~1', 'HEAD^', 'HEAD~2', 'annotated', 'annotated^1', 'master', 'refs/heads/master'):
+            try:
+                expected = git(self.repo, 'rev-parse', '-q', '--verify', rev + '^{commit}').decode().strip()
+            except subprocess.CalledProcessError:
+                continue
+            self.assertEqual(repository.resolve(rev), expected, "Wrong commit for " + rev)
+
+        head = repository.resolve('HEAD')
+        self.assertEqual(repository.resolve(head[:8]), head, "Abbreviated sha should be resolved.")
+
+        # Packed refs
+        git(self.repo, 'pack-refs', '--all')
+        self.assertEqual(repository.resolve('annotated'), head, "Packed tag should be resolved.")
+
+        with self.assertRaises(gitrepo.GitError):
+            repository.resolve('HEAD@{1}')
+
+        # Refs written by fetch have the branch and the remote after the sha
+        with open(os.path.join(self.repo, '.git', 'FETCH_HEAD'), 'w') as fetch_head:
+            fetch_head.write(head + "\t\tbranch 'master' of /remote\n")
+        self.assertEqual(repository.resolve('FETCH_HEAD'), head, "FETCH_HEAD should be resolved.")
+
+        with open(os.path.join(self.repo, '.git', 'FETCH_HEAD'), 'w') as fetch_head:
+            fetch_head.write('not a sha\n')
+        with self.assertRaises(gitrepo.GitError):
+            repository.resolve('FETCH_HEAD')
+
+    def test_index_and_diff(self):
+        with open(os.path.join(self.repo, 'other_0.txt'), 'w') as content_file:
+            content_file.write('staged')
+        with open(os.path.join(self.repo, 'dir', 'new.txt'), 'w') as content_file:
+            content_file.write('new')
+        git(self.repo, 'add', '-A')
+
+        repository = gitrepo.Repository(os.path.join(self.repo, '.git'))
+
+        expected = git(self.repo, 'ls-files', '-s').decode().splitlines()
+        entries = ['%06o %s %d\t%s' % (e.mode, e.sha1, e.stage, e.path) for e in repository.read_index()]
+        self.assertEqual(entries, expected, "Wrong index entries.")
+
+        def raw(diff):
+            return [':%s %s %s %s %s\t%s' % entry[:6] for entry in diff]
+
+        expected = git(self.repo, 'diff-index', '--cached', '--no-abbrev', 'HEAD').decode().splitlines()
+        self.assertEqual(raw(repository.diff_index('HEAD')), expected, "Wrong staged changes.")
+
+        expected = git(self.repo, 'diff', '--raw', '--no-abbrev', 'HEAD~2', 'HEAD').decode().splitlines()
+        diff = repository.diff_trees(repository.tree_of('HEAD~2'), repository.tree_of('HEAD'))
+        self.assertEqual(raw(diff), expected, "Wrong changes between commits.")
+
+    def test_index_file(self):
+        # 'git commit -a' gives its hooks another index, with the modified files added
+        with open(os.path.join(self.repo, 'other_1.txt'), 'w') as content_file:
+            content_file.write('committed with -a')
+
+        index_file = os.path.join(self.repo, '.git', 'index.lock')
+        shutil.copy(os.path.join(self.repo, '.git', 'index'), index_file)
+        environment = dict(os.environ, GIT_INDEX_FILE=index_file)
+        subprocess.check_call(['git', '-C', self.repo, 'add', '-u'], env=environment)
+        expected = subprocess.check_output(['git', '-C', self.repo, 'ls-files', '-s'], env=environment)
+
+        repository = gitrepo.Repository(os.path.join(self.repo, '.git'))
+        default_entries = repository.read_index()
+
+        os.environ['GIT_INDEX_FILE'] = index_file
+        try:
+            entries = ['%06o %s %d\t%s' % (e.mode, e.sha1, e.stage, e.path) for e in repository.read_index()]
+        finally:
+            del os.environ['GIT_INDEX_FILE']
+
+        self.assertEqual(entries, expected.decode().splitlines(), "The index of GIT_INDEX_FILE should be read.")
+        self.assertEqual(repository.read_index(), default_entries, "The default index should be read again.")
+
+        # The repository moved by the environment is only found by git
+        os.environ['GIT_OBJECT_DIRECTORY'] = os.path.join(self.repo, '.git', 'objects')
+        try:
+            self.assertIsNone(gitrepo.discover(self.repo))
+        finally:
+            del os.environ['GIT_OBJECT_DIRECTORY']
+
+    def test_tree_entry(self):
+        repository = gitrepo.Repository(os.path.join(self.repo, '.git'))
+        tree = repository.tree_of('HEAD')
+
+        expected = git(self.repo, 'rev-parse', 'HEAD:dir/file.txt').decode().strip()
+        self.assertEqual(repository.tree_entry(tree, 'dir/file.txt'), (0o100644, expected), "Wrong tree entry.")
+        self.assertIsNone(repository.tree_entry(tree, 'dir/missing.txt'), "Missing file should not be found.")
+        self.assertIsNone(repository.tree_entry(tree, 'other_0.txt/file.txt'), "A file has no entries.")
+
+    def test_discover(self):
+        os.makedirs(os.path.join(self.repo, 'dir', 'sub'))
+        root, git_dir, common_dir = gitrepo.discover(os.path.join(self.repo, 'dir', 'sub'))
+
+        self.assertEqual(root, os.path.realpath(self.repo), "Wrong repository root.")
+        self.assertEqual(git_dir, common_dir, "A main worktree has no separate common directory.")
+
+        # Linked worktree
+        worktree = os.path.join(self.repo, 'worktree')
+        git(self.repo, 'worktree', 'add', '-q', worktree, 'HEAD~1')
+        root, git_dir, common_dir = gitrepo.discover(worktree)
+
+        self.assertEqual(root, os.path.realpath(worktree), "Wrong worktree root.")
+        self.assertEqual(common_dir, os.path.realpath(os.path.join(self.repo, '.git')), "Wrong common directory.")
+
+        repository = gitrepo.Repository(git_dir, common_dir)
+        self.assertEqual(repository.resolve('HEAD'), git(worktree, 'rev-parse', 'HEAD').decode().strip(),
+                         "Worktree HEAD should be its own.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SHELDON = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'sheldon')
+
+# Cumulative import time allowed for the commit-msg hook, in microseconds, sources being compiled if needed
+COMMIT_MSG_BUDGET = 150000
+
+
+# Runs sheldon like its script, then lists the loaded modules, importlib.import_module not being timed by importtime
+RUN_SHELDON = """
+import atexit, runpy, sys
+atexit.register(lambda: sys.stderr.write('modules: ' + ' '.join(sys.modules) + '\\n'))
+sys.argv = sys.argv[1:]
+sys.path.insert(0, sys.argv[0].rpartition('/')[0])
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+
+def imports(cwd, *args):
+    """return the modules imported by sheldon, and the import time of those imported with import statements, in
+    microseconds"""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', RUN_SHELDON, SHELDON] + list(args), cwd=cwd,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    modules = set()
+    times = {}
+    for line in process.stderr.decode().splitlines():
+        if line.startswith('modules: '):
+            modules.update(line.split()[1:])
+        elif line.startswith('import time:') and not line.endswith('imported package'):
+            self_time, cumulative, name = line[len('import time:'):].split('|')
+            times[name.strip()] = int(cumulative)
+    return modules, times
+
+
+class TestImportTime(unittest.TestCase):
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        subprocess.check_output(['git', 'init', '-q', self.repo])
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def test_commit_msg(self):
+        message_path = os.path.join(self.repo, 'COMMIT_EDITMSG')
+        with open(message_path, 'w') as message_file:
+            message_file.write('feat(hooks): check faster\n')
+
+        modules, times = imports(self.repo, '--commit-message-file', message_path)
+
+        self.assertIn('check_commit', modules, "Commit message should be checked.")
+        for name in ('daemon', 'argparse', 'cache', 'codingstyle', 'cppcheck', 'sortincludes', 'check_xml',
+                     'forbidtoken', 'filesize', 'concurrent.futures', 'sqlite3', 'hashlib', 'tempfile'):
+            self.assertNotIn(name, modules, name + " should not be imported to check a commit message.")
+
+        # -X importtime only exists since python 3.7
+        if sys.version_info >= (3, 7):
+            self.assertLess(times['check_commit'], COMMIT_MSG_BUDGET, "Checking a commit message imports too much.")
+
+    def test_enabled_hooks(self):
+        subprocess.check_output(['git', '-C', self.repo, 'config', 'fw4spl-hooks.hooks', 'tab crlf'])
+        with open(os.path.join(self.repo, 'file.cpp'), 'w') as content_file:
+            content_file.write('int a;\n')
+        subprocess.check_output(['git', '-C', self.repo, 'add', 'file.cpp'])
+
+        modules, times = imports(self.repo, '--no-daemon', '--no-cache')
+
+        self.assertIn('forbidtoken', modules, "Enabled hooks should be imported.")
+        for name in ('cache', 'codingstyle', 'cppcheck', 'sortincludes', 'check_xml', 'check_commit', 'filesize',
+                     'concurrent.futures', 'sqlite3', 'xml.etree.ElementTree'):
+            self.assertNotIn(name, modules, name + " should not be imported when it is not used.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import unittest
+
+import common
+import forbidtoken
+import profiling
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.popen = subprocess.Popen
+        profiling.enable(2)
+
+    def tearDown(self):
+        subprocess.Popen = self.popen
+        profiling.g_profile = None
+        profiling.tracemalloc.stop()
+
+    def test_command_name(self):
+        self.assertEqual(profiling.command_name(['git', '-C', '/repo', 'cat-file', '--batch']), 'git cat-file')
+        self.assertEqual(profiling.command_name(['git', '-c', 'core.quotepath=off', 'diff']), 'git diff')
+        self.assertEqual(profiling.command_name('/usr/bin/uncrustify -c cfg'), 'uncrustify')
+
+    def test_commands(self):
+        usage = profiling.Usage()
+        subprocess.check_output(['git', 'version'])
+        subprocess.run(['git', 'version'], stdout=subprocess.DEVNULL)
+        wall, cpu, commands = usage.stop()
+
+        self.assertEqual(commands['git version'][0], 2, "Commands should be counted once each.")
+        self.assertEqual(profiling.g_profile.commands['git version'][0], 2)
+        self.assertGreaterEqual(wall, commands['git version'][1], "Commands run during the usage.")
+
+    def test_report(self):
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        files = common.file_on_disk(dir_path + '/data/forbidtoken_tab.cpp')
+
+        with common.capture():
+            with profiling.hook('tab'):
+                forbidtoken.forbidtoken(profiling.files('tab', files), 'tab')
+
+        profile = profiling.g_profile
+        profile.cached('tab', True)
+        profile.cached('tab', False)
+        profile.remote('crlf', 'a.cpp', (0.5, 0.25, {'uncrustify': (3, 0.2)}))
+        profile.remote('crlf', 'b.cpp', (0.1, 0.05, {}))
+        profile.remote('crlf', 'c.cpp', (0.2, 0.05, {}))
+
+        self.assertEqual(list(profile.hooks), ['tab', 'crlf'])
+        self.assertEqual(profile.hooks['crlf'], [0.0, 0.35], "Worker CPU time should be added to the hook.")
+        self.assertEqual(profile.commands['uncrustify'], (3, 0.2))
+
+        with common.capture() as messages:
+            profile.report()
+
+        lines = [line.replace('* [Sheldon] ', '', 1) for level, line in messages]
+        self.assertTrue(any(line.split()[:1] == ['tab'] and line.endswith('1/2') for line in lines),
+                        "Cache hits should be reported.")
+        self.assertTrue(any('Peak memory' in line for line in lines), "Peak memory should be reported.")
+
+        # Only the slowest files are listed
+        slowest = lines[lines.index('  Slowest files:') + 1:]
+        self.assertEqual([line.split()[-1] for line in slowest], ['a.cpp', 'c.cpp'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import common
+import forbidtoken
+import schedule
+
+
+class TestSchedule(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'costs.json')
+        common.forget_run_state()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        common.forget_run_state()
+        schedule.g_fail_fast = False
+        schedule.g_deadline = None
+        schedule.g_interrupted = False
+
+    def test_order(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        scheduler = schedule.Schedule(self.path)
+        names = ['codingstyle', 'cppcheck', 'check_commit', 'tab', 'filesize']
+        self.assertEqual(scheduler.order_hooks(names, 10), ['filesize', 'tab', 'check_commit', 'codingstyle',
+                                                             'cppcheck'])
+
+        # cppcheck is fast with the cached results
+        scheduler.measure('cppcheck', 0.001, 10)
+        scheduler.measure('cppcheck', 0.001, 10)
+        self.assertEqual(scheduler.order_hooks(names, 10)[:2], ['filesize', 'cppcheck'])
+
+        files = [common.FileAtIndex(b'', 0, '', '', 'A', path) for path in ('a.cpp', 'b.cpp', 'c.cpp', 'd.cpp')]
+        scheduler.save(['a.cpp', 'b.cpp', 'c.cpp'], {'c.cpp', 'b.cpp'})
+
+        # Costs and failures are read by the next run
+        scheduler = schedule.Schedule(self.path)
+        self.assertAlmostEqual(scheduler.costs['cppcheck'], 0.0001)
+        self.assertEqual([f.path for f in scheduler.order_files(files)], ['b.cpp', 'c.cpp', 'a.cpp', 'd.cpp'])
+
+        # Files checked without error are not failing anymore, files not checked keep their state
+        scheduler.save(['b.cpp', 'd.cpp'], {'d.cpp'})
+        self.assertEqual(schedule.Schedule(self.path).failures, ['d.cpp', 'c.cpp'])
+
+    def test_shard(self):
+        # Be verbose by default
+        common.g_trace = True
+
+        sizes = [100000, 5000, 5000, 5000, 0, 70000, 300, 300, 1200000, 42]
+        files = [common.FileAtIndex(None, size, '', '', 'A', 'dir/f%d.cpp' % i) for i, size in enumerate(sizes)]
+
+        shards = [schedule.shard(files, index, 3) for index in (1, 2, 3)]
+        self.assertEqual(sorted(f.path for shard in shards for f in shard), sorted(f.path for f in files),
+                         "Each file should be in exactly one shard.")
+        self.assertTrue(all(shards), "Every shard should have files.")
+
+        # Same split in another order, and wherever the files are
+        moved = [common.FileAtIndex(None, f.size, '', '', 'A', '/runner/' + f.path) for f in reversed(files)]
+        moved_shards = [schedule.shard(moved, index, 3, base='/runner') for index in (1, 2, 3)]
+        self.assertEqual([sorted(f.path for f in shard) for shard in moved_shards],
+                         [sorted('/runner/' + f.path for f in shard) for shard in shards])
+
+    def test_until_stopped(self):
+        # Be verbose by default
+        common.g_trace = True
+        schedule.g_fail_fast = True
+
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        files = list(common.file_on_disk(dir_path + '/data/forbidtoken_tab.cpp'))
+        files += list(common.file_on_disk(dir_path + '/data/forbidtoken_lf.cpp'))
+        self.assertEqual(list(schedule.until_stopped(files)), files, "No error reported yet.")
+
+        # The file after the first error is not checked
+        checked = []
+
+        def record(f):
+            checked.append(f)
+            return f
+
+        self.assertTrue(forbidtoken.forbidtoken((record(f) for f in schedule.until_stopped(files)), 'tab'))
+        self.assertEqual(checked, files[:1])
+        self.assertTrue(schedule.failed())
+        self.assertEqual(common.g_failed_paths, set([files[0].path]))
+
+        # Nothing is checked once the time budget is spent, even without error
+        self.assertTrue(schedule.interrupted())
+        common.forget_run_state()
+        schedule.g_fail_fast = False
+        schedule.g_interrupted = False
+        schedule.g_deadline = time.monotonic() - 1
+        self.assertFalse(schedule.interrupted(), "Checks are only skipped when asked if they should be.")
+        self.assertTrue(schedule.stopped())
+        self.assertEqual(list(schedule.until_stopped(files)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()